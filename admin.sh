@@ -59,17 +59,21 @@ case $option in
     3)
         echo ""
         echo "📊 Estadísticas del sistema:"
-        echo "Productos:"
-        curl -s -X GET "http://localhost:8000/products/" \
-             -H "Authorization: Bearer admin_test_data" | python3 -c "import sys, json; data=json.load(sys.stdin); print(f'  Total: {len(data)} productos')"
-        
-        echo "Categorías:"
-        curl -s -X GET "http://localhost:8000/categories/" \
-             -H "Authorization: Bearer admin_test_data" | python3 -c "import sys, json; data=json.load(sys.stdin); print(f'  Total: {len(data)} categorías')"
-        
-        echo "Etiquetas:"
-        curl -s -X GET "http://localhost:8000/tags/" \
-             -H "Authorization: Bearer admin_test_data" | python3 -c "import sys, json; data=json.load(sys.stdin); print(f'  Total: {len(data)} etiquetas')"
+        curl -s -X GET "http://localhost:8000/admin/stats?limit=20" \
+             -H "Authorization: Bearer $ADMIN_TOKEN" | python3 -c "
+import sys, json
+data = json.load(sys.stdin)
+totals = data['totals']
+print(f\"  Productos:  {totals['products']}\")
+print(f\"  Categorías: {totals['categories']}\")
+print(f\"  Etiquetas:  {totals['tags']}\")
+print(f\"  Tokens con datos: {data['tokens_count']}\")
+print(f\"  Imágenes: {data['uploads']['files']} archivos ({data['uploads']['bytes'] / 1048576:.1f} MB)\")
+print(f\"  Base de datos: {data['database_bytes'] / 1048576:.1f} MB\")
+print('  Tokens con más productos:')
+for row in data['tokens']:
+    print(f\"    {(row['token_hash'] or '?')[:16]}: {row['products']} productos, {row['categories']} categorías, {row['tags']} etiquetas\")
+"
         ;;
     4)
         echo "👋 ¡Hasta luego!"
@@ -1,6 +1,7 @@
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from typing import Optional
+import hashlib
 
 security = HTTPBearer()
 
@@ -16,3 +17,7 @@ def get_current_token(credentials: HTTPAuthorizationCredentials = Depends(securi
             headers={"WWW-Authenticate": "Bearer"},
         )
     return credentials.credentials
+
+def hash_token(token: str) -> str:
+    """SHA-256 of the bearer token: the database never stores tokens in clear text."""
+    return hashlib.sha256(token.encode()).hexdigest()
@@ -0,0 +1,169 @@
+import bisect
+import os
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+import database
+import metrics
+
+# Palabras indexadas entre todos los tokens; al superarlo se descartan los índices menos usados
+MAX_ENTRIES = int(os.getenv("AUTOCOMPLETE_MAX_ENTRIES", "500000"))
+MAX_RESULTS = 50
+
+ENTITIES = {"product": database.Product, "category": database.Category, "tag": database.Tag}
+
+
+def normalize(text: str) -> str:
+    """Minúsculas y sin acentos: "Azúcar" y "azu" coinciden."""
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+
+class TitleIndex:
+    """
+    Títulos de productos, categorías y etiquetas de un token, ordenados para buscar por prefijo.
+
+    Cada título se indexa una vez por palabra (desde esa palabra hasta el final), así
+    "azul" encuentra "Queso azul". La búsqueda es un `bisect` sobre la lista ordenada.
+    """
+
+    def __init__(self, version: int, reset_version: int):
+        self.version = version
+        self.reset_version = reset_version
+        self.entries: List[Tuple[str, str, int]] = []  # (texto normalizado, entidad, id)
+        self.titles: Dict[Tuple[str, int], str] = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    @staticmethod
+    def keys(title: str) -> List[str]:
+        words = normalize(title).split()
+        return list(dict.fromkeys(" ".join(words[i:]) for i in range(len(words))))
+
+    def load(self, rows):
+        """Carga inicial: ordena una sola vez en lugar de insertar cada título."""
+        for entity, item_id, title in rows:
+            if title:
+                self.titles[(entity, item_id)] = title
+                self.entries.extend((key, entity, item_id) for key in self.keys(title))
+        self.entries.sort()
+
+    def add(self, entity: str, item_id: int, title: Optional[str]):
+        self.remove(entity, item_id)
+        if not title:
+            return
+        self.titles[(entity, item_id)] = title
+        for key in self.keys(title):
+            bisect.insort(self.entries, (key, entity, item_id))
+
+    def remove(self, entity: str, item_id: int):
+        title = self.titles.pop((entity, item_id), None)
+        if title is None:
+            return
+        for key in self.keys(title):
+            index = bisect.bisect_left(self.entries, (key, entity, item_id))
+            if index < len(self.entries) and self.entries[index] == (key, entity, item_id):
+                del self.entries[index]
+
+    def search(self, query: str, limit: int) -> List[dict]:
+        prefix = " ".join(normalize(query).split())
+        if not prefix:
+            return []
+        results = []
+        seen = set()
+        for position in range(bisect.bisect_left(self.entries, (prefix,)), len(self.entries)):
+            key, entity, item_id = self.entries[position]
+            if not key.startswith(prefix):
+                break
+            if (entity, item_id) in seen:
+                continue
+            seen.add((entity, item_id))
+            results.append({"entity": entity, "id": item_id, "title": self.titles[(entity, item_id)]})
+            if len(results) >= limit:
+                break
+        return results
+
+
+# (archivo de base de datos, id del tenant) -> índice; el orden es el de uso (LRU)
+_indexes: "OrderedDict[Tuple[str, int], TitleIndex]" = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def _build(db: Session, tenant_id: int, state) -> TitleIndex:
+    index = TitleIndex(state.version if state else 0, state.reset_version if state else 0)
+    for entity, model in ENTITIES.items():
+        rows = db.execute(select(model.id, model.title).where(model.tenant_id == tenant_id))
+        index.load((entity, item_id, title) for item_id, title in rows)
+    return index
+
+
+def _catch_up(db: Session, tenant_id: int, index: TitleIndex, state):
+    """Aplica los cambios posteriores a la versión del índice (también los de otros workers)."""
+    for entity, model in ENTITIES.items():
+        rows = db.execute(
+            select(model.id, model.title)
+            .where(model.tenant_id == tenant_id, model.version > index.version, model.version <= state.version)
+        )
+        for item_id, title in rows:
+            index.add(entity, item_id, title)
+    tombstones = db.execute(
+        select(database.Tombstone.entity, database.Tombstone.entity_id)
+        .where(
+            database.Tombstone.tenant_id == tenant_id,
+            database.Tombstone.version > index.version,
+            database.Tombstone.version <= state.version,
+        )
+    )
+    for entity, item_id in tombstones:
+        index.remove(entity, item_id)
+    index.version = state.version
+
+
+def search(db: Session, tenant_id: int, query: str, limit: int = 10) -> List[dict]:
+    """
+    Productos, categorías y etiquetas cuyo título (o alguna de sus palabras) empieza con `query`.
+
+    El índice del token se arma en la primera búsqueda. Las siguientes solo leen la
+    versión de sincronización del token y, si cambió, aplican los cambios desde la
+    última búsqueda: las escrituras de `crud` ya registran esa versión.
+    """
+    key = (str(db.get_bind().engine.url.database), tenant_id)
+    state = db.get(database.SyncState, tenant_id)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is not None:
+            _indexes.move_to_end(key)
+    metrics.record_cache("autocomplete", index is not None)
+
+    version = state.version if state else 0
+    reset_version = state.reset_version if state else 0
+    if index is None or version < index.version or reset_version != index.reset_version:
+        # Primera búsqueda, o el token se reinició (/seed, /clean): se arma completo
+        index = _build(db, tenant_id, state)
+        with _indexes_lock:
+            _indexes[key] = index
+        _evict()
+    elif version > index.version:
+        with index.lock:
+            if version > index.version:
+                _catch_up(db, tenant_id, index, state)
+        _evict()
+
+    with index.lock:
+        return index.search(query, max(1, min(limit, MAX_RESULTS)))
+
+
+def _evict():
+    """Descarta los índices menos usados hasta quedar dentro de MAX_ENTRIES (siempre queda uno)."""
+    with _indexes_lock:
+        total = sum(len(index) for index in _indexes.values())
+        while total > MAX_ENTRIES and len(_indexes) > 1:
+            _, evicted = _indexes.popitem(last=False)
+            total -= len(evicted)
@@ -0,0 +1,177 @@
+import json
+import os
+import re
+from typing import Any, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from fastapi.concurrency import run_in_threadpool
+from fastapi.middleware.asyncexitstack import AsyncExitStackMiddleware
+from starlette.middleware.exceptions import ExceptionMiddleware
+
+import database
+
+# Sub-peticiones permitidas por lote
+MAX_REQUESTS = int(os.getenv("BATCH_MAX_REQUESTS", "25"))
+# Rutas que no pueden usarse dentro de un lote (administración, streaming, archivos)
+EXCLUDED_PREFIXES = (
+    "/batch", "/seed", "/clean", "/admin", "/events", "/uploads", "/metrics", "/docs", "/redoc", "/openapi.json",
+)
+
+# "$0.id", "$2.category.id": valor de la respuesta de una sub-petición anterior
+REFERENCE = re.compile(r"\$(\d+)((?:\.\w+)+)")
+
+
+def add_task(background_tasks, func, *args):
+    """
+    Como `background_tasks.add_task`. Dentro de un lote atómico la tarea se guarda
+    y se ejecuta recién cuando el lote se confirma (si se revierte, se descarta).
+    """
+    session = database.batch_session.get()
+    if session is None:
+        background_tasks.add_task(func, *args)
+    else:
+        session.info.setdefault("tasks", []).append((func, args))
+
+
+class InvalidReference(Exception):
+    """Referencia a una respuesta que no existe o que falló."""
+
+
+def lookup(responses: List[dict], index: int, fields: str) -> Any:
+    if index >= len(responses):
+        raise InvalidReference(f"${index} hace referencia a una petición posterior")
+    response = responses[index]
+    if response["status"] >= 400:
+        raise InvalidReference(f"${index} hace referencia a una petición que falló")
+    value = response["body"]
+    for field in fields.strip(".").split("."):
+        try:
+            value = value[int(field)] if isinstance(value, list) else value[field]
+        except (KeyError, IndexError, TypeError, ValueError):
+            raise InvalidReference(f"${index}{fields} no existe en la respuesta")
+    return value
+
+
+def resolve(value: Any, responses: List[dict]) -> Any:
+    """Reemplaza las referencias `$N.campo` en la ruta o el cuerpo de una sub-petición."""
+    if isinstance(value, str):
+        match = REFERENCE.fullmatch(value)
+        if match:
+            # Valor completo: conserva el tipo (ej: un id entero)
+            return lookup(responses, int(match.group(1)), match.group(2))
+        return REFERENCE.sub(lambda m: str(lookup(responses, int(m.group(1)), m.group(2))), value)
+    if isinstance(value, list):
+        return [resolve(item, responses) for item in value]
+    if isinstance(value, dict):
+        return {key: resolve(item, responses) for key, item in value.items()}
+    return value
+
+
+async def call(app, method: str, path: str, body: Any, authorization: str) -> Tuple[int, Any]:
+    """Ejecuta una sub-petición contra las rutas de la aplicación, sin pasar por la red."""
+    url = urlsplit(path)
+    payload = json.dumps(body).encode() if body is not None else b""
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": url.path,
+        "raw_path": url.path.encode(),
+        "query_string": url.query.encode(),
+        "root_path": "",
+        "headers": [
+            (b"authorization", authorization.encode("latin-1")),
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(payload)).encode()),
+        ],
+        "client": None,
+        "server": None,
+        "app": app,
+    }
+    sent = False
+
+    async def receive():
+        nonlocal sent
+        if sent:
+            return {"type": "http.disconnect"}
+        sent = True
+        return {"type": "http.request", "body": payload, "more_body": False}
+
+    status = 500
+    chunks = []
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+
+    # Solo el router y los manejadores de errores: sin límites, compresión ni métricas por sub-petición
+    router = AsyncExitStackMiddleware(app.router)
+    await ExceptionMiddleware(router, handlers=app.exception_handlers)(scope, receive, send)
+    content = b"".join(chunks)
+    try:
+        return status, json.loads(content) if content else None
+    except ValueError:
+        return status, content.decode("utf-8", "replace")
+
+
+async def execute(app, requests, token: str, atomic: bool = True, background_tasks=None) -> dict:
+    """
+    Ejecuta las sub-peticiones en orden.
+
+    Con `atomic`, todas comparten una transacción: los commits de `crud` pasan a
+    ser savepoints y el lote se confirma al final. La primera sub-petición que
+    falla revierte el lote y las siguientes no se ejecutan (424). Las tareas en
+    segundo plano de las sub-peticiones (ver `add_task`) pasan a `background_tasks`
+    solo si el lote se confirmó: mientras el lote tiene el lock de escritura no
+    pueden abrir otra sesión, y no deben borrar imágenes de un lote revertido.
+    """
+    session = await run_in_threadpool(database.begin_batch, token) if atomic else None
+    context = database.batch_session.set(session) if session is not None else None
+    responses: List[dict] = []
+    failed_at: Optional[int] = None
+    try:
+        for index, request in enumerate(requests):
+            if failed_at is not None:
+                responses.append({
+                    "status": 424,
+                    "body": {"detail": f"No ejecutada: la petición {failed_at} falló y el lote se revirtió"},
+                })
+                continue
+            try:
+                path = resolve(request.path, responses)
+                body = resolve(request.body, responses)
+            except InvalidReference as e:
+                status, content = 424, {"detail": str(e)}
+            else:
+                if not path.startswith("/") or urlsplit(path).path.startswith(EXCLUDED_PREFIXES):
+                    status, content = 400, {"detail": f"Ruta no permitida en un lote: {path}"}
+                else:
+                    try:
+                        status, content = await call(app, request.method, path, body, f"Bearer {token}")
+                    except Exception as e:
+                        print(f"Error en la petición {index} del lote ({request.method} {path}): {e}")
+                        status, content = 500, {"detail": "Error interno del servidor"}
+            responses.append({"status": status, "body": content})
+            if session is not None:
+                # Como al cerrar la sesión de una petición normal: los objetos que el endpoint
+                # modificó solo para responder (ej: pictures como lista) no se escriben después
+                session.expunge_all()
+            if atomic and status >= 400:
+                failed_at = index
+    finally:
+        if session is not None:
+            database.batch_session.reset(context)
+            tasks = session.info.pop("tasks", [])
+            await run_in_threadpool(database.end_batch, session, failed_at is None)
+            if failed_at is None:
+                for func, args in tasks:
+                    if background_tasks is not None:
+                        background_tasks.add_task(func, *args)
+                    else:
+                        await run_in_threadpool(func, *args)
+    return {"responses": responses, "committed": failed_at is None}
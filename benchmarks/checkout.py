@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Benchmark de compras concurrentes: el stock no se sobrevende
+
+Crea pocos productos con poco stock y muchos carritos que compiten por
+ellos, confirma todas las compras a la vez y verifica el resultado:
+
+- las unidades vendidas (pedidos creados) coinciden con el stock descontado
+- ningún producto queda con stock negativo
+- cada compra termina en 200 (pedido) o 409 (sin stock), nunca en 5xx
+
+Muestra además la latencia (p50/p99) y el throughput de las confirmaciones.
+
+Uso:
+    python -m benchmarks.checkout                         # app en proceso, 300 compras
+    python -m benchmarks.checkout --carts 500 --products 3 --stock 50
+    python -m benchmarks.checkout --workers 4             # gunicorn con 4 workers
+    python -m benchmarks.checkout --url http://localhost:8000   # con QUOTA_MAX_OPEN_CARTS >= --carts
+
+Sale con código 1 si detecta sobreventa o errores del servidor.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from pathlib import Path
+
+from benchmarks.harness import Timer, auth, boot_app, make_client, summarize
+
+
+async def prepare(client, headers, args, rng):
+    """Crea los productos y los carritos (sin confirmar) que van a competir por el stock."""
+    response = await client.post(
+        "/categories/", json={"title": "Ofertas", "description": "Productos con stock limitado"}, headers=headers
+    )
+    category_id = response.json()["id"]
+    products = []
+    for p in range(args.products):
+        response = await client.post(
+            "/products/",
+            json={
+                "title": f"Oferta {p}",
+                "description": "Producto con stock limitado",
+                "price": 10 + p,
+                "category_id": category_id,
+                "stock": args.stock,
+            },
+            headers=headers,
+        )
+        products.append(response.json()["id"])
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def create_cart():
+        async with semaphore:
+            cart_id = (await client.post("/carts/", headers=headers)).json()["id"]
+            for product_id in rng.sample(products, rng.randint(1, min(args.items, len(products)))):
+                await client.put(
+                    f"/carts/{cart_id}/items/{product_id}",
+                    json={"quantity": rng.randint(1, args.quantity)},
+                    headers=headers,
+                )
+            return cart_id
+
+    carts = await asyncio.gather(*(create_cart() for _ in range(args.carts)))
+    return products, carts
+
+
+async def stock_of(client, headers, products):
+    response = await client.get("/products/", params={"ids": ",".join(map(str, products))}, headers=headers)
+    return {product["id"]: product["stock"] for product in response.json()}
+
+
+async def all_orders(client, headers):
+    orders = []
+    while True:
+        response = await client.get(
+            "/orders/", params={"skip": len(orders), "limit": 100}, headers=headers
+        )
+        page = response.json()
+        orders.extend(page)
+        if len(page) < 100:
+            return orders
+
+
+async def run(args, url: str = None) -> dict:
+    app = None
+    if not url:
+        app, _ = boot_app()
+
+    rng = random.Random(args.random_seed)
+    headers = auth(args.token)
+    async with make_client(url, app) as client:
+        products, carts = await prepare(client, headers, args, rng)
+        initial = await stock_of(client, headers, products)
+
+        durations = []
+        statuses = {}
+
+        async def checkout(cart_id):
+            with Timer(durations):
+                response = await client.post(f"/carts/{cart_id}/checkout", headers=headers)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        # Todas las confirmaciones a la vez: compiten por la misma fila de cada producto
+        start = time.perf_counter()
+        await asyncio.gather(*(checkout(cart_id) for cart_id in carts))
+        elapsed = time.perf_counter() - start
+
+        final = await stock_of(client, headers, products)
+        orders = await all_orders(client, headers)
+
+    sold = {product_id: 0 for product_id in products}
+    for order in orders:
+        for item in order["items"]:
+            sold[item["product_id"]] += item["quantity"]
+
+    oversold = [
+        product_id for product_id in products
+        if final[product_id] < 0 or initial[product_id] - final[product_id] != sold[product_id]
+    ]
+    server_errors = sum(count for status, count in statuses.items() if status >= 500)
+    return {
+        "config": vars(args),
+        "checkout": summarize(durations, elapsed),
+        "statuses": statuses,
+        "orders": len(orders),
+        "units_sold": sum(sold.values()),
+        "stock_initial": sum(initial.values()),
+        "stock_final": sum(final.values()),
+        "oversold_products": oversold,
+        "ok": not oversold and not server_errors and len(orders) == statuses.get(200, 0),
+    }
+
+
+def run_with_workers(args) -> dict:
+    from benchmarks.workers import free_port, start_server, wait_until_ready
+
+    port = free_port()
+    url = f"http://127.0.0.1:{port}"
+    server = start_server(args.workers, port, "bench_admin_token")
+    try:
+        wait_until_ready(url, server)
+        return asyncio.run(run(args, url))
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compras concurrentes sin sobreventa")
+    parser.add_argument("--url", help="URL de un servidor ya iniciado (por defecto: app en proceso)")
+    parser.add_argument("--workers", type=int, help="Iniciar gunicorn con esta cantidad de workers")
+    parser.add_argument("--token", default="bench_checkout")
+    parser.add_argument("--products", type=int, default=5)
+    parser.add_argument("--stock", type=int, default=40, help="Unidades iniciales de cada producto")
+    parser.add_argument("--carts", type=int, default=300, help="Compras confirmadas en paralelo")
+    parser.add_argument("--items", type=int, default=3, help="Productos distintos por carrito (máximo)")
+    parser.add_argument("--quantity", type=int, default=2, help="Unidades por producto (máximo)")
+    parser.add_argument("--concurrency", type=int, default=32, help="Carritos preparados en paralelo")
+    parser.add_argument("--random-seed", type=int, default=42)
+    parser.add_argument("--output", help="Archivo JSON donde guardar los resultados")
+    args = parser.parse_args(argv)
+
+    # Todos los carritos están abiertos a la vez (con --url, configurarlo en el servidor)
+    os.environ["QUOTA_MAX_OPEN_CARTS"] = str(max(args.carts, int(os.getenv("QUOTA_MAX_OPEN_CARTS", "100"))))
+    results = run_with_workers(args) if args.workers else asyncio.run(run(args, args.url))
+
+    summary = results["checkout"]
+    print(f"{'compras':>8} {'p50 ms':>10} {'p99 ms':>10} {'req/s':>8} {'pedidos':>8} {'sin stock':>10}")
+    print(
+        f"{summary['count']:>8} {summary['p50_ms']:>10} {summary['p99_ms']:>10} "
+        f"{summary['throughput_rps']:>8} {results['orders']:>8} {results['statuses'].get(409, 0):>10}"
+    )
+    print(
+        f"Stock: {results['stock_initial']} -> {results['stock_final']}, "
+        f"unidades vendidas: {results['units_sold']}"
+    )
+    if results["ok"]:
+        print("OK: sin sobreventa")
+    else:
+        print(f"SOBREVENTA o errores: productos {results['oversold_products']}, respuestas {results['statuses']}")
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2), encoding="utf-8")
+    if not results["ok"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
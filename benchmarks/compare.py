@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Compara dos resultados de `benchmarks.run` y marca las regresiones
+
+Uso:
+    python -m benchmarks.compare antes.json despues.json [--threshold 10]
+
+Sale con código 1 si algún p50/p99 empeora, o el throughput baja, más que
+el umbral (en %).
+"""
+
+import argparse
+import json
+import sys
+
+METRICS = [
+    # (clave, mayor es mejor)
+    ("p50_ms", False),
+    ("p99_ms", False),
+    ("throughput_rps", True),
+]
+
+
+def change_pct(before: float, after: float) -> float:
+    if not before:
+        return 0.0
+    return (after - before) / before * 100
+
+
+def compare(before: dict, after: dict, threshold: float):
+    rows = []
+    regressions = []
+    for scenario, after_stats in after["results"].items():
+        before_stats = before["results"].get(scenario)
+        if not before_stats:
+            continue
+        for key, higher_is_better in METRICS:
+            if before_stats.get(key) is None or after_stats.get(key) is None:
+                continue
+            pct = change_pct(before_stats[key], after_stats[key])
+            worse = -pct if higher_is_better else pct
+            flag = "REGRESIÓN" if worse > threshold else ""
+            rows.append((scenario, key, before_stats[key], after_stats[key], pct, flag))
+            if flag:
+                regressions.append((scenario, key, pct))
+    return rows, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Comparar resultados de benchmarks")
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Umbral de regresión en %%")
+    args = parser.parse_args(argv)
+
+    with open(args.before, encoding="utf-8") as f:
+        before = json.load(f)
+    with open(args.after, encoding="utf-8") as f:
+        after = json.load(f)
+
+    print(f"Antes:   {before['meta']['commit']} ({before['meta']['timestamp']})")
+    print(f"Después: {after['meta']['commit']} ({after['meta']['timestamp']})")
+    print()
+    print(f"{'escenario':<10} {'métrica':<15} {'antes':>10} {'después':>10} {'cambio':>9}")
+    rows, regressions = compare(before, after, args.threshold)
+    for scenario, key, before_value, after_value, pct, flag in rows:
+        print(f"{scenario:<10} {key:<15} {before_value:>10} {after_value:>10} {pct:>+8.1f}% {flag}")
+
+    if regressions:
+        print(f"\n❌ {len(regressions)} regresiones mayores al {args.threshold}%")
+        sys.exit(1)
+    print("\n✅ Sin regresiones")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Benchmark de compresión de respuestas sobre un catálogo realista
+
+Crea un catálogo (productos con su categoría y etiquetas embebidas, como
+devuelve `GET /products/`) y mide, para cada codificación y nivel:
+
+- bytes de la respuesta y porcentaje ahorrado
+- tiempo de CPU por compresión
+- latencia extremo a extremo (p50/p99) pidiendo el listado con cada
+  `Accept-Encoding` y la configuración actual del middleware
+
+Uso:
+    python -m benchmarks.compression
+    python -m benchmarks.compression --products 500 --tags 8 --requests 300
+"""
+
+import argparse
+import asyncio
+import gzip
+import time
+
+from benchmarks.harness import Timer, auth, boot_app, make_client, summarize
+
+LEVELS = {
+    "gzip": [1, 6, 9],
+    "br": [1, 4, 6, 11],
+}
+
+
+def compress(encoding: str, level: int, body: bytes) -> bytes:
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=level)
+    import brotli
+    return brotli.compress(body, quality=level)
+
+
+def cpu_cost(encoding: str, level: int, body: bytes, repeat: int) -> float:
+    """Tiempo de CPU promedio (segundos) de comprimir `body` una vez."""
+    start = time.process_time()
+    for _ in range(repeat):
+        compress(encoding, level, body)
+    return (time.process_time() - start) / repeat
+
+
+async def build_catalog(client, token: str, args):
+    headers = auth(token)
+    categories = []
+    for c in range(args.categories):
+        response = await client.post(
+            "/categories/",
+            json={"title": f"Categoría {c}", "description": "Verduras, carnes y productos de limpieza " * 2},
+            headers=headers,
+        )
+        categories.append(response.json()["id"])
+    tags = []
+    for t in range(args.tags):
+        response = await client.post("/tags/", json={"title": f"Etiqueta {t}"}, headers=headers)
+        tags.append(response.json()["id"])
+    for p in range(args.products):
+        await client.post(
+            "/products/",
+            json={
+                "title": f"Producto {p}",
+                "description": "Producto fresco de estación, ideal para la cocina de todos los días.",
+                "price": round(100 + p * 3.5, 2),
+                "category_id": categories[p % len(categories)],
+                "tag_ids": tags[: 1 + p % len(tags)],
+            },
+            headers=headers,
+        )
+
+
+async def end_to_end(client, token: str, accept_encoding: str, args) -> dict:
+    durations = []
+    transferred = 0
+    for _ in range(args.requests):
+        with Timer(durations):
+            response = await client.get(
+                "/products/",
+                params={"limit": args.products},
+                headers={**auth(token), "Accept-Encoding": accept_encoding},
+            )
+        transferred = response.num_bytes_downloaded
+    summary = summarize(durations)
+    summary["bytes"] = transferred
+    return summary
+
+
+async def run(args):
+    app, _ = boot_app()
+    import compression
+
+    token = "bench_compression"
+    async with make_client(app=app) as client:
+        await build_catalog(client, token, args)
+        response = await client.get(
+            "/products/",
+            params={"limit": args.products},
+            headers={**auth(token), "Accept-Encoding": "identity"},
+        )
+        body = response.content
+        print(f"Listado de {args.products} productos: {len(body)} bytes sin comprimir\n")
+
+        print(f"{'codificación':<14} {'nivel':>5} {'bytes':>9} {'ahorro':>8} {'CPU (ms)':>9}")
+        for encoding, levels in LEVELS.items():
+            if encoding == "br" and not compression.BROTLI_AVAILABLE:
+                print("br: no disponible (pip install brotli)")
+                continue
+            for level in levels:
+                size = len(compress(encoding, level, body))
+                cost = cpu_cost(encoding, level, body, args.repeat)
+                saved = 100 - size * 100 / len(body)
+                print(f"{encoding:<14} {level:>5} {size:>9} {saved:>7.1f}% {cost * 1000:>9.3f}")
+
+        print(f"\nExtremo a extremo (gzip={compression.GZIP_LEVEL}, br={compression.BROTLI_LEVEL}, "
+              f"mínimo {compression.MINIMUM_SIZE} bytes):")
+        encodings = ["identity", "gzip"] + (["br"] if compression.BROTLI_AVAILABLE else [])
+        for accept_encoding in encodings:
+            summary = await end_to_end(client, token, accept_encoding, args)
+            print(f"{accept_encoding:>9}: {summary}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compresión de respuestas")
+    parser.add_argument("--products", type=int, default=200)
+    parser.add_argument("--categories", type=int, default=4)
+    parser.add_argument("--tags", type=int, default=5)
+    parser.add_argument("--requests", type=int, default=200, help="Peticiones por codificación (extremo a extremo)")
+    parser.add_argument("--repeat", type=int, default=50, help="Repeticiones para medir la CPU de cada nivel")
+    asyncio.run(run(parser.parse_args(argv)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Utilidades compartidas por los benchmarks de la API de Ecommerce - UNTDF
+
+Levantan `main.app` dentro del proceso, en un directorio temporal con su
+propia base SQLite y su propio directorio uploads, o bien apuntan a un
+servidor uvicorn ya iniciado (--url).
+"""
+
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+def boot_app(workdir: str = None):
+    """
+    Importa `main.app` trabajando dentro de un directorio temporal.
+
+    La base de datos (`./ecommerce.db`) y `uploads/` son rutas relativas, por
+    lo que cambiar de directorio antes del import aísla el benchmark de los
+    datos reales.
+
+    Returns:
+        Tupla (app, workdir)
+    """
+    workdir = workdir or tempfile.mkdtemp(prefix="ecommerce-bench-")
+    if str(REPO_ROOT) not in sys.path:
+        sys.path.insert(0, str(REPO_ROOT))
+    os.chdir(workdir)
+    # Los benchmarks miden el servidor, no el limitador de peticiones por token
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+
+    import main
+    # httpx.ASGITransport no ejecuta el lifespan: se crean las tablas acá
+    main.initialize_database()
+    return main.app, workdir
+
+
+def make_client(url: str = None, app=None) -> httpx.AsyncClient:
+    """Cliente HTTP contra un servidor real (url) o contra la app en proceso."""
+    if url:
+        return httpx.AsyncClient(base_url=url, timeout=60)
+    transport = httpx.ASGITransport(app=app)
+    return httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60)
+
+
+def auth(token: str) -> dict:
+    return {"Authorization": f"Bearer {token}"}
+
+
+def summarize(durations: list, elapsed: float = None) -> dict:
+    """
+    Resume una lista de duraciones (en segundos) en milisegundos.
+
+    Returns:
+        Diccionario con count, mean, p50, p99 y throughput (req/s)
+    """
+    if not durations:
+        return {"count": 0}
+    ordered = sorted(durations)
+    elapsed = elapsed if elapsed is not None else sum(durations)
+    return {
+        "count": len(ordered),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 3),
+        "p50_ms": round(percentile(ordered, 50) * 1000, 3),
+        "p99_ms": round(percentile(ordered, 99) * 1000, 3),
+        "throughput_rps": round(len(ordered) / elapsed, 1) if elapsed > 0 else None,
+    }
+
+
+def percentile(ordered: list, pct: float) -> float:
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+class Timer:
+    """Context manager que acumula la duración de cada bloque en una lista."""
+
+    def __init__(self, durations: list):
+        self.durations = durations
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.durations.append(time.perf_counter() - self.start)
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Benchmark del tiempo de inicio: cuánto tarda `import main`
+
+Ejecuta `python -X importtime -c "import main"` en procesos nuevos (en un
+directorio temporal, sin base de datos previa) y resume el tiempo total y los
+módulos que más tardan en importarse. Es el costo de cada arranque en frío
+del servidor.
+
+Uso:
+    python -m benchmarks.importtime                 # 5 ejecuciones, 15 módulos más lentos
+    python -m benchmarks.importtime --runs 10 --top 30
+
+`benchmarks.run` incluye este resultado como escenario `import`, así
+`benchmarks.compare` detecta regresiones en el tiempo de inicio.
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+import tempfile
+from typing import Dict, List, Tuple
+
+from benchmarks.harness import REPO_ROOT, summarize
+
+# "import time:  self [us] | cumulative | imported package"
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+
+
+def import_main_once() -> Tuple[float, Dict[str, int]]:
+    """
+    Importa `main` en un proceso nuevo.
+
+    Returns:
+        Tupla (segundos totales de `import main`, microsegundos acumulados por módulo)
+    """
+    workdir = tempfile.mkdtemp(prefix="ecommerce-importtime-")
+    env = {**os.environ, "PYTHONPATH": str(REPO_ROOT), "PYTHONDONTWRITEBYTECODE": "1"}
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=workdir, env=env, capture_output=True, text=True, check=True,
+    )
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            cumulative[match.group(4)] = int(match.group(2))
+    return cumulative.get("main", 0) / 1_000_000, cumulative
+
+
+def measure(runs: int = 5) -> Tuple[List[float], Dict[str, int]]:
+    """
+    Returns:
+        Tupla (duraciones de cada ejecución en segundos, mediana por módulo en microsegundos)
+    """
+    durations = []
+    per_module: Dict[str, List[int]] = {}
+    # La primera ejecución compila los .pyc de las dependencias y no se cuenta
+    import_main_once()
+    for _ in range(runs):
+        duration, cumulative = import_main_once()
+        durations.append(duration)
+        for module, micros in cumulative.items():
+            per_module.setdefault(module, []).append(micros)
+    medians = {module: sorted(values)[len(values) // 2] for module, values in per_module.items()}
+    return durations, medians
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tiempo de importación de main")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="Módulos de primer nivel más lentos a mostrar")
+    args = parser.parse_args(argv)
+
+    durations, medians = measure(args.runs)
+    print(f"import main: {summarize(durations)}")
+    print(f"\n{'módulo':<40} {'acumulado (ms)':>15}")
+    top_level = {module: micros for module, micros in medians.items() if "." not in module}
+    for module, micros in sorted(top_level.items(), key=lambda item: item[1], reverse=True)[:args.top]:
+        print(f"{module:<40} {micros / 1000:>15.1f}")
+
+
+if __name__ == "__main__":
+    main()
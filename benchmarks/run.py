@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+Suite de benchmarks de la API de Ecommerce - UNTDF
+
+Genera un catálogo sintético repartido entre muchos tokens y mide
+throughput, p50 y p99 de los endpoints principales. Los resultados se
+guardan en JSON para compararlos entre commits con `benchmarks.compare`.
+
+Uso:
+    python -m benchmarks.run                              # app en proceso, valores por defecto
+    python -m benchmarks.run --tokens 50 --products 200 --requests 2000 --concurrency 32
+    python -m benchmarks.run --url http://localhost:8000 --admin-token $ADMIN_TOKEN
+    python -m benchmarks.compare benchmarks/results/<antes>.json benchmarks/results/<después>.json
+
+Escenarios: import, list, list_compact (?format=compact), detail, related,
+autocomplete (prefijos de títulos), batch (?ids=, --batch-size productos por
+petición), create, upload, seed, clean (clean se ejecuta al final porque
+elimina el catálogo). En proceso, el seed usa un
+seed.yml sintético sin imágenes para no depender de internet. `import` mide
+el arranque en frío (`import main` en un proceso nuevo, ver
+`benchmarks.importtime`) y se omite con --url.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from benchmarks import importtime
+from benchmarks.harness import REPO_ROOT, Timer, auth, boot_app, make_client, summarize
+
+SCENARIOS = ["import", "list", "list_compact", "detail", "related", "autocomplete", "batch", "create", "upload", "seed", "clean"]
+RESULTS_DIR = REPO_ROOT / "benchmarks" / "results"
+ADMIN_TOKEN = "bench_admin_token"
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=REPO_ROOT, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+def write_seed_file(workdir: str, categories: int, items: int):
+    """seed.yml sintético (sin imágenes) para medir /seed sin acceso a internet."""
+    lines = []
+    for c in range(categories):
+        lines += [f"Categoria{c}:", f'  title: "Categoría {c}"', '  description: "Sintética"', "  items:"]
+        for i in range(items):
+            lines += [
+                f'    - title: "Producto {c}-{i}"',
+                '      description: "Producto sintético"',
+                f"      price: {1 + i}.50",
+                f'      tags: ["Etiqueta {i % 3}"]',
+            ]
+    Path(workdir, "seed.yml").write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+
+class Catalog:
+    """Ids creados por token, para elegir objetivos aleatorios en cada escenario."""
+
+    def __init__(self):
+        self.categories = {}
+        self.products = {}
+
+    def random_product(self, rng):
+        token = rng.choice(list(self.products))
+        return token, rng.choice(self.products[token])
+
+
+async def run_concurrently(jobs, concurrency: int):
+    """Ejecuta las corrutinas con un máximo de `concurrency` en paralelo y mide cada una."""
+    semaphore = asyncio.Semaphore(concurrency)
+    durations = []
+    errors = 0
+
+    async def run_job(job):
+        nonlocal errors
+        async with semaphore:
+            with Timer(durations):
+                response = await job()
+            if response.status_code >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run_job(job) for job in jobs))
+    elapsed = time.perf_counter() - start
+    summary = summarize(durations, elapsed)
+    summary["errors"] = errors
+    return summary
+
+
+async def populate(client, catalog: Catalog, args):
+    """Crea el catálogo sintético a través de la API (categorías, etiquetas y productos)."""
+    async def create_token_catalog(t):
+        token = f"bench_token_{t}"
+        headers = auth(token)
+        categories = []
+        for c in range(args.categories):
+            response = await client.post(
+                "/categories/",
+                json={"title": f"Categoría {c}", "description": "Categoría sintética"},
+                headers=headers,
+            )
+            categories.append(response.json()["id"])
+        tags = []
+        for g in range(args.tags):
+            response = await client.post("/tags/", json={"title": f"Etiqueta {g}"}, headers=headers)
+            tags.append(response.json()["id"])
+        products = []
+        for p in range(args.products):
+            response = await client.post(
+                "/products/",
+                json={
+                    "title": f"Producto {p}",
+                    "description": "Producto sintético para benchmark " * 3,
+                    "price": round(1 + p * 0.75, 2),
+                    "category_id": categories[p % len(categories)],
+                    "tag_ids": tags[: 1 + p % len(tags)] if tags else [],
+                },
+                headers=headers,
+            )
+            products.append(response.json()["id"])
+        catalog.categories[token] = categories
+        catalog.products[token] = products
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def limited(t):
+        async with semaphore:
+            await create_token_catalog(t)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(limited(t) for t in range(args.tokens)))
+    return time.perf_counter() - start
+
+
+def scenario_jobs(name: str, client, catalog: Catalog, args, rng):
+    tokens = list(catalog.products)
+
+    if name == "list":
+        def make(token):
+            return lambda: client.get("/products/", params={"limit": args.page_size}, headers=auth(token))
+        return [make(rng.choice(tokens)) for _ in range(args.requests)]
+
+    if name == "list_compact":
+        def make(token):
+            return lambda: client.get(
+                "/products/", params={"limit": args.page_size, "format": "compact"}, headers=auth(token)
+            )
+        return [make(rng.choice(tokens)) for _ in range(args.requests)]
+
+    if name == "detail":
+        def make(token, product_id):
+            return lambda: client.get(f"/products/{product_id}", headers=auth(token))
+        return [make(*catalog.random_product(rng)) for _ in range(args.requests)]
+
+    if name == "related":
+        def make(token, product_id):
+            return lambda: client.get(f"/products/{product_id}/related", headers=auth(token))
+        return [make(*catalog.random_product(rng)) for _ in range(args.requests)]
+
+    if name == "autocomplete":
+        # Lo que un buscador pide en cada tecla: prefijos de un título del catálogo
+        def make(token, query):
+            return lambda: client.get("/autocomplete", params={"q": query}, headers=auth(token))
+        jobs = []
+        for _ in range(args.requests):
+            title = f"Producto {rng.randrange(args.products)}"
+            jobs.append(make(rng.choice(tokens), title[: rng.randint(1, len(title))]))
+        return jobs
+
+    if name == "batch":
+        def make(token):
+            ids = rng.sample(catalog.products[token], min(args.batch_size, len(catalog.products[token])))
+            return lambda: client.get(
+                "/products/", params={"ids": ",".join(map(str, ids))}, headers=auth(token)
+            )
+        return [make(rng.choice(tokens)) for _ in range(args.requests)]
+
+    if name == "create":
+        def make(token, category_id):
+            return lambda: client.post(
+                "/products/",
+                json={"title": "Nuevo", "description": "Creado en benchmark", "price": 9.99,
+                      "category_id": category_id},
+                headers=auth(token),
+            )
+        jobs = []
+        for _ in range(args.requests):
+            token = rng.choice(tokens)
+            jobs.append(make(token, rng.choice(catalog.categories[token])))
+        return jobs
+
+    if name == "upload":
+        picture = os.urandom(args.picture_size)
+
+        def make(token, product_id):
+            return lambda: client.post(
+                f"/products/{product_id}/pictures",
+                files=[("files", ("bench.jpg", picture, "image/jpeg"))],
+                headers=auth(token),
+            )
+        return [make(*catalog.random_product(rng)) for _ in range(max(1, args.requests // 10))]
+
+    if name == "seed":
+        def make(token):
+            return lambda: client.post("/seed", headers=auth(token))
+        return [make(f"bench_seed_{i}") for i in range(args.seed_requests)]
+
+    if name == "clean":
+        return [lambda: client.post("/clean", headers=auth(args.admin_token))]
+
+    raise ValueError(f"Escenario desconocido: {name}")
+
+
+async def run(args) -> dict:
+    rng = random.Random(args.random_seed)
+    app = None
+    workdir = None
+    import_summary = None
+    if not args.url and "import" in args.scenarios:
+        # Antes de boot_app: mide procesos nuevos, sin main ya importado
+        durations, _ = importtime.measure(args.import_runs)
+        import_summary = summarize(durations)
+        print(f"{'import':>8}: {import_summary}")
+    if not args.url:
+        os.environ.setdefault("ADMIN_TOKEN", args.admin_token)
+        app, workdir = boot_app()
+        write_seed_file(workdir, args.seed_categories, args.seed_items)
+
+    results = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "target": args.url or "in-process",
+            "config": {k: v for k, v in vars(args).items() if k not in ("output", "admin_token")},
+        },
+        "results": {},
+    }
+    if import_summary:
+        results["results"]["import"] = import_summary
+
+    async with make_client(args.url, app) as client:
+        catalog = Catalog()
+        populate_seconds = await populate(client, catalog, args)
+        results["meta"]["populate_seconds"] = round(populate_seconds, 3)
+        print(f"Catálogo: {args.tokens} tokens x {args.products} productos ({populate_seconds:.1f}s)")
+
+        for name in [s for s in SCENARIOS if s in args.scenarios and s != "import"]:
+            concurrency = 1 if name in ("seed", "clean") else args.concurrency
+            summary = await run_concurrently(scenario_jobs(name, client, catalog, args, rng), concurrency)
+            results["results"][name] = summary
+            print(f"{name:>8}: {summary}")
+
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks de la API de Ecommerce")
+    parser.add_argument("--url", help="URL de un servidor ya iniciado (por defecto: app en proceso)")
+    parser.add_argument("--admin-token", default=os.getenv("ADMIN_TOKEN", ADMIN_TOKEN))
+    parser.add_argument("--tokens", type=int, default=20, help="Tokens (estudiantes) sintéticos")
+    parser.add_argument("--categories", type=int, default=4, help="Categorías por token")
+    parser.add_argument("--tags", type=int, default=3, help="Etiquetas por token")
+    parser.add_argument("--products", type=int, default=100, help="Productos por token")
+    parser.add_argument("--requests", type=int, default=1000, help="Peticiones por escenario")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--page-size", type=int, default=100, help="limit de los listados")
+    parser.add_argument("--batch-size", type=int, default=10, help="Productos pedidos con ?ids= en el escenario batch")
+    parser.add_argument("--picture-size", type=int, default=50_000)
+    parser.add_argument("--seed-requests", type=int, default=10)
+    parser.add_argument("--seed-categories", type=int, default=4)
+    parser.add_argument("--seed-items", type=int, default=5)
+    parser.add_argument("--import-runs", type=int, default=5, help="Procesos nuevos medidos en el escenario import")
+    parser.add_argument("--random-seed", type=int, default=42)
+    parser.add_argument("--scenarios", nargs="+", default=SCENARIOS, choices=SCENARIOS)
+    parser.add_argument("--output", help="Archivo JSON de resultados (por defecto benchmarks/results/<commit>.json)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = asyncio.run(run(args))
+
+    output = Path(args.output) if args.output else RESULTS_DIR / f"{results['meta']['commit']}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2, ensure_ascii=False), encoding="utf-8")
+    print(f"Resultados guardados en {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Benchmark de carga de páginas con muchas imágenes (/uploads)
+Universidad Nacional de Tierra del Fuego
+
+Simula la vista de catálogo de un frontend: un GET /products/ seguido de la
+descarga de todas las imágenes, con 6 conexiones en paralelo como un
+navegador. Compara tres escenarios:
+
+- cold: primera visita, todas las imágenes se descargan (200)
+- revalidate: visita repetida sin `immutable`, una petición condicional por imagen (304)
+- immutable: visita repetida con `Cache-Control: immutable`, las imágenes no se piden
+
+Uso:
+    python -m benchmarks.uploads --products 50 --pictures 3 --views 20
+    python -m benchmarks.uploads --url http://localhost:8000 --output uploads.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+
+from benchmarks.harness import Timer, auth, boot_app, make_client, summarize
+
+BROWSER_CONNECTIONS = 6
+
+
+async def build_catalog(client, headers, products: int, pictures: int, picture_size: int):
+    response = await client.post(
+        "/categories/",
+        json={"title": "Benchmark", "description": "Catálogo sintético"},
+        headers=headers,
+    )
+    category_id = response.json()["id"]
+
+    for i in range(products):
+        response = await client.post(
+            "/products/",
+            json={
+                "title": f"Producto {i}",
+                "description": "Producto sintético para benchmark",
+                "price": 10.0 + i,
+                "category_id": category_id,
+            },
+            headers=headers,
+        )
+        product_id = response.json()["id"]
+        files = [
+            ("files", (f"foto_{j}.jpg", os.urandom(picture_size), "image/jpeg"))
+            for j in range(pictures)
+        ]
+        await client.post(f"/products/{product_id}/pictures", files=files, headers=headers)
+
+
+async def fetch_pictures(client, urls, etags=None):
+    """Descarga las imágenes con un máximo de conexiones simultáneas."""
+    semaphore = asyncio.Semaphore(BROWSER_CONNECTIONS)
+    transferred = 0
+    statuses = {}
+
+    async def fetch(url):
+        nonlocal transferred
+        headers = {"If-None-Match": etags[url]} if etags else {}
+        async with semaphore:
+            response = await client.get(url, headers=headers)
+        transferred += len(response.content)
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+        return url, response.headers.get("etag")
+
+    results = await asyncio.gather(*(fetch(url) for url in urls))
+    return dict(results), transferred, statuses
+
+
+async def page_view(client, headers, scenario: str, etags: dict):
+    response = await client.get("/products/", headers=headers)
+    transferred = len(response.content)
+    urls = [url for product in response.json() for url in product["pictures"]]
+
+    if scenario == "cold":
+        _, picture_bytes, statuses = await fetch_pictures(client, urls)
+    elif scenario == "revalidate":
+        _, picture_bytes, statuses = await fetch_pictures(client, urls, etags)
+    else:
+        picture_bytes, statuses = 0, {}
+
+    return transferred + picture_bytes, statuses, len(urls) if scenario != "immutable" else 0
+
+
+async def check_headers(client, headers) -> dict:
+    """Verifica las cabeceras de caché y el soporte de Range en una imagen."""
+    response = await client.get("/products/", headers=headers)
+    url = response.json()[0]["pictures"][0]
+    full = await client.get(url)
+    partial = await client.get(url, headers={"Range": "bytes=0-99"})
+    revalidated = await client.get(url, headers={"If-None-Match": full.headers.get("etag", "")})
+    return {
+        "cache_control": full.headers.get("cache-control"),
+        "etag": full.headers.get("etag"),
+        "accept_ranges": full.headers.get("accept-ranges"),
+        "range_status": partial.status_code,
+        "range_length": len(partial.content),
+        "revalidate_status": revalidated.status_code,
+    }
+
+
+async def run(args) -> dict:
+    app = None
+    if not args.url:
+        app, _ = boot_app()
+
+    headers = auth(args.token)
+    async with make_client(args.url, app) as client:
+        await build_catalog(client, headers, args.products, args.pictures, args.picture_size)
+
+        response = await client.get("/products/", headers=headers)
+        urls = [url for product in response.json() for url in product["pictures"]]
+        etags, _, _ = await fetch_pictures(client, urls)
+
+        results = {
+            "config": vars(args),
+            "headers": await check_headers(client, headers),
+            "scenarios": {},
+        }
+        for scenario in ("cold", "revalidate", "immutable"):
+            durations = []
+            transferred = 0
+            requests_made = 0
+            statuses = {}
+            start = time.perf_counter()
+            for _ in range(args.views):
+                with Timer(durations):
+                    view_bytes, view_statuses, view_requests = await page_view(
+                        client, headers, scenario, etags
+                    )
+                transferred += view_bytes
+                requests_made += view_requests + 1
+                for status_code, count in view_statuses.items():
+                    statuses[status_code] = statuses.get(status_code, 0) + count
+            elapsed = time.perf_counter() - start
+
+            summary = summarize(durations, elapsed)
+            summary["requests_per_view"] = requests_made / args.views
+            summary["bytes_per_view"] = transferred // args.views
+            summary["picture_statuses"] = statuses
+            results["scenarios"][scenario] = summary
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de páginas con muchas imágenes")
+    parser.add_argument("--url", help="URL de un servidor ya iniciado (por defecto: app en proceso)")
+    parser.add_argument("--token", default="bench_uploads")
+    parser.add_argument("--products", type=int, default=50)
+    parser.add_argument("--pictures", type=int, default=3, help="Imágenes por producto")
+    parser.add_argument("--picture-size", type=int, default=60_000, help="Bytes por imagen")
+    parser.add_argument("--views", type=int, default=20, help="Vistas de página por escenario")
+    parser.add_argument("--output", help="Archivo JSON donde guardar los resultados")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Benchmark de escalado con la cantidad de workers de gunicorn
+
+Para cada cantidad de workers inicia `gunicorn main:app -c gunicorn.conf.py`
+en un directorio temporal (base y uploads propios), ejecuta los escenarios de
+`benchmarks.run` contra ese servidor y muestra el throughput obtenido.
+
+Uso:
+    python -m benchmarks.workers                          # 1, 2 y 4 workers
+    python -m benchmarks.workers --workers 1 2 4 8 --requests 4000 --concurrency 64
+
+Requiere gunicorn y uvicorn-worker (requirements.txt). El escalado depende de
+los núcleos disponibles: con un solo núcleo no hay mejora.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+from benchmarks import run as bench_run
+from benchmarks.harness import REPO_ROOT
+
+SCENARIOS = ["list", "detail", "create"]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(workers: int, port: int, admin_token: str) -> subprocess.Popen:
+    workdir = tempfile.mkdtemp(prefix=f"ecommerce-workers-{workers}-")
+    env = {
+        **os.environ,
+        "PYTHONPATH": str(REPO_ROOT),
+        "PORT": str(port),
+        "WEB_CONCURRENCY": str(workers),
+        "ADMIN_TOKEN": admin_token,
+        "RATE_LIMIT_ENABLED": "false",
+        # Los benchmarks no usan /events: se aceptan varios workers sin Redis
+        "ALLOW_PER_PROCESS_STATE": "true",
+        "PROMETHEUS_MULTIPROC_DIR": os.path.join(workdir, "prometheus"),
+    }
+    return subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "main:app", "-c", str(REPO_ROOT / "gunicorn.conf.py"),
+         "--access-logfile", "/dev/null"],
+        cwd=workdir,
+        env=env,
+    )
+
+
+def wait_until_ready(url: str, server: subprocess.Popen, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("gunicorn terminó antes de quedar listo")
+        try:
+            if httpx.get(url, timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"El servidor no respondió en {timeout} segundos")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Escalado con la cantidad de workers")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--tokens", type=int, default=20)
+    parser.add_argument("--products", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--scenarios", nargs="+", default=SCENARIOS, choices=SCENARIOS)
+    parser.add_argument("--output", help="Archivo JSON con los resultados")
+    args = parser.parse_args(argv)
+
+    admin_token = "bench_admin_token"
+    results = {}
+    for workers in args.workers:
+        port = free_port()
+        url = f"http://127.0.0.1:{port}"
+        server = start_server(workers, port, admin_token)
+        try:
+            wait_until_ready(url, server)
+            run_args = bench_run.parse_args([
+                "--url", url,
+                "--admin-token", admin_token,
+                "--tokens", str(args.tokens),
+                "--products", str(args.products),
+                "--requests", str(args.requests),
+                "--concurrency", str(args.concurrency),
+                "--scenarios", *args.scenarios,
+            ])
+            print(f"\n=== {workers} worker(s) ===")
+            results[workers] = asyncio.run(bench_run.run(run_args))["results"]
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+
+    print(f"\n{'workers':>8} " + " ".join(f"{name + ' rps':>14}" for name in args.scenarios))
+    for workers, scenario_results in results.items():
+        print(f"{workers:>8} " + " ".join(
+            f"{scenario_results[name]['throughput_rps']:>14}" for name in args.scenarios
+        ))
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
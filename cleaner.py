@@ -1,17 +1,73 @@
 import os
-import shutil
-from pathlib import Path
+import threading
+import time
+from itertools import islice
+from sqlalchemy import delete, update
 from sqlalchemy.orm import Session
-from typing import Dict, Any
+from typing import Dict, Any, Optional, Set
 
 import database
+from static_files import PRECOMPRESSED_ENCODINGS
+from storage import get_storage, name_from_url
+
+# Posición del recorrido incremental del recolector de archivos huérfanos
+_gc_cursor: Optional[str] = None
+_gc_lock = threading.Lock()
+
+def _clear_tables(db: Session, stats: Dict[str, Any]):
+    # Contar registros antes de eliminar
+    stats["products_deleted"] += db.query(database.Product).count()
+    stats["categories_deleted"] += db.query(database.Category).count()
+    stats["tags_deleted"] += db.query(database.Tag).count()
+    
+    # Eliminar todos los productos y sus relaciones con etiquetas (el borrado masivo no
+    # las elimina solo, y los ids se reutilizan cuando la tabla queda vacía)
+    db.query(database.RelatedProduct).delete()
+    db.execute(delete(database.product_tags))
+    db.query(database.Product).delete()
+    
+    # Eliminar todas las categorías
+    db.query(database.CategoryClosure).delete()
+    db.query(database.Category).delete()
+    
+    # Eliminar todas las etiquetas
+    db.query(database.Tag).delete()
+    
+    # Reiniciar los contadores de uso de todos los tokens. La tabla de tokens se
+    # conserva: los ids ya resueltos siguen cacheados en cada worker
+    db.query(database.TokenUsage).delete()
+    
+    # Eliminar carritos y pedidos
+    db.query(database.CartItem).delete()
+    db.query(database.Cart).delete()
+    db.query(database.OrderItem).delete()
+    db.query(database.Order).delete()
+    
+    # Las respuestas guardadas por Idempotency-Key hacen referencia a los datos eliminados
+    db.query(database.IdempotencyKey).delete()
+    
+    # Las filas se borraron sin dejar tombstones: los clientes de /sync deben descargar todo otra vez
+    db.query(database.Tombstone).delete()
+    reset = db.execute(
+        update(database.SyncState)
+        .values(
+            version=database.SyncState.version + 1,
+            reset_version=database.SyncState.version + 1,
+        )
+        .returning(database.SyncState.tenant_id, database.SyncState.version)
+    )
+    for tenant_id, version in reset.all():
+        database.record_change(db, tenant_id, {"type": "reset", "version": version})
+    
+    # Confirmar cambios en la base de datos
+    db.commit()
 
 def clean_all_data(db: Session) -> Dict[str, Any]:
     """
     Limpia completamente la base de datos eliminando todos los registros.
     
     Args:
-        db: Sesión de base de datos
+        db: Sesión de la base de datos principal (las bases por token también se limpian)
     
     Returns:
         Diccionario con estadísticas de limpieza
@@ -25,25 +81,12 @@ def clean_all_data(db: Session) -> Dict[str, Any]:
     }
     
     try:
-        # Contar registros antes de eliminar
-        products_count = db.query(database.Product).count()
-        categories_count = db.query(database.Category).count()
-        tags_count = db.query(database.Tag).count()
-        
-        # Eliminar todos los productos (esto también elimina las relaciones con etiquetas)
-        db.query(database.Product).delete()
-        stats["products_deleted"] = products_count
+        _clear_tables(db, stats)
         
-        # Eliminar todas las categorías
-        db.query(database.Category).delete()
-        stats["categories_deleted"] = categories_count
-        
-        # Eliminar todas las etiquetas
-        db.query(database.Tag).delete()
-        stats["tags_deleted"] = tags_count
-        
-        # Confirmar cambios en la base de datos
-        db.commit()
+        # Con bases separadas por token (DATABASE_SHARDING), cada archivo se limpia igual
+        for path in database.list_shard_paths():
+            with database.shard_session(path) as shard_db:
+                _clear_tables(shard_db, stats)
         
     except Exception as e:
         db.rollback()
@@ -55,7 +98,8 @@ def clean_all_data(db: Session) -> Dict[str, Any]:
 
 def clean_uploaded_files() -> Dict[str, Any]:
     """
-    Elimina todos los archivos subidos en el directorio uploads.
+    Elimina todos los archivos subidos del almacenamiento configurado
+    (directorio uploads o bucket S3).
     
     Returns:
         Diccionario con estadísticas de archivos eliminados
@@ -65,24 +109,10 @@ def clean_uploaded_files() -> Dict[str, Any]:
         "errors": []
     }
     
-    uploads_dir = Path("uploads")
-    
     try:
-        if uploads_dir.exists() and uploads_dir.is_dir():
-            # Contar archivos antes de eliminar
-            files_list = list(uploads_dir.glob("*"))
-            files_count = len([f for f in files_list if f.is_file()])
-            
-            # Eliminar todo el contenido del directorio
-            shutil.rmtree(uploads_dir)
-            
-            # Recrear el directorio vacío
-            uploads_dir.mkdir(exist_ok=True)
-            
-            stats["files_deleted"] = files_count
-            print(f"Eliminados {files_count} archivos del directorio uploads/")
-        else:
-            print("Directorio uploads no existe o está vacío")
+        files_count = get_storage().clear()
+        stats["files_deleted"] = files_count
+        print(f"Eliminados {files_count} archivos subidos")
             
     except Exception as e:
         error_msg = f"Error limpiando archivos: {e}"
@@ -120,3 +150,158 @@ def clean_everything(db: Session) -> Dict[str, Any]:
     
     print("✅ Limpieza completa finalizada")
     return combined_stats
+
+def referenced_picture_names(db: Session, batch_size: int = 1000) -> Set[str]:
+    """
+    Obtiene los nombres de todos los archivos referenciados por categorías y productos.
+    
+    Recorre las tablas por rangos de id (consultas cortas de `batch_size` filas)
+    para no mantener bloqueada la base de datos mientras se leen.
+    
+    Args:
+        db: Sesión de base de datos
+        batch_size: Filas leídas por consulta
+    
+    Returns:
+        Conjunto de nombres de archivo en uso
+    """
+    names = set()
+    sources = [
+        (database.Category, database.Category.picture),
+        (database.Product, database.Product.pictures),
+    ]
+    for model, column in sources:
+        last_id = 0
+        while True:
+            rows = (
+                db.query(model.id, column)
+                .filter(model.id > last_id, column.isnot(None))
+                .order_by(model.id)
+                .limit(batch_size)
+                .all()
+            )
+            if not rows:
+                break
+            for _, value in rows:
+                for picture_url in value.split(","):
+                    name = name_from_url(picture_url)
+                    if name:
+                        names.add(name)
+            last_id = rows[-1][0]
+    return names
+
+def is_referenced(name: str, referenced: Set[str]) -> bool:
+    """Un archivo está en uso si algún registro lo nombra, o si es la copia precomprimida (.br/.gz) de uno"""
+    if name in referenced:
+        return True
+    return any(
+        name.endswith(suffix) and name[:-len(suffix)] in referenced
+        for _, suffix in PRECOMPRESSED_ENCODINGS
+    )
+
+def collect_orphaned_files(
+    db: Session,
+    batch_size: int = 200,
+    max_files: int = 5000,
+    min_age: int = 3600,
+    pause: float = 0.0
+) -> Dict[str, Any]:
+    """
+    Elimina archivos subidos que ya no están referenciados en la base de datos.
+    
+    El recorrido es incremental: cada ejecución revisa como máximo `max_files`
+    archivos, en lotes de `batch_size`, y la siguiente continúa donde terminó
+    la anterior. Los archivos más nuevos que `min_age` segundos se respetan,
+    porque pueden pertenecer a una subida cuyo registro todavía no se guardó.
+    
+    Args:
+        db: Sesión de base de datos
+        batch_size: Archivos procesados por lote
+        max_files: Máximo de archivos revisados en esta ejecución
+        min_age: Antigüedad mínima (segundos) para eliminar un archivo
+        pause: Segundos de espera entre lotes
+    
+    Returns:
+        Diccionario con estadísticas de la recolección
+    """
+    global _gc_cursor
+    
+    stats = {
+        "files_scanned": 0,
+        "orphans_deleted": 0,
+        "bytes_reclaimed": 0,
+        "skipped_recent": 0,
+        "pass_completed": False,
+        "errors": []
+    }
+    
+    if not _gc_lock.acquire(blocking=False):
+        stats["errors"].append("La recolección de archivos ya está en ejecución")
+        return stats
+    
+    try:
+        storage = get_storage()
+        referenced = referenced_picture_names(db)
+        for path in database.list_shard_paths():
+            with database.shard_session(path) as shard_db:
+                referenced |= referenced_picture_names(shard_db)
+        cutoff = time.time() - min_age
+        files = storage.list(start_after=_gc_cursor)
+        
+        while stats["files_scanned"] < max_files:
+            batch = list(islice(files, min(batch_size, max_files - stats["files_scanned"])))
+            if not batch:
+                stats["pass_completed"] = True
+                _gc_cursor = None
+                break
+            
+            for stored in batch:
+                if is_referenced(stored.name, referenced):
+                    continue
+                if stored.modified > cutoff:
+                    stats["skipped_recent"] += 1
+                    continue
+                try:
+                    stats["bytes_reclaimed"] += storage.delete(stored.name)
+                    stats["orphans_deleted"] += 1
+                except Exception as e:
+                    stats["errors"].append(f"Error eliminando {stored.name}: {e}")
+            
+            stats["files_scanned"] += len(batch)
+            _gc_cursor = batch[-1].name
+            if pause:
+                time.sleep(pause)
+        
+        print(
+            f"Recolección de huérfanos: {stats['orphans_deleted']} archivos eliminados, "
+            f"{stats['bytes_reclaimed']} bytes liberados"
+        )
+    
+    except Exception as e:
+        error_msg = f"Error recolectando archivos huérfanos: {e}"
+        stats["errors"].append(error_msg)
+        print(error_msg)
+    
+    finally:
+        _gc_lock.release()
+    
+    return stats
+
+def run_scheduled_gc() -> Dict[str, Any]:
+    """
+    Ejecución programada del recolector de huérfanos con su propia sesión.
+    
+    Returns:
+        Diccionario con estadísticas de la recolección
+    """
+    db = database.SessionLocal()
+    try:
+        return collect_orphaned_files(
+            db,
+            batch_size=int(os.getenv("UPLOADS_GC_BATCH_SIZE", "200")),
+            max_files=int(os.getenv("UPLOADS_GC_MAX_FILES", "5000")),
+            min_age=int(os.getenv("UPLOADS_GC_MIN_AGE", "3600")),
+            pause=float(os.getenv("UPLOADS_GC_PAUSE", "0.05")),
+        )
+    finally:
+        db.close()
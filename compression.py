@@ -0,0 +1,131 @@
+import importlib.util
+import os
+import time
+from typing import Optional
+
+import anyio.to_thread
+from starlette.datastructures import Headers
+from starlette.middleware.gzip import GZipResponder, IdentityResponder
+
+import metrics
+
+# Compresión de respuestas (gzip y, si está instalado el paquete brotli, br)
+ENABLED = os.getenv("COMPRESSION_ENABLED", "true").lower() == "true"
+# Respuestas más chicas que esto se envían sin comprimir (no compensa el costo)
+MINIMUM_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+BROTLI_LEVEL = int(os.getenv("COMPRESSION_BROTLI_LEVEL", "4"))
+THREAD_MINIMUM_SIZE = 128 * 1024
+# Las imágenes ya están comprimidas
+EXCLUDED_PREFIXES = ("/uploads/",)
+
+BROTLI_AVAILABLE = importlib.util.find_spec("brotli") is not None
+
+
+def negotiate(accept_encoding: str) -> Optional[str]:
+    """
+    Elige la codificación según `Accept-Encoding` (respetando q=0).
+
+    Returns:
+        "br", "gzip" o None si el cliente no acepta ninguna
+    """
+    accepted = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding.strip().lower()] = quality
+
+    def quality_of(coding: str) -> float:
+        return accepted.get(coding, accepted.get("*", 0.0))
+
+    candidates = (["br"] if BROTLI_AVAILABLE else []) + ["gzip"]
+    best = max(candidates, key=quality_of)
+    return best if quality_of(best) > 0 else None
+
+
+class MeasuredResponderMixin:
+    """Registra en las métricas los bytes ahorrados y el tiempo de compresión."""
+
+    async def apply_compression(self, body: bytes, *, more_body: bool) -> bytes:
+        start = time.perf_counter()
+        compressed = await super().apply_compression(body, more_body=more_body)
+        metrics.record_compression(
+            self.content_encoding, len(body), len(compressed), time.perf_counter() - start
+        )
+        return compressed
+
+
+class BrotliResponder(IdentityResponder):
+    content_encoding = "br"
+
+    def __init__(self, app, minimum_size: int, quality: int = BROTLI_LEVEL):
+        super().__init__(app, minimum_size)
+        self.quality = quality
+        self.compressor = None
+
+    async def apply_compression(self, body: bytes, *, more_body: bool) -> bytes:
+        if len(body) >= THREAD_MINIMUM_SIZE:
+            # Igual que gzip en Starlette: bloques grandes se comprimen fuera del event loop
+            return await anyio.to_thread.run_sync(self.compress_body, body, more_body)
+        return self.compress_body(body, more_body)
+
+    def compress_body(self, body: bytes, more_body: bool) -> bytes:
+        if self.compressor is None:
+            import brotli
+            self.compressor = brotli.Compressor(quality=self.quality)
+        if more_body:
+            return self.compressor.process(body) + self.compressor.flush()
+        return self.compressor.process(body) + self.compressor.finish()
+
+
+class MeasuredGZipResponder(MeasuredResponderMixin, GZipResponder):
+    pass
+
+
+class MeasuredBrotliResponder(MeasuredResponderMixin, BrotliResponder):
+    pass
+
+
+class CompressionMiddleware:
+    """
+    Middleware ASGI que comprime las respuestas con brotli o gzip según
+    `Accept-Encoding`.
+
+    Reutiliza los responders de Starlette: respeta `MINIMUM_SIZE`, no vuelve a
+    comprimir respuestas con `Content-Encoding` ni tipos ya comprimidos
+    (imágenes) y agrega `Vary: Accept-Encoding`. `/uploads` no pasa por aquí.
+    Esos responders no son API pública, por eso requirements.txt fija la
+    versión menor de Starlette.
+    """
+
+    def __init__(
+        self,
+        app,
+        minimum_size: int = MINIMUM_SIZE,
+        gzip_level: int = GZIP_LEVEL,
+        brotli_level: int = BROTLI_LEVEL,
+    ):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_level = brotli_level
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(EXCLUDED_PREFIXES):
+            await self.app(scope, receive, send)
+            return
+
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding == "br":
+            responder = MeasuredBrotliResponder(self.app, self.minimum_size, quality=self.brotli_level)
+        elif encoding == "gzip":
+            responder = MeasuredGZipResponder(self.app, self.minimum_size, compresslevel=self.gzip_level)
+        else:
+            responder = IdentityResponder(self.app, self.minimum_size)
+        await responder(scope, receive, send)
@@ -1,97 +1,400 @@
-from sqlalchemy.orm import Session
-from typing import List, Optional
+from sqlalchemy import delete, func, insert, literal, select, true, union_all, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, aliased, selectinload
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+import os
 import database
 import schemas
+from storage import name_from_url
+
+# Per-token quotas (0 = unlimited)
+QUOTAS = {
+    "products": int(os.getenv("QUOTA_MAX_PRODUCTS", "1000")),
+    "categories": int(os.getenv("QUOTA_MAX_CATEGORIES", "100")),
+    "tags": int(os.getenv("QUOTA_MAX_TAGS", "200")),
+    "upload_bytes": int(os.getenv("QUOTA_MAX_UPLOAD_BYTES", str(50 * 1024 * 1024))),
+    # Carts not yet checked out: reserved on creation, released on checkout or deletion
+    "carts": int(os.getenv("QUOTA_MAX_OPEN_CARTS", "100")),
+}
+
+# Related products index: top-K per product, score = shared tags * tag weight (+ category weight)
+RELATED_TOP_K = int(os.getenv("RELATED_TOP_K", "10"))
+RELATED_TAG_WEIGHT = float(os.getenv("RELATED_TAG_WEIGHT", "1"))
+RELATED_CATEGORY_WEIGHT = float(os.getenv("RELATED_CATEGORY_WEIGHT", "0.5"))
+
+class QuotaExceededError(Exception):
+    def __init__(self, field: str, limit: int):
+        self.field = field
+        self.limit = limit
+        super().__init__(f"Cuota excedida: {field} (máximo {limit})")
+
+class DuplicateTitleError(Exception):
+    def __init__(self, entity: str, title: str):
+        self.entity = entity
+        self.title = title
+        super().__init__(f"Título repetido: {entity} {title!r}")
+
+class OutOfStockError(Exception):
+    def __init__(self, product_ids: List[int]):
+        self.product_ids = product_ids
+        super().__init__(f"Sin stock suficiente: {product_ids}")
+
+def _commit_unique_title(db: Session, entity: str, title: str):
+    # Categories and tags are unique per (tenant_id, title)
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise DuplicateTitleError(entity, title)
+
+# Token usage counters
+def get_token_usage(db: Session, tenant_id: int):
+    return db.get(database.TokenUsage, tenant_id)
+
+def reserve_usage(db: Session, tenant_id: int, field: str, amount: int = 1):
+    # Conditional UPDATE: the quota check and the increment are a single atomic statement
+    db.execute(
+        sqlite_insert(database.TokenUsage)
+        .values(tenant_id=tenant_id)
+        .on_conflict_do_nothing(index_elements=["tenant_id"])
+    )
+    column = getattr(database.TokenUsage, field)
+    statement = (
+        update(database.TokenUsage)
+        .where(database.TokenUsage.tenant_id == tenant_id)
+        .values({field: column + amount})
+    )
+    limit = QUOTAS[field]
+    if limit and amount > 0:
+        statement = statement.where(column + amount <= limit)
+    if db.execute(statement).rowcount == 0:
+        raise QuotaExceededError(field, limit)
+
+def release_usage(db: Session, tenant_id: int, field: str, amount: int = 1):
+    column = getattr(database.TokenUsage, field)
+    db.execute(
+        update(database.TokenUsage)
+        .where(database.TokenUsage.tenant_id == tenant_id)
+        .values({field: func.max(column - amount, 0)})
+    )
+
+def reset_token_usage(db: Session, tenant_id: int):
+    db.execute(
+        update(database.TokenUsage)
+        .where(database.TokenUsage.tenant_id == tenant_id)
+        .values(products=0, categories=0, tags=0, upload_bytes=0, carts=0)
+    )
+
+def token_usage_needs_rebuild(db: Session):
+    # Databases created before usage counters existed have data but no counters
+    if db.query(database.TokenUsage.tenant_id).first() is not None:
+        return False
+    return any(
+        db.query(model.id).first() is not None
+        for model in (database.Product, database.Category, database.Tag)
+    )
+
+def rebuild_token_usage(db: Session, picture_sizes: Dict[str, int]):
+    usage = {
+        row.tenant_id: {**row._asdict(), "upload_bytes": 0, "carts": 0}
+        for row in db.execute(_token_counts_query())
+    }
+    open_carts = db.query(database.Cart.tenant_id, func.count()).group_by(database.Cart.tenant_id)
+    for tenant_id, carts in open_carts:
+        usage.setdefault(tenant_id, {
+            "tenant_id": tenant_id, "products": 0, "categories": 0, "tags": 0, "upload_bytes": 0,
+        })["carts"] = carts
+    picture_columns = [
+        (database.Category.tenant_id, database.Category.picture),
+        (database.Product.tenant_id, database.Product.pictures),
+    ]
+    for tenant_column, picture_column in picture_columns:
+        for tenant_id, value in db.query(tenant_column, picture_column).filter(picture_column.isnot(None)):
+            for picture_url in value.split(","):
+                size = picture_sizes.get(name_from_url(picture_url), 0)
+                if size and tenant_id in usage:
+                    usage[tenant_id]["upload_bytes"] += size
+    db.query(database.TokenUsage).delete()
+    if usage:
+        db.execute(sqlite_insert(database.TokenUsage), list(usage.values()))
+    db.commit()
 
 # Category CRUD operations
-def get_categories(db: Session, token: str, skip: int = 0, limit: int = 100):
-    return db.query(database.Category).filter(database.Category.token == token).offset(skip).limit(limit).all()
+def get_categories(db: Session, tenant_id: int, skip: int = 0, limit: int = 100):
+    return db.query(database.Category).filter(database.Category.tenant_id == tenant_id).offset(skip).limit(limit).all()
 
-def get_category(db: Session, category_id: int, token: str):
-    return db.query(database.Category).filter(database.Category.id == category_id, database.Category.token == token).first()
+def get_category(db: Session, category_id: int, tenant_id: int):
+    return db.query(database.Category).filter(database.Category.id == category_id, database.Category.tenant_id == tenant_id).first()
 
-def create_category(db: Session, category: schemas.CategoryCreate, token: str):
-    db_category = database.Category(**category.dict(), token=token)
+def create_category(db: Session, category: schemas.CategoryCreate, tenant_id: int):
+    reserve_usage(db, tenant_id, "categories")
+    db_category = database.Category(**category.dict(), tenant_id=tenant_id)
     db.add(db_category)
-    db.commit()
+    # The id is needed for the category tree, so a repeated title already fails here
+    try:
+        db.flush()
+    except IntegrityError:
+        db.rollback()
+        raise DuplicateTitleError("categories", category.title)
+    _attach_category(db, db_category.id, db_category.parent_id)
+    _commit_unique_title(db, "categories", category.title)
     db.refresh(db_category)
     return db_category
 
-def update_category(db: Session, category_id: int, category: schemas.CategoryUpdate, token: str):
-    db_category = get_category(db, category_id, token)
+def update_category(db: Session, category_id: int, category: schemas.CategoryUpdate, tenant_id: int):
+    db_category = get_category(db, category_id, tenant_id)
     if db_category:
         update_data = category.dict(exclude_unset=True)
+        previous_parent_id = db_category.parent_id
         for field, value in update_data.items():
             setattr(db_category, field, value)
-        db.commit()
+        if db_category.parent_id != previous_parent_id:
+            _move_category(db, category_id, db_category.parent_id)
+        _commit_unique_title(db, "categories", db_category.title)
         db.refresh(db_category)
     return db_category
 
-def delete_category(db: Session, category_id: int, token: str):
-    db_category = get_category(db, category_id, token)
+def delete_category(db: Session, category_id: int, tenant_id: int):
+    db_category = get_category(db, category_id, tenant_id)
     if db_category:
+        # Its subcategories move up to its parent (not deleted with it)
+        _detach_category(db, category_id)
+        for child in db.query(database.Category).filter(database.Category.parent_id == category_id):
+            child.parent_id = db_category.parent_id
+        # Its products are left without category: their related products change
+        product_ids = [product.id for product in db_category.products]
         db.delete(db_category)
+        release_usage(db, tenant_id, "categories")
+        db.flush()
+        update_related(db, tenant_id, product_ids)
         db.commit()
     return db_category
 
+# Category tree: category_closure holds every (ancestor, descendant) pair, so subtrees and
+# paths to the root are single indexed queries instead of one query per level
+def _attach_category(db: Session, category_id: int, parent_id: Optional[int]):
+    # A new category is a leaf: its ancestors are the parent's ancestors, one level further away
+    closure = database.CategoryClosure
+    db.execute(insert(closure).values(ancestor_id=category_id, descendant_id=category_id, depth=0))
+    if parent_id is not None:
+        db.execute(insert(closure).from_select(
+            ["ancestor_id", "descendant_id", "depth"],
+            select(closure.ancestor_id, literal(category_id), closure.depth + 1)
+            .where(closure.descendant_id == parent_id),
+        ))
+
+def _move_category(db: Session, category_id: int, parent_id: Optional[int]):
+    # Paths inside the subtree are kept; paths from the old ancestors into it are replaced
+    # by paths from the new parent's ancestors (the caller rejects moves into the subtree)
+    closure = database.CategoryClosure
+    subtree = select(closure.descendant_id).where(closure.ancestor_id == category_id)
+    ancestors = select(closure.ancestor_id).where(closure.descendant_id == category_id, closure.depth > 0)
+    db.execute(
+        delete(closure)
+        .where(closure.descendant_id.in_(subtree), closure.ancestor_id.in_(ancestors))
+        .execution_options(synchronize_session=False)
+    )
+    if parent_id is not None:
+        above, below = aliased(closure), aliased(closure)
+        db.execute(insert(closure).from_select(
+            ["ancestor_id", "descendant_id", "depth"],
+            select(above.ancestor_id, below.descendant_id, above.depth + below.depth + 1)
+            .join_from(above, below, true())
+            .where(above.descendant_id == parent_id, below.ancestor_id == category_id),
+        ))
+
+def _detach_category(db: Session, category_id: int):
+    # Descendants get one level closer to the ancestors of the deleted category
+    closure = database.CategoryClosure
+    ancestors = select(closure.ancestor_id).where(closure.descendant_id == category_id, closure.depth > 0)
+    descendants = select(closure.descendant_id).where(closure.ancestor_id == category_id, closure.depth > 0)
+    db.execute(
+        update(closure)
+        .where(closure.ancestor_id.in_(ancestors), closure.descendant_id.in_(descendants))
+        .values(depth=closure.depth - 1)
+        .execution_options(synchronize_session=False)
+    )
+    db.execute(
+        delete(closure)
+        .where((closure.ancestor_id == category_id) | (closure.descendant_id == category_id))
+        .execution_options(synchronize_session=False)
+    )
+
+def is_in_category_subtree(db: Session, root_id: int, category_id: int):
+    """True if `category_id` is `root_id` or one of its descendants"""
+    return db.get(database.CategoryClosure, (root_id, category_id)) is not None
+
+def get_category_path(db: Session, tenant_id: int, category_id: int):
+    """Breadcrumb of a category: its ancestors from the root down to the category itself"""
+    return (
+        db.query(database.Category)
+        .join(database.CategoryClosure, database.CategoryClosure.ancestor_id == database.Category.id)
+        .filter(database.CategoryClosure.descendant_id == category_id, database.Category.tenant_id == tenant_id)
+        .order_by(database.CategoryClosure.depth.desc())
+        .all()
+    )
+
+def get_category_products(db: Session, tenant_id: int, category_id: int, recursive: bool = False, skip: int = 0, limit: int = 100):
+    if recursive:
+        subtree = select(database.CategoryClosure.descendant_id).where(database.CategoryClosure.ancestor_id == category_id)
+        in_category = database.Product.category_id.in_(subtree)
+    else:
+        in_category = database.Product.category_id == category_id
+    return (
+        db.query(database.Product)
+        .options(selectinload(database.Product.category), selectinload(database.Product.tags))
+        .filter(database.Product.tenant_id == tenant_id, in_category)
+        # Same order as ix_products_tenant_id_category_id: pages are read from the index, no sort
+        .order_by(database.Product.category_id, database.Product.id)
+        .offset(skip)
+        .limit(limit)
+        .all()
+    )
+
 # Tag CRUD operations
-def get_tags(db: Session, token: str, skip: int = 0, limit: int = 100):
-    return db.query(database.Tag).filter(database.Tag.token == token).offset(skip).limit(limit).all()
+def get_tags(db: Session, tenant_id: int, skip: int = 0, limit: int = 100):
+    return db.query(database.Tag).filter(database.Tag.tenant_id == tenant_id).offset(skip).limit(limit).all()
 
-def get_tag(db: Session, tag_id: int, token: str):
-    return db.query(database.Tag).filter(database.Tag.id == tag_id, database.Tag.token == token).first()
+def get_tag(db: Session, tag_id: int, tenant_id: int):
+    return db.query(database.Tag).filter(database.Tag.id == tag_id, database.Tag.tenant_id == tenant_id).first()
 
-def create_tag(db: Session, tag: schemas.TagCreate, token: str):
-    db_tag = database.Tag(**tag.dict(), token=token)
+def create_tag(db: Session, tag: schemas.TagCreate, tenant_id: int):
+    reserve_usage(db, tenant_id, "tags")
+    db_tag = database.Tag(**tag.dict(), tenant_id=tenant_id)
     db.add(db_tag)
-    db.commit()
+    _commit_unique_title(db, "tags", tag.title)
     db.refresh(db_tag)
     return db_tag
 
-def update_tag(db: Session, tag_id: int, tag: schemas.TagUpdate, token: str):
-    db_tag = get_tag(db, tag_id, token)
+def update_tag(db: Session, tag_id: int, tag: schemas.TagUpdate, tenant_id: int):
+    db_tag = get_tag(db, tag_id, tenant_id)
     if db_tag:
         update_data = tag.dict(exclude_unset=True)
         for field, value in update_data.items():
             setattr(db_tag, field, value)
-        db.commit()
+        _commit_unique_title(db, "tags", db_tag.title)
         db.refresh(db_tag)
     return db_tag
 
-def delete_tag(db: Session, tag_id: int, token: str):
-    db_tag = get_tag(db, tag_id, token)
+def delete_tag(db: Session, tag_id: int, tenant_id: int):
+    db_tag = get_tag(db, tag_id, tenant_id)
     if db_tag:
+        product_ids = [product.id for product in db_tag.products]
         db.delete(db_tag)
+        release_usage(db, tenant_id, "tags")
+        db.flush()
+        update_related(db, tenant_id, product_ids)
         db.commit()
     return db_tag
 
+# Upserts by natural key (tenant_id, title)
+def _upsert_by_title(db: Session, model, tenant_id: int, quota: str, title: str, values: Dict):
+    """INSERT ... ON CONFLICT (tenant_id, title) DO UPDATE. Returns (row, created)"""
+    existing = db.query(model).filter(model.tenant_id == tenant_id, model.title == title).first()
+    if existing is not None and all(getattr(existing, field) == value for field, value in values.items()):
+        # Repeating an upsert writes nothing (and does not wait for the write lock)
+        return existing, False
+
+    # The sync version is taken first: it holds SQLite's write lock, so the check can't race
+    version = database.next_sync_version(db, tenant_id)
+    created = db.execute(
+        select(model.id).where(model.tenant_id == tenant_id, model.title == title)
+    ).scalar() is None
+    if created:
+        reserve_usage(db, tenant_id, quota)
+    now = datetime.now(timezone.utc)
+    insert = sqlite_insert(model).values(tenant_id=tenant_id, title=title, updated_at=now, version=version, **values)
+    insert = insert.on_conflict_do_update(
+        index_elements=["tenant_id", "title"],
+        set_={**{field: insert.excluded[field] for field in values}, "updated_at": now, "version": version},
+    )
+    row_id = db.execute(insert.returning(model.id)).scalar_one()
+    if created and model is database.Category:
+        _attach_category(db, row_id, None)
+    database.record_change(db, tenant_id, {
+        "type": "created" if created else "updated",
+        "entity": database.SYNCED_ENTITIES[model],
+        "version": version,
+        "id": row_id,
+    })
+    db.commit()
+    return db.get(model, row_id), created
+
+def upsert_category(db: Session, tenant_id: int, title: str, category: schemas.CategoryUpsert):
+    return _upsert_by_title(db, database.Category, tenant_id, "categories", title, category.dict())
+
+def upsert_tag(db: Session, tenant_id: int, title: str):
+    return _upsert_by_title(db, database.Tag, tenant_id, "tags", title, {})
+
 # Product CRUD operations
-def get_products(db: Session, token: str, skip: int = 0, limit: int = 100):
-    return db.query(database.Product).filter(database.Product.token == token).offset(skip).limit(limit).all()
+def get_products(db: Session, tenant_id: int, skip: int = 0, limit: int = 100):
+    return db.query(database.Product).filter(database.Product.tenant_id == tenant_id).offset(skip).limit(limit).all()
+
+def _compact_products(db: Session, products: List[database.Product]):
+    product_ids = [product.id for product in products]
+
+    # One query per side table instead of one lazy load per product
+    tag_ids_by_product = {}
+    if product_ids:
+        rows = db.execute(
+            select(database.product_tags.c.product_id, database.product_tags.c.tag_id)
+            .where(database.product_tags.c.product_id.in_(product_ids))
+        )
+        for product_id, tag_id in rows:
+            tag_ids_by_product.setdefault(product_id, []).append(tag_id)
+
+    return [
+        {
+            "id": product.id,
+            "title": product.title,
+            "description": product.description,
+            "price": product.price,
+            "stock": product.stock,
+            "category_id": product.category_id,
+            "pictures": product.pictures.split(",") if product.pictures else [],
+            "tag_ids": tag_ids_by_product.get(product.id, []),
+            "updated_at": product.updated_at,
+        }
+        for product in products
+    ]
+
+def compact_product_list(db: Session, products: List[database.Product]):
+    products = _compact_products(db, products)
+
+    category_ids = {product["category_id"] for product in products if product["category_id"] is not None}
+    tag_ids = {tag_id for product in products for tag_id in product["tag_ids"]}
+    categories = db.query(database.Category).filter(database.Category.id.in_(category_ids)).all() if category_ids else []
+    tags = db.query(database.Tag).filter(database.Tag.id.in_(tag_ids)).all() if tag_ids else []
+
+    return {"products": products, "categories": categories, "tags": tags}
 
-def get_product(db: Session, product_id: int, token: str):
-    return db.query(database.Product).filter(database.Product.id == product_id, database.Product.token == token).first()
+def get_product(db: Session, product_id: int, tenant_id: int):
+    return db.query(database.Product).filter(database.Product.id == product_id, database.Product.tenant_id == tenant_id).first()
 
-def create_product(db: Session, product: schemas.ProductCreate, token: str):
+def create_product(db: Session, product: schemas.ProductCreate, tenant_id: int):
     product_data = product.dict()
     tag_ids = product_data.pop('tag_ids', [])
     
-    db_product = database.Product(**product_data, token=token)
-    db.add(db_product)
-    db.commit()
-    db.refresh(db_product)
+    reserve_usage(db, tenant_id, "products")
+    db_product = database.Product(**product_data, tenant_id=tenant_id)
     
     # Add tags
     if tag_ids:
-        tags = db.query(database.Tag).filter(database.Tag.id.in_(tag_ids), database.Tag.token == token).all()
+        tags = db.query(database.Tag).filter(database.Tag.id.in_(tag_ids), database.Tag.tenant_id == tenant_id).all()
         db_product.tags = tags
-        db.commit()
-        db.refresh(db_product)
     
+    db.add(db_product)
+    db.flush()
+    update_related(db, tenant_id, [db_product.id])
+    db.commit()
+    db.refresh(db_product)
     return db_product
 
-def update_product(db: Session, product_id: int, product: schemas.ProductUpdate, token: str):
-    db_product = get_product(db, product_id, token)
+def update_product(db: Session, product_id: int, product: schemas.ProductUpdate, tenant_id: int):
+    db_product = get_product(db, product_id, tenant_id)
     if db_product:
         update_data = product.dict(exclude_unset=True)
         tag_ids = update_data.pop('tag_ids', None)
@@ -101,16 +404,488 @@ def update_product(db: Session, product_id: int, product: schemas.ProductUpdate,
         
         # Update tags if provided
         if tag_ids is not None:
-            tags = db.query(database.Tag).filter(database.Tag.id.in_(tag_ids), database.Tag.token == token).all()
+            tags = db.query(database.Tag).filter(database.Tag.id.in_(tag_ids), database.Tag.tenant_id == tenant_id).all()
             db_product.tags = tags
         
+        if tag_ids is not None or "category_id" in update_data:
+            db.flush()
+            update_related(db, tenant_id, [product_id])
         db.commit()
         db.refresh(db_product)
     return db_product
 
-def delete_product(db: Session, product_id: int, token: str):
-    db_product = get_product(db, product_id, token)
+def delete_product(db: Session, product_id: int, tenant_id: int):
+    db_product = get_product(db, product_id, tenant_id)
     if db_product:
         db.delete(db_product)
+        db.query(database.CartItem).filter(database.CartItem.product_id == product_id).delete()
+        release_usage(db, tenant_id, "products")
+        db.flush()
+        remove_related(db, tenant_id, product_id)
         db.commit()
     return db_product
+
+# Tag membership deltas: direct inserts/deletes on product_tags, without loading collections
+def _touch_products(db: Session, tenant_id: int, product_ids: List[int]):
+    """New sync version for products whose tag_ids changed (the flush hook only sees ORM changes)"""
+    if not product_ids:
+        return
+    version = database.next_sync_version(db, tenant_id)
+    db.execute(
+        update(database.Product)
+        .where(database.Product.id.in_(product_ids))
+        .values(updated_at=datetime.now(timezone.utc), version=version)
+    )
+    for product_id in product_ids:
+        database.record_change(db, tenant_id, {"type": "updated", "entity": "product", "version": version, "id": product_id})
+
+def update_tag_products(db: Session, tenant_id: int, tag_id: int, add: List[int], remove: List[int]):
+    """
+    Attach/detach a tag (already checked to belong to the tenant) to a set of products.
+    Returns the products actually added and removed, and the ids not found for the tenant.
+    """
+    requested = list(dict.fromkeys([*add, *remove]))
+    owned = set(db.execute(
+        select(database.Product.id)
+        .where(database.Product.id.in_(requested), database.Product.tenant_id == tenant_id)
+    ).scalars())
+    to_add = [product_id for product_id in dict.fromkeys(add) if product_id in owned]
+    to_remove = [product_id for product_id in dict.fromkeys(remove) if product_id in owned]
+
+    added, removed = [], []
+    if to_add:
+        added = db.execute(
+            sqlite_insert(database.product_tags)
+            .values([{"product_id": product_id, "tag_id": tag_id} for product_id in to_add])
+            .on_conflict_do_nothing(index_elements=["product_id", "tag_id"])
+            .returning(database.product_tags.c.product_id)
+        ).scalars().all()
+    if to_remove:
+        removed = db.execute(
+            delete(database.product_tags)
+            .where(database.product_tags.c.tag_id == tag_id, database.product_tags.c.product_id.in_(to_remove))
+            .returning(database.product_tags.c.product_id)
+        ).scalars().all()
+    changed = list(dict.fromkeys([*added, *removed]))
+    _touch_products(db, tenant_id, changed)
+    update_related(db, tenant_id, changed)
+    db.commit()
+    return {
+        "added": sorted(added),
+        "removed": sorted(removed),
+        "missing": [product_id for product_id in requested if product_id not in owned],
+    }
+
+# Related products index: maintained on every change to a product's tags or category,
+# so GET /products/{id}/related is a single indexed read
+def _related_scores(db: Session, tenant_id: int, product_id: int, limit: Optional[int] = None):
+    """(related_id, score) of the products similar to product_id, best first (ties: lowest id)"""
+    mine = database.product_tags.alias("mine")
+    other = database.product_tags.alias("other")
+    candidates = [
+        select(other.c.product_id.label("id"), (func.count() * RELATED_TAG_WEIGHT).label("score"))
+        .select_from(mine.join(other, other.c.tag_id == mine.c.tag_id))
+        .where(mine.c.product_id == product_id, other.c.product_id != product_id)
+        .group_by(other.c.product_id)
+    ]
+    if RELATED_CATEGORY_WEIGHT:
+        category_id = select(database.Product.category_id).where(database.Product.id == product_id).scalar_subquery()
+        candidates.append(
+            select(database.Product.id.label("id"), literal(RELATED_CATEGORY_WEIGHT).label("score"))
+            .where(
+                database.Product.tenant_id == tenant_id,
+                database.Product.category_id == category_id,
+                database.Product.id != product_id,
+            )
+        )
+    scored = union_all(*candidates).subquery()
+    score = func.sum(scored.c.score)
+    query = (
+        select(scored.c.id, score)
+        .group_by(scored.c.id)
+        .having(score > 0)
+        .order_by(score.desc(), scored.c.id)
+    )
+    if limit is not None:
+        query = query.limit(limit)
+    return db.execute(query).all()
+
+def _store_related(db: Session, product_id: int, scores):
+    db.execute(delete(database.RelatedProduct).where(database.RelatedProduct.product_id == product_id))
+    if scores:
+        db.execute(sqlite_insert(database.RelatedProduct), [
+            {"product_id": product_id, "related_id": related_id, "score": score}
+            for related_id, score in scores
+        ])
+
+def _weakest_related(db: Session, product_ids: List[int]):
+    """Size and last entry (score, related_id) of the stored lists of these products"""
+    model = database.RelatedProduct
+    ranked = select(
+        model.product_id,
+        model.related_id,
+        model.score,
+        func.count().over(partition_by=model.product_id).label("size"),
+        func.row_number().over(
+            partition_by=model.product_id, order_by=(model.score.asc(), model.related_id.desc())
+        ).label("position"),
+    ).where(model.product_id.in_(product_ids)).subquery()
+    rows = db.execute(
+        select(ranked.c.product_id, ranked.c.size, ranked.c.score, ranked.c.related_id)
+        .where(ranked.c.position == 1)
+    )
+    return {row.product_id: (row.size, row.score, row.related_id) for row in rows}
+
+def update_related(db: Session, tenant_id: int, product_ids: List[int]):
+    """
+    Update the index after the tags or category of these products changed (already flushed).
+
+    Each product's own list is recomputed. Scores are symmetric, so the other lists only
+    change where this product enters, moves or leaves: lists that held it and now score
+    it lower are recomputed, and it is inserted into lists whose weakest entry it now beats.
+    """
+    model = database.RelatedProduct
+    for product_id in dict.fromkeys(product_ids):
+        scores = dict(_related_scores(db, tenant_id, product_id))
+        _store_related(db, product_id, list(scores.items())[:RELATED_TOP_K])
+
+        holders = db.execute(select(model.product_id, model.score).where(model.related_id == product_id)).all()
+        for holder_id, old_score in holders:
+            new_score = scores.get(holder_id)
+            if new_score is None or new_score < old_score:
+                # Another product may now rank above it: recompute that list
+                _store_related(db, holder_id, _related_scores(db, tenant_id, holder_id, RELATED_TOP_K))
+            elif new_score != old_score:
+                db.execute(
+                    update(model)
+                    .where(model.product_id == holder_id, model.related_id == product_id)
+                    .values(score=new_score)
+                )
+
+        held = {holder_id for holder_id, _ in holders}
+        candidates = [candidate_id for candidate_id in scores if candidate_id not in held]
+        weakest = _weakest_related(db, candidates) if candidates else {}
+        for candidate_id in candidates:
+            score = scores[candidate_id]
+            size, weakest_score, weakest_id = weakest.get(candidate_id, (0, None, None))
+            if size >= RELATED_TOP_K:
+                if score < weakest_score or (score == weakest_score and product_id > weakest_id):
+                    continue
+                db.execute(delete(model).where(model.product_id == candidate_id, model.related_id == weakest_id))
+            db.execute(sqlite_insert(model).values(product_id=candidate_id, related_id=product_id, score=score))
+
+def remove_related(db: Session, tenant_id: int, product_id: int):
+    """Drop a deleted product (already flushed) from the index and refill the lists that held it"""
+    model = database.RelatedProduct
+    holders = db.execute(select(model.product_id).where(model.related_id == product_id)).scalars().all()
+    db.execute(delete(model).where((model.product_id == product_id) | (model.related_id == product_id)))
+    for holder_id in holders:
+        _store_related(db, holder_id, _related_scores(db, tenant_id, holder_id, RELATED_TOP_K))
+
+def get_related_products(db: Session, tenant_id: int, product_id: int, limit: int = RELATED_TOP_K):
+    """Related products with their score, best first"""
+    scores = dict(db.execute(
+        select(database.RelatedProduct.related_id, database.RelatedProduct.score)
+        .where(database.RelatedProduct.product_id == product_id)
+        .order_by(database.RelatedProduct.score.desc(), database.RelatedProduct.related_id)
+        .limit(limit)
+    ).all())
+    products, _ = get_products_by_ids(db, tenant_id, list(scores))
+    return [(product, scores[product.id]) for product in products]
+
+def related_index_needs_rebuild(db: Session):
+    # Databases created before the index existed: empty index, but some products are related
+    if db.query(database.RelatedProduct.product_id).first() is not None:
+        return False
+    shared_category = (
+        db.query(database.Product.category_id)
+        .filter(database.Product.category_id.isnot(None))
+        .group_by(database.Product.tenant_id, database.Product.category_id)
+        .having(func.count() > 1)
+        .first()
+    )
+    shared_tag = (
+        db.query(database.product_tags.c.tag_id)
+        .group_by(database.product_tags.c.tag_id)
+        .having(func.count() > 1)
+        .first()
+    )
+    return shared_category is not None or shared_tag is not None
+
+def rebuild_related_index(db: Session):
+    db.query(database.RelatedProduct).delete()
+    for product_id, tenant_id in db.query(database.Product.id, database.Product.tenant_id).all():
+        _store_related(db, product_id, _related_scores(db, tenant_id, product_id, RELATED_TOP_K))
+    db.commit()
+
+# Carts and orders
+def get_cart(db: Session, cart_id: int, tenant_id: int):
+    return db.query(database.Cart).filter(database.Cart.id == cart_id, database.Cart.tenant_id == tenant_id).first()
+
+def create_cart(db: Session, tenant_id: int):
+    reserve_usage(db, tenant_id, "carts")
+    db_cart = database.Cart(tenant_id=tenant_id, created_at=datetime.now(timezone.utc))
+    db.add(db_cart)
+    db.commit()
+    db.refresh(db_cart)
+    return db_cart
+
+def set_cart_item(db: Session, cart_id: int, product_id: int, quantity: int):
+    item = database.CartItem
+    if quantity:
+        insert = sqlite_insert(item).values(cart_id=cart_id, product_id=product_id, quantity=quantity)
+        db.execute(insert.on_conflict_do_update(
+            index_elements=["cart_id", "product_id"],
+            set_={"quantity": insert.excluded.quantity},
+        ))
+    else:
+        db.execute(delete(item).where(item.cart_id == cart_id, item.product_id == product_id))
+    db.commit()
+
+def delete_cart(db: Session, cart_id: int, tenant_id: int):
+    db_cart = get_cart(db, cart_id, tenant_id)
+    if db_cart:
+        db.delete(db_cart)
+        release_usage(db, tenant_id, "carts")
+        db.commit()
+    return db_cart
+
+def cart_contents(db: Session, cart_id: int):
+    """Cart with current titles, prices and stock, in one query"""
+    rows = db.execute(
+        select(
+            database.CartItem.product_id, database.CartItem.quantity,
+            database.Product.title, database.Product.price, database.Product.stock,
+        )
+        .join(database.Product, database.Product.id == database.CartItem.product_id)
+        .where(database.CartItem.cart_id == cart_id)
+        .order_by(database.CartItem.product_id)
+    ).all()
+    items = [row._asdict() for row in rows]
+    return {
+        "id": cart_id,
+        "items": items,
+        "total": round(sum(item["price"] * item["quantity"] for item in items), 2),
+    }
+
+def checkout(db: Session, tenant_id: int, cart_id: int):
+    """
+    Turn a cart into an order in a single transaction.
+    
+    Stock is decremented with one conditional UPDATE per product (stock >= quantity),
+    so concurrent checkouts can never oversell. Returns None if the cart does not
+    exist, is empty or was checked out concurrently; raises OutOfStockError with the
+    products that are short, leaving stock and cart untouched.
+    """
+    # The sync version is taken first: it holds SQLite's write lock for the whole checkout
+    version = database.next_sync_version(db, tenant_id)
+    claimed = db.execute(
+        delete(database.Cart).where(database.Cart.id == cart_id, database.Cart.tenant_id == tenant_id)
+    ).rowcount
+    items = db.execute(
+        delete(database.CartItem)
+        .where(database.CartItem.cart_id == cart_id)
+        .returning(database.CartItem.product_id, database.CartItem.quantity)
+    ).all()
+    if not claimed or not items:
+        db.rollback()
+        return None
+
+    now = datetime.now(timezone.utc)
+    order_items, out_of_stock = [], []
+    for product_id, quantity in sorted(items):
+        sold = db.execute(
+            update(database.Product)
+            .where(
+                database.Product.id == product_id,
+                database.Product.tenant_id == tenant_id,
+                database.Product.stock >= quantity,
+            )
+            .values(stock=database.Product.stock - quantity, updated_at=now, version=version)
+            .returning(database.Product.title, database.Product.price)
+        ).first()
+        if sold is None:
+            out_of_stock.append(product_id)
+        else:
+            order_items.append(database.OrderItem(
+                product_id=product_id, title=sold.title, unit_price=sold.price, quantity=quantity,
+            ))
+    if out_of_stock:
+        db.rollback()
+        raise OutOfStockError(out_of_stock)
+
+    db_order = database.Order(
+        tenant_id=tenant_id,
+        created_at=now,
+        total=round(sum(item.unit_price * item.quantity for item in order_items), 2),
+        items=order_items,
+    )
+    db.add(db_order)
+    release_usage(db, tenant_id, "carts")
+    for item in order_items:
+        database.record_change(db, tenant_id, {"type": "updated", "entity": "product", "version": version, "id": item.product_id})
+    db.commit()
+    db.refresh(db_order)
+    return db_order
+
+def get_orders(db: Session, tenant_id: int, skip: int = 0, limit: int = 100):
+    return (
+        db.query(database.Order)
+        .options(selectinload(database.Order.items))
+        .filter(database.Order.tenant_id == tenant_id)
+        .order_by(database.Order.id.desc())
+        .offset(skip).limit(limit)
+        .all()
+    )
+
+def get_order(db: Session, order_id: int, tenant_id: int):
+    return db.query(database.Order).filter(database.Order.id == order_id, database.Order.tenant_id == tenant_id).first()
+
+# Batch fetch (?ids=1,2,3): one IN query, results in the requested order
+def _get_by_ids(db: Session, model, tenant_id: int, ids: List[int], *options):
+    rows = db.query(model).options(*options).filter(model.id.in_(ids), model.tenant_id == tenant_id).all()
+    by_id = {row.id: row for row in rows}
+    found = [by_id[item_id] for item_id in ids if item_id in by_id]
+    missing = [item_id for item_id in ids if item_id not in by_id]
+    return found, missing
+
+def get_categories_by_ids(db: Session, tenant_id: int, ids: List[int]):
+    return _get_by_ids(db, database.Category, tenant_id, ids)
+
+def get_tags_by_ids(db: Session, tenant_id: int, ids: List[int]):
+    return _get_by_ids(db, database.Tag, tenant_id, ids)
+
+def get_products_by_ids(db: Session, tenant_id: int, ids: List[int]):
+    # Categories and tags in one query each instead of lazy loads per product
+    return _get_by_ids(
+        db, database.Product, tenant_id, ids,
+        selectinload(database.Product.category), selectinload(database.Product.tags),
+    )
+
+# Incremental sync
+def reset_sync(db: Session, tenant_id: int):
+    """Drop the tenant's tombstones and force clients to download everything again"""
+    db.flush()
+    db.query(database.Tombstone).filter(database.Tombstone.tenant_id == tenant_id).delete()
+    version = database.next_sync_version(db, tenant_id)
+    db.execute(
+        update(database.SyncState)
+        .where(database.SyncState.tenant_id == tenant_id)
+        .values(reset_version=version)
+    )
+    database.record_change(db, tenant_id, {"type": "reset", "version": version})
+
+def get_changes(db: Session, tenant_id: int, since: int = 0):
+    state = db.get(database.SyncState, tenant_id)
+    cursor = state.version if state else 0
+    # A cursor from before a reset (or from a database that was recreated) cannot be resumed
+    reset = since <= 0 or since > cursor or (state is not None and since < state.reset_version)
+    lower = -1 if reset else since
+
+    # Rows changed after `cursor` was read are left for the next sync, so every change
+    # is delivered exactly once even without a snapshot across these queries
+    def changed(model):
+        return (
+            db.query(model)
+            .filter(model.tenant_id == tenant_id, model.version > lower, model.version <= cursor)
+            .order_by(model.version)
+            .all()
+        )
+
+    deleted = []
+    if not reset:
+        deleted = (
+            db.query(database.Tombstone.entity, database.Tombstone.entity_id.label("id"))
+            .filter(
+                database.Tombstone.tenant_id == tenant_id,
+                database.Tombstone.version > lower,
+                database.Tombstone.version <= cursor,
+            )
+            .order_by(database.Tombstone.version)
+            .all()
+        )
+
+    return {
+        "products": _compact_products(db, changed(database.Product)),
+        "categories": changed(database.Category),
+        "tags": changed(database.Tag),
+        "deleted": [row._asdict() for row in deleted],
+        "cursor": cursor,
+        "reset": reset,
+    }
+
+# Statistics (admin)
+def get_global_counts(db: Session):
+    return {
+        "products": db.query(func.count(database.Product.id)).scalar(),
+        "categories": db.query(func.count(database.Category.id)).scalar(),
+        "tags": db.query(func.count(database.Tag.id)).scalar(),
+    }
+
+def _token_counts_query():
+    # One GROUP BY per table (each served by its tenant_id index), merged per tenant
+    per_table = union_all(
+        select(database.Product.tenant_id.label("tenant_id"), func.count().label("products"),
+               literal(0).label("categories"), literal(0).label("tags"))
+        .group_by(database.Product.tenant_id),
+        select(database.Category.tenant_id, literal(0), func.count(), literal(0))
+        .group_by(database.Category.tenant_id),
+        select(database.Tag.tenant_id, literal(0), literal(0), func.count())
+        .group_by(database.Tag.tenant_id),
+    ).subquery()
+
+    return (
+        select(
+            per_table.c.tenant_id,
+            func.sum(per_table.c.products).label("products"),
+            func.sum(per_table.c.categories).label("categories"),
+            func.sum(per_table.c.tags).label("tags"),
+        )
+        .group_by(per_table.c.tenant_id)
+    )
+
+def _token_stats_query():
+    # Tokens are only known by their hash: that is what admins see
+    counts = _token_counts_query().subquery()
+    return (
+        select(
+            database.Tenant.token_hash,
+            counts.c.products,
+            counts.c.categories,
+            counts.c.tags,
+        )
+        .select_from(counts)
+        .outerjoin(database.Tenant, database.Tenant.id == counts.c.tenant_id)
+    )
+
+def get_token_counts(db: Session, skip: int = 0, limit: int = 100):
+    query = _token_stats_query()
+    total_tokens = db.execute(select(func.count()).select_from(query.subquery())).scalar()
+    ordered = query.order_by(query.selected_columns.products.desc(), query.selected_columns.token_hash)
+    rows = db.execute(ordered.offset(skip).limit(limit)).all()
+    return total_tokens, [row._asdict() for row in rows]
+
+def _merge_token_counts(db: Session, per_token: Dict[str, dict]):
+    for row in db.execute(_token_stats_query()):
+        counts = per_token.setdefault(
+            row.token_hash, {"token_hash": row.token_hash, "products": 0, "categories": 0, "tags": 0}
+        )
+        counts["products"] += row.products
+        counts["categories"] += row.categories
+        counts["tags"] += row.tags
+
+def get_all_counts(db: Session, skip: int = 0, limit: int = 100):
+    if database.SHARDING == "none":
+        total_tokens, tokens = get_token_counts(db, skip=skip, limit=limit)
+        return get_global_counts(db), total_tokens, tokens
+
+    # Sharded: aggregate each database (main + shards) and merge per token in Python
+    totals = Counter(get_global_counts(db))
+    per_token = {}
+    _merge_token_counts(db, per_token)
+    for path in database.list_shard_paths():
+        with database.shard_session(path) as shard_db:
+            totals.update(get_global_counts(shard_db))
+            _merge_token_counts(shard_db, per_token)
+    ordered = sorted(per_token.values(), key=lambda counts: (-counts["products"], counts["token_hash"] or ""))
+    return dict(totals), len(ordered), ordered[skip:skip + limit]
@@ -1,11 +1,58 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, ForeignKey, Table
+from sqlalchemy import create_engine, event, inspect, text, Column, DateTime, Integer, LargeBinary, String, Float, ForeignKey, Index, Table
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.orm import Session, sessionmaker, relationship
+from collections import OrderedDict
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from fastapi import Depends
+from typing import Callable, List, Optional
+import glob
+import hashlib
 import os
+import threading
+
+from auth import get_current_token, hash_token
 
 # Database configuration
 DATABASE_URL = "sqlite:///./ecommerce.db"
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+
+# Optional sharding: "token" (one SQLite file per token) or "hash" (DATABASE_SHARD_COUNT files)
+SHARDING = os.getenv("DATABASE_SHARDING", "none").lower()
+if SHARDING not in ("none", "token", "hash"):
+    raise RuntimeError(f"DATABASE_SHARDING desconocido: {SHARDING}")
+SHARD_COUNT = int(os.getenv("DATABASE_SHARD_COUNT", "16"))
+SHARDS_DIR = os.getenv("DATABASE_SHARDS_DIR", "shards")
+# Shard engines kept open; the least recently used ones are disposed
+ENGINE_CACHE_SIZE = int(os.getenv("DATABASE_ENGINE_CACHE_SIZE", "64"))
+
+# Several worker processes share the SQLite files: WAL lets readers run alongside the
+# writer, and writers wait for the lock instead of failing with "database is locked"
+SQLITE_WAL = os.getenv("SQLITE_WAL", "true").lower() == "true"
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+def _configure_sqlite_connection(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}")
+    if SQLITE_WAL:
+        cursor.execute("PRAGMA journal_mode = WAL")
+    cursor.close()
+
+# Functions applied to every engine (main and shards), e.g. metrics instrumentation
+_engine_hooks: List[Callable[[Engine], None]] = []
+
+def create_sqlite_engine(url: str) -> Engine:
+    # No cap on overflow connections: a request keeps its session's connection until get_db
+    # closes it on a threadpool thread, so with a capped pool, hundreds of concurrent requests
+    # leave every thread waiting for a connection held by a request waiting for a thread
+    sqlite_engine = create_engine(url, connect_args={"check_same_thread": False}, max_overflow=-1)
+    event.listen(sqlite_engine, "connect", _configure_sqlite_connection)
+    for hook in _engine_hooks:
+        hook(sqlite_engine)
+    return sqlite_engine
+
+engine = create_sqlite_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
@@ -14,49 +61,515 @@ product_tags = Table(
     'product_tags',
     Base.metadata,
     Column('product_id', Integer, ForeignKey('products.id')),
-    Column('tag_id', Integer, ForeignKey('tags.id'))
+    Column('tag_id', Integer, ForeignKey('tags.id')),
+    # Lets tags be attached with INSERT ... ON CONFLICT DO NOTHING; tag_id for the tag -> products side
+    Index('ux_product_tags_product_id_tag_id', 'product_id', 'tag_id', unique=True),
+    Index('ix_product_tags_tag_id', 'tag_id')
 )
 
+class Tenant(Base):
+    __tablename__ = "tokens"
+    # AUTOINCREMENT: ids are never reused, so a cached id can never point to another token
+    __table_args__ = {"sqlite_autoincrement": True}
+    
+    # Bearer tokens are stored hashed; data tables reference the compact integer id
+    id = Column(Integer, primary_key=True)
+    token_hash = Column(String, unique=True, nullable=False)
+
 class Category(Base):
     __tablename__ = "categories"
+    __table_args__ = (
+        # Delta sync reads "changed since version N" for one tenant
+        Index("ix_categories_tenant_id_version", "tenant_id", "version"),
+        # Natural key: upserts by title (INSERT ... ON CONFLICT) and no duplicates on retries
+        Index("ux_categories_tenant_id_title", "tenant_id", "title", unique=True),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String, index=True)
     description = Column(String)
     picture = Column(String)
-    token = Column(String, index=True)
+    parent_id = Column(Integer, ForeignKey("categories.id"), index=True)  # None for top-level categories
+    tenant_id = Column(Integer, index=True)
+    updated_at = Column(DateTime)
+    version = Column(Integer)  # Sync version of the last change
     
     products = relationship("Product", back_populates="category")
 
+class CategoryClosure(Base):
+    __tablename__ = "category_closure"
+    # Clustered by ancestor (subtrees, no rowid); (descendant_id, depth) walks up to the root in order
+    __table_args__ = (
+        Index("ix_category_closure_descendant_id_depth", "descendant_id", "depth"),
+        {"sqlite_with_rowid": False},
+    )
+    
+    # One row per (ancestor, descendant) pair of the category tree, itself included at depth 0.
+    # Kept up to date by crud when categories are created, moved or deleted
+    ancestor_id = Column(Integer, ForeignKey("categories.id"), primary_key=True)
+    descendant_id = Column(Integer, ForeignKey("categories.id"), primary_key=True)
+    depth = Column(Integer, nullable=False)
+
 class Tag(Base):
     __tablename__ = "tags"
+    __table_args__ = (
+        # Delta sync reads "changed since version N" for one tenant
+        Index("ix_tags_tenant_id_version", "tenant_id", "version"),
+        # Natural key: upserts by title (INSERT ... ON CONFLICT) and no duplicates on retries
+        Index("ux_tags_tenant_id_title", "tenant_id", "title", unique=True),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String, index=True)
-    token = Column(String, index=True)
+    tenant_id = Column(Integer, index=True)
+    updated_at = Column(DateTime)
+    version = Column(Integer)  # Sync version of the last change
     
     products = relationship("Product", secondary=product_tags, back_populates="tags")
 
 class Product(Base):
     __tablename__ = "products"
+    # Delta sync reads "changed since version N" for one tenant
+    __table_args__ = (
+        Index("ix_products_tenant_id_version", "tenant_id", "version"),
+        # Products of a category (or of a whole subtree, through category_closure)
+        Index("ix_products_tenant_id_category_id", "tenant_id", "category_id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String, index=True)
     description = Column(String)
     price = Column(Float)
     pictures = Column(String)  # Store as comma-separated paths
+    # Only changed with conditional UPDATEs (stock >= quantity), never read-modify-write
+    stock = Column(Integer, nullable=False, default=0, server_default="0")
     category_id = Column(Integer, ForeignKey("categories.id"))
-    token = Column(String, index=True)
+    tenant_id = Column(Integer, index=True)
+    updated_at = Column(DateTime)
+    version = Column(Integer)  # Sync version of the last change
     
     category = relationship("Category", back_populates="products")
     tags = relationship("Tag", secondary=product_tags, back_populates="products")
 
+class RelatedProduct(Base):
+    __tablename__ = "related_products"
+    # Clustered by product (no rowid); related_id finds the lists that hold a product
+    __table_args__ = (Index("ix_related_products_related_id", "related_id"), {"sqlite_with_rowid": False})
+    
+    # Top-K most similar products of each product (shared tags and same category), kept up to date by crud
+    product_id = Column(Integer, ForeignKey("products.id"), primary_key=True)
+    related_id = Column(Integer, ForeignKey("products.id"), primary_key=True)
+    score = Column(Float, nullable=False)
+
+class Cart(Base):
+    __tablename__ = "carts"
+    
+    id = Column(Integer, primary_key=True)
+    tenant_id = Column(Integer, nullable=False, index=True)
+    created_at = Column(DateTime, nullable=False)
+    
+    items = relationship("CartItem", cascade="all, delete-orphan")
+
+class CartItem(Base):
+    __tablename__ = "cart_items"
+    # Clustered by cart (no rowid); product_id for removing a deleted product from every cart
+    __table_args__ = (Index("ix_cart_items_product_id", "product_id"), {"sqlite_with_rowid": False})
+    
+    cart_id = Column(Integer, ForeignKey("carts.id"), primary_key=True)
+    product_id = Column(Integer, ForeignKey("products.id"), primary_key=True)
+    quantity = Column(Integer, nullable=False)
+
+class Order(Base):
+    __tablename__ = "orders"
+    
+    id = Column(Integer, primary_key=True)
+    tenant_id = Column(Integer, nullable=False, index=True)
+    created_at = Column(DateTime, nullable=False)
+    total = Column(Float, nullable=False)
+    
+    items = relationship("OrderItem", cascade="all, delete-orphan")
+
+class OrderItem(Base):
+    __tablename__ = "order_items"
+    # Clustered by order (no rowid)
+    __table_args__ = {"sqlite_with_rowid": False}
+    
+    order_id = Column(Integer, ForeignKey("orders.id"), primary_key=True)
+    product_id = Column(Integer, primary_key=True)  # The product may be deleted later
+    # Title and price at checkout time
+    title = Column(String)
+    unit_price = Column(Float, nullable=False)
+    quantity = Column(Integer, nullable=False)
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+    # Clustered on (tenant_id, key): no rowid, no separate index
+    __table_args__ = {"sqlite_with_rowid": False}
+    
+    # Response of a create request sent with an Idempotency-Key header, replayed on retries
+    tenant_id = Column(Integer, primary_key=True)
+    key = Column(String, primary_key=True)
+    fingerprint = Column(LargeBinary, nullable=False)  # Digest of method, path and body
+    status_code = Column(Integer)  # NULL while the original request is in progress
+    content_type = Column(String)
+    body = Column(LargeBinary)
+    created_at = Column(DateTime, nullable=False)
+
+class TokenUsage(Base):
+    __tablename__ = "token_usage"
+    
+    # Incrementally maintained counters used to enforce per-token quotas
+    tenant_id = Column(Integer, primary_key=True)
+    products = Column(Integer, nullable=False, default=0, server_default="0")
+    categories = Column(Integer, nullable=False, default=0, server_default="0")
+    tags = Column(Integer, nullable=False, default=0, server_default="0")
+    upload_bytes = Column(Integer, nullable=False, default=0, server_default="0")
+    carts = Column(Integer, nullable=False, default=0, server_default="0")
+
+class SyncState(Base):
+    __tablename__ = "sync_state"
+    
+    # Per-tenant change counter: every flush that writes a tenant's rows takes the next version
+    tenant_id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0, server_default="0")
+    # Clients with an older cursor missed deletions that left no tombstone (/clean, /seed)
+    reset_version = Column(Integer, nullable=False, default=0, server_default="0")
+
+class Tombstone(Base):
+    __tablename__ = "tombstones"
+    __table_args__ = (Index("ix_tombstones_tenant_id_version", "tenant_id", "version"),)
+    
+    id = Column(Integer, primary_key=True)
+    tenant_id = Column(Integer, nullable=False)
+    entity = Column(String, nullable=False)  # "product", "category" or "tag"
+    entity_id = Column(Integer, nullable=False)
+    version = Column(Integer, nullable=False)
+    deleted_at = Column(DateTime)
+
+SYNCED_ENTITIES = {Category: "category", Tag: "tag", Product: "product"}
+
+def next_sync_version(session, tenant_id: int) -> int:
+    return session.execute(
+        sqlite_insert(SyncState)
+        .values(tenant_id=tenant_id, version=1)
+        .on_conflict_do_update(index_elements=["tenant_id"], set_={"version": SyncState.version + 1})
+        .returning(SyncState.version)
+    ).scalar_one()
+
+@event.listens_for(SessionLocal, "before_flush")
+def stamp_changes(session, flush_context, instances):
+    """Stamp written rows with updated_at and a new sync version; deletions leave a tombstone"""
+    deleted = [obj for obj in session.deleted if type(obj) in SYNCED_ENTITIES]
+    changed = {obj for obj in session.new if type(obj) in SYNCED_ENTITIES}
+    changed.update(
+        obj for obj in session.dirty
+        if type(obj) in SYNCED_ENTITIES and session.is_modified(obj)
+    )
+    for obj in deleted:
+        # Deleting a category or tag also changes its products (category_id / tag_ids)
+        if isinstance(obj, (Category, Tag)):
+            changed.update(product for product in obj.products if product not in session.deleted)
+    if not changed and not deleted:
+        return
+
+    # The version is taken inside the writing transaction, so versions are committed in order
+    now = datetime.now(timezone.utc)
+    tenant_ids = {obj.tenant_id for obj in changed} | {obj.tenant_id for obj in deleted}
+    versions = {tenant_id: next_sync_version(session, tenant_id) for tenant_id in tenant_ids}
+    unflushed = session.info.setdefault("unflushed_changes", [])
+    for obj in changed:
+        obj.updated_at = now
+        obj.version = versions[obj.tenant_id]
+        action = "created" if obj in session.new else "updated"
+        unflushed.append((obj, {"type": action, "entity": SYNCED_ENTITIES[type(obj)], "version": obj.version}))
+    for obj in deleted:
+        session.add(Tombstone(
+            tenant_id=obj.tenant_id,
+            entity=SYNCED_ENTITIES[type(obj)],
+            entity_id=obj.id,
+            version=versions[obj.tenant_id],
+            deleted_at=now,
+        ))
+        unflushed.append((obj, {"type": "deleted", "entity": SYNCED_ENTITIES[type(obj)], "version": versions[obj.tenant_id]}))
+
+# Listeners called with (session, [(tenant_id, change), ...]) after each commit, e.g. /events
+_change_listeners: List[Callable] = []
+
+def on_changes_committed(listener: Callable):
+    _change_listeners.append(listener)
+
+def record_change(session, tenant_id: int, change: dict):
+    """Change of the current transaction, passed to the change listeners once committed"""
+    session.info.setdefault("changes", []).append((tenant_id, change))
+
+@event.listens_for(SessionLocal, "after_flush")
+def resolve_change_ids(session, flush_context):
+    # New rows only have an id once flushed
+    for obj, change in session.info.pop("unflushed_changes", []):
+        record_change(session, obj.tenant_id, {**change, "id": obj.id})
+
+@event.listens_for(SessionLocal, "after_commit")
+def publish_changes(session):
+    if session.info.get("defer_changes"):
+        # Batch session: its commits are savepoints, published when the batch commits
+        return
+    dispatch_changes(session, session.info.pop("changes", None))
+
+def dispatch_changes(session, changes):
+    if changes:
+        for listener in _change_listeners:
+            listener(session, changes)
+
+@event.listens_for(SessionLocal, "after_rollback")
+def discard_changes(session):
+    session.info.pop("unflushed_changes", None)
+    session.info.pop("changes", None)
+
 # Create tables
 def create_tables():
-    Base.metadata.create_all(bind=engine)
+    prepare_schema(engine)
+
+def prepare_schema(target: Engine):
+    Base.metadata.create_all(bind=target)
+    migrate_token_columns(target)
+    migrate_sync_columns(target)
+    migrate_product_tags_indexes(target)
+    migrate_title_indexes(target)
+    migrate_stock_column(target)
+    migrate_category_tree(target)
+    migrate_cart_usage(target)
+
+def migrate_token_columns(target: Engine):
+    """Replace the raw `token` columns of older databases with `tenant_id` (tokens stored hashed)"""
+    inspector = inspect(target)
+    if "token" not in {column["name"] for column in inspector.get_columns("products")}:
+        return
+
+    with target.begin() as conn:
+        raw_tokens = set()
+        for table in ("categories", "tags", "products"):
+            raw_tokens.update(row[0] for row in conn.execute(text(f"SELECT DISTINCT token FROM {table}")))
+        raw_tokens.discard(None)
+
+        tenant_ids = {}
+        for raw_token in sorted(raw_tokens):
+            conn.execute(text("INSERT OR IGNORE INTO tokens (token_hash) VALUES (:h)"), {"h": hash_token(raw_token)})
+            tenant_ids[raw_token] = conn.execute(
+                text("SELECT id FROM tokens WHERE token_hash = :h"), {"h": hash_token(raw_token)}
+            ).scalar()
+
+        for table in ("categories", "tags", "products"):
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN tenant_id INTEGER"))
+            if tenant_ids:
+                conn.execute(
+                    text(f"UPDATE {table} SET tenant_id = :tenant_id WHERE token = :token"),
+                    [{"tenant_id": tenant_id, "token": raw_token} for raw_token, tenant_id in tenant_ids.items()],
+                )
+            conn.execute(text(f"DROP INDEX IF EXISTS ix_{table}_token"))
+            conn.execute(text(f"ALTER TABLE {table} DROP COLUMN token"))
+            conn.execute(text(f"CREATE INDEX ix_{table}_tenant_id ON {table} (tenant_id)"))
+
+        # Usage counters were keyed by the raw token: recreated empty and rebuilt at startup
+        conn.execute(text("DROP TABLE IF EXISTS token_usage"))
+    TokenUsage.__table__.create(bind=target)
+
+def migrate_sync_columns(target: Engine):
+    """Add updated_at/version to databases created before incremental sync existed"""
+    inspector = inspect(target)
+    with target.begin() as conn:
+        for table in ("categories", "tags", "products"):
+            if "version" in {column["name"] for column in inspector.get_columns(table)}:
+                continue
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN updated_at DATETIME"))
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN version INTEGER"))
+            # Existing rows are part of every full sync (version 0)
+            conn.execute(text(f"UPDATE {table} SET version = 0"))
+            conn.execute(text(f"CREATE INDEX ix_{table}_tenant_id_version ON {table} (tenant_id, version)"))
+
+def migrate_product_tags_indexes(target: Engine):
+    """Index product_tags in databases created before tag deltas existed"""
+    # Pairs whose product or tag no longer exists (left by older bulk deletes in /clean):
+    # ids are reused once a table is empty, so they would attach to new rows
+    orphaned = (
+        "FROM product_tags WHERE product_id NOT IN (SELECT id FROM products) "
+        "OR tag_id NOT IN (SELECT id FROM tags)"
+    )
+    with target.connect() as conn:
+        found = conn.execute(text(f"SELECT 1 {orphaned} LIMIT 1")).first() is not None
+    if found:
+        with target.begin() as conn:
+            conn.execute(text(f"DELETE {orphaned}"))
+
+    indexes = {index["name"] for index in inspect(target).get_indexes("product_tags")}
+    if "ux_product_tags_product_id_tag_id" in indexes:
+        return
+    with target.begin() as conn:
+        # Duplicate pairs would make the unique index fail
+        conn.execute(text(
+            "DELETE FROM product_tags WHERE rowid NOT IN "
+            "(SELECT MIN(rowid) FROM product_tags GROUP BY product_id, tag_id)"
+        ))
+        conn.execute(text("CREATE UNIQUE INDEX ux_product_tags_product_id_tag_id ON product_tags (product_id, tag_id)"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_product_tags_tag_id ON product_tags (tag_id)"))
+
+def migrate_title_indexes(target: Engine):
+    """Unique (tenant_id, title) for databases created before upserts by title existed"""
+    for table in ("categories", "tags"):
+        index = f"ux_{table}_tenant_id_title"
+        if index in {existing["name"] for existing in inspect(target).get_indexes(table)}:
+            continue
+        with target.begin() as conn:
+            # Repeated titles get their id appended (the oldest row keeps the title) and a new
+            # sync version, so that /sync clients pick up the new title
+            duplicates = conn.execute(text(
+                f"SELECT id, tenant_id FROM {table} WHERE id NOT IN "
+                f"(SELECT MIN(id) FROM {table} GROUP BY tenant_id, title)"
+            )).all()
+            now = datetime.now(timezone.utc)
+            for row_id, tenant_id in duplicates:
+                conn.execute(
+                    text(f"UPDATE {table} SET title = title || ' (' || id || ')', updated_at = :now, version = :version WHERE id = :id"),
+                    {"now": now, "version": next_sync_version(conn, tenant_id), "id": row_id},
+                )
+            conn.execute(text(f"CREATE UNIQUE INDEX {index} ON {table} (tenant_id, title)"))
+
+def migrate_stock_column(target: Engine):
+    """Add products.stock to databases created before carts and orders existed"""
+    if "stock" in {column["name"] for column in inspect(target).get_columns("products")}:
+        return
+    with target.begin() as conn:
+        conn.execute(text("ALTER TABLE products ADD COLUMN stock INTEGER NOT NULL DEFAULT 0"))
+
+def migrate_category_tree(target: Engine):
+    """Add categories.parent_id to databases created before nested categories existed"""
+    inspector = inspect(target)
+    if "ix_products_tenant_id_category_id" not in {index["name"] for index in inspector.get_indexes("products")}:
+        with target.begin() as conn:
+            conn.execute(text("CREATE INDEX ix_products_tenant_id_category_id ON products (tenant_id, category_id)"))
+    if "parent_id" in {column["name"] for column in inspector.get_columns("categories")}:
+        return
+    with target.begin() as conn:
+        conn.execute(text("ALTER TABLE categories ADD COLUMN parent_id INTEGER REFERENCES categories (id)"))
+        conn.execute(text("CREATE INDEX ix_categories_parent_id ON categories (parent_id)"))
+        # Existing categories are all top-level: each one is only its own ancestor
+        conn.execute(text(
+            "INSERT OR IGNORE INTO category_closure (ancestor_id, descendant_id, depth) "
+            "SELECT id, id, 0 FROM categories"
+        ))
+
+def migrate_cart_usage(target: Engine):
+    """Add token_usage.carts to databases created before open carts were counted there"""
+    if "carts" in {column["name"] for column in inspect(target).get_columns("token_usage")}:
+        return
+    with target.begin() as conn:
+        conn.execute(text("ALTER TABLE token_usage ADD COLUMN carts INTEGER NOT NULL DEFAULT 0"))
+        # Carts already open count against the quota from the start
+        conn.execute(text(
+            "INSERT INTO token_usage (tenant_id, carts) "
+            "SELECT tenant_id, COUNT(*) FROM carts GROUP BY tenant_id "
+            "ON CONFLICT (tenant_id) DO UPDATE SET carts = excluded.carts"
+        ))
+
+def on_engine_created(hook: Callable[[Engine], None]):
+    """Register a hook for the main engine, the open shards and every shard opened later"""
+    _engine_hooks.append(hook)
+    hook(engine)
+    with _shard_lock:
+        for shard_engine in _shard_engines.values():
+            hook(shard_engine)
+
+# Shard engines, in least recently used order
+_shard_engines: "OrderedDict[str, Engine]" = OrderedDict()
+_shard_lock = threading.Lock()
+
+def shard_path(token: str) -> str:
+    # Hashed so that tokens never become file names
+    digest = hashlib.sha256(token.encode()).hexdigest()
+    if SHARDING == "hash":
+        return os.path.join(SHARDS_DIR, f"shard_{int(digest, 16) % SHARD_COUNT:03d}.db")
+    return os.path.join(SHARDS_DIR, f"{digest[:32]}.db")
+
+def get_shard_engine(path: str) -> Engine:
+    with _shard_lock:
+        shard_engine = _shard_engines.get(path)
+        if shard_engine is not None:
+            _shard_engines.move_to_end(path)
+            return shard_engine
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        shard_engine = create_sqlite_engine(f"sqlite:///{path}")
+        prepare_schema(shard_engine)
+        _shard_engines[path] = shard_engine
+        while len(_shard_engines) > ENGINE_CACHE_SIZE:
+            # Sessions still using an evicted engine keep working; its idle connections are closed
+            _, evicted = _shard_engines.popitem(last=False)
+            evicted.dispose()
+        return shard_engine
+
+def list_shard_paths() -> List[str]:
+    if SHARDING == "none":
+        return []
+    return sorted(glob.glob(os.path.join(SHARDS_DIR, "*.db")))
+
+def shard_session(path: str):
+    return SessionLocal(bind=get_shard_engine(path))
+
+def get_session(token: str):
+    """New session on the database that stores the token's data"""
+    if SHARDING == "none":
+        return SessionLocal()
+    return shard_session(shard_path(token))
+
+# Size on disk of the SQLite database and its shards (including WAL files)
+def get_database_size() -> int:
+    total = 0
+    for path in [engine.url.database] + list_shard_paths():
+        for suffix in ("", "-wal"):
+            try:
+                total += os.path.getsize(path + suffix)
+            except (OSError, TypeError):
+                pass
+    return total
+
+# Session shared by the sub-requests of POST /batch (see begin_batch)
+batch_session: ContextVar[Optional[Session]] = ContextVar("batch_session", default=None)
+
+def begin_batch(token: str) -> Session:
+    """Session whose commits are savepoints of a single transaction, ended with end_batch"""
+    target = engine if SHARDING == "none" else get_shard_engine(shard_path(token))
+    connection = target.connect()
+    # Explicit BEGIN: otherwise pysqlite starts the transaction at the first SAVEPOINT and
+    # its RELEASE commits it. IMMEDIATE takes the write lock up front (waits busy_timeout)
+    connection.exec_driver_sql("BEGIN IMMEDIATE")
+    session = SessionLocal(bind=connection, join_transaction_mode="create_savepoint")
+    session.info["defer_changes"] = True
+    return session
+
+def end_batch(session: Session, commit: bool):
+    changes = session.info.pop("changes", None)
+    connection = session.get_bind()
+    session.close()
+    if commit:
+        connection.commit()
+    else:
+        connection.rollback()
+    connection.close()
+    if commit:
+        dispatch_changes(session, changes)
+
+# Dependency to get database session (routed to the token's shard when sharding is enabled)
+def get_db(token: str = Depends(get_current_token)):
+    shared = batch_session.get()
+    if shared is not None:
+        yield shared
+        return
+    db = get_session(token)
+    try:
+        yield db
+    finally:
+        db.close()
 
-# Dependency to get database session
-def get_db():
+# Dependency for cross-token (admin) endpoints: always the main database
+def get_main_db():
     db = SessionLocal()
     try:
         yield db
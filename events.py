@@ -0,0 +1,222 @@
+import asyncio
+import json
+import os
+import threading
+from typing import Dict, List, Optional, Set
+
+from sqlalchemy.orm import Session
+from starlette.responses import StreamingResponse
+
+import database
+import metrics
+
+# Eventos pendientes por cliente; si se llena, el cliente recibe `overflow` y debe usar /sync
+QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", "100"))
+# Conexiones simultáneas a /events por token (0 = sin límite)
+MAX_SUBSCRIBERS = int(os.getenv("EVENTS_MAX_SUBSCRIBERS", "5"))
+# Segundos entre comentarios de keep-alive (evitan que los proxies corten la conexión)
+HEARTBEAT = float(os.getenv("EVENTS_HEARTBEAT", "15"))
+
+OVERFLOW = {"type": "overflow"}
+
+
+def channel(db: Session, tenant_id: int) -> str:
+    """Canal de un token: con DATABASE_SHARDING los ids se repiten entre archivos."""
+    return f"{db.get_bind().engine.url.database}:{tenant_id}"
+
+
+class Subscriber:
+    """Cola acotada de un cliente conectado a /events."""
+
+    def __init__(self, key: str):
+        self.key = key
+        self.queue: asyncio.Queue = asyncio.Queue(QUEUE_SIZE)
+
+    def push(self, event: dict):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Un cliente lento nunca acumula memoria: se descartan sus eventos
+            # pendientes y se le avisa para que se ponga al día con /sync
+            dropped = self.queue.qsize() + 1
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(OVERFLOW)
+            metrics.record_events("dropped", dropped)
+
+
+class MemoryBroker:
+    """
+    Pub/sub dentro del proceso.
+
+    Los cambios se confirman en los hilos del pool (endpoints síncronos) y se
+    entregan en el event loop con `call_soon_threadsafe`. Con varios workers
+    cada proceso solo ve sus propias escrituras: conviene RedisBroker.
+    """
+
+    def __init__(self):
+        self.subscribers: Dict[str, Set[Subscriber]] = {}
+        self.lock = threading.Lock()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def subscribe(self, key: str) -> Optional[Subscriber]:
+        """Registra un cliente; None si el token ya tiene MAX_SUBSCRIBERS conexiones."""
+        self.loop = asyncio.get_running_loop()
+        with self.lock:
+            current = self.subscribers.setdefault(key, set())
+            if MAX_SUBSCRIBERS and len(current) >= MAX_SUBSCRIBERS:
+                return None
+            subscriber = Subscriber(key)
+            current.add(subscriber)
+            metrics.EVENT_SUBSCRIBERS.inc()
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        """Da de baja a un cliente (más de una vez no tiene efecto)."""
+        with self.lock:
+            current = self.subscribers.get(subscriber.key, set())
+            if subscriber not in current:
+                return
+            current.discard(subscriber)
+            if not current:
+                self.subscribers.pop(subscriber.key, None)
+            metrics.EVENT_SUBSCRIBERS.dec()
+
+    def publish(self, key: str, events: List[dict]):
+        """Publica eventos desde cualquier hilo."""
+        with self.lock:
+            listening = bool(self.subscribers.get(key))
+        if listening and self.loop is not None:
+            self.loop.call_soon_threadsafe(self.deliver, key, events)
+
+    def deliver(self, key: str, events: List[dict]):
+        with self.lock:
+            subscribers = list(self.subscribers.get(key, ()))
+        for subscriber in subscribers:
+            for event in events:
+                subscriber.push(event)
+        metrics.record_events("delivered", len(subscribers) * len(events))
+
+
+class RedisBroker(MemoryBroker):
+    """
+    Pub/sub compartido entre workers a través de un canal de Redis.
+
+    Cada escritura se publica en Redis; cada proceso escucha el canal con una
+    única tarea y reparte los eventos entre sus clientes locales.
+    """
+
+    CHANNEL = "events"
+
+    def __init__(self, url: str):
+        super().__init__()
+        try:
+            import redis
+            import redis.asyncio
+        except ImportError:
+            raise RuntimeError(
+                "EVENTS_BACKEND=redis requiere el paquete redis. Instalalo con: pip install redis"
+            )
+        # Cliente síncrono: se publica desde los hilos que confirman las transacciones
+        self.client = redis.Redis.from_url(url)
+        self.async_client = redis.asyncio.from_url(url)
+        self.relay_task: Optional[asyncio.Task] = None
+
+    def subscribe(self, key: str) -> Optional[Subscriber]:
+        subscriber = super().subscribe(key)
+        if self.relay_task is None or self.relay_task.done():
+            self.relay_task = asyncio.create_task(self.relay())
+        return subscriber
+
+    def publish(self, key: str, events: List[dict]):
+        try:
+            self.client.publish(self.CHANNEL, json.dumps({"key": key, "events": events}))
+        except Exception as e:
+            print(f"Error publicando eventos en Redis: {e}")
+
+    async def relay(self):
+        while True:
+            try:
+                pubsub = self.async_client.pubsub()
+                await pubsub.subscribe(self.CHANNEL)
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        data = json.loads(message["data"])
+                        self.deliver(data["key"], data["events"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Error escuchando eventos en Redis: {e}")
+                await asyncio.sleep(1)
+
+
+def create_broker():
+    """Crea el broker configurado con EVENTS_BACKEND (memory o redis)."""
+    backend = os.getenv("EVENTS_BACKEND", "memory").lower()
+    if backend == "memory":
+        return MemoryBroker()
+    if backend == "redis":
+        return RedisBroker(os.getenv("EVENTS_REDIS_URL", "redis://localhost:6379/0"))
+    raise RuntimeError(f"EVENTS_BACKEND desconocido: {backend}")
+
+
+broker = create_broker()
+
+
+def publish_committed_changes(session: Session, changes):
+    """Listener de `database.on_changes_committed`: un mensaje por token y transacción."""
+    by_tenant: Dict[int, List[dict]] = {}
+    for tenant_id, change in changes:
+        by_tenant.setdefault(tenant_id, []).append(change)
+    for tenant_id, events in by_tenant.items():
+        broker.publish(channel(session, tenant_id), events)
+
+
+database.on_changes_committed(publish_committed_changes)
+
+
+def format_event(event: dict) -> str:
+    """Mensaje SSE: `event` es el tipo de cambio e `id` la versión (usable como `since` en /sync)."""
+    data = {key: value for key, value in event.items() if key != "type"}
+    lines = [f"event: {event['type']}"]
+    if "version" in event:
+        lines.append(f"id: {event['version']}")
+    lines.append(f"data: {json.dumps(data)}")
+    return "\n".join(lines) + "\n\n"
+
+
+async def stream(subscriber: Subscriber):
+    """Generador de la respuesta SSE (la baja del cliente la hace EventStreamResponse)."""
+    yield ": conectado\n\n"
+    while True:
+        try:
+            event = await asyncio.wait_for(subscriber.queue.get(), HEARTBEAT)
+        except asyncio.TimeoutError:
+            yield ": ping\n\n"
+            continue
+        yield format_event(event)
+
+
+class EventStreamResponse(StreamingResponse):
+    """
+    Respuesta SSE de un cliente ya registrado.
+
+    La baja se hace al terminar la respuesta, de cualquier forma que termine: si el
+    cliente se desconecta antes del primer evento, el generador nunca empieza y su
+    `finally` no se ejecutaría, dejando ocupado un lugar de MAX_SUBSCRIBERS.
+    """
+
+    def __init__(self, subscriber: Subscriber):
+        super().__init__(
+            stream(subscriber),
+            media_type="text/event-stream",
+            # Sin caché ni buffering en proxies (nginx), para que cada evento llegue en el momento
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+        self.subscriber = subscriber
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            broker.unsubscribe(self.subscriber)
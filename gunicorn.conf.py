@@ -0,0 +1,72 @@
+# Configuración de gunicorn para ejecutar la API con varios procesos
+#
+#   gunicorn main:app -c gunicorn.conf.py
+#
+# Cada worker es un proceso uvicorn independiente con su propio event loop,
+# por lo que la API aprovecha todos los núcleos. El estado compartido entre
+# workers vive en la base de datos (SQLite en modo WAL), en archivos de
+# bloqueo (locks.py) o en Redis (límites de peticiones y eventos). Sin Redis
+# se inicia un solo worker.
+
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+
+def process_local_state():
+    """Backends configurados que guardan su estado en cada proceso (no compartido entre workers)"""
+    local = []
+    if os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true" \
+            and os.getenv("RATE_LIMIT_BACKEND", "memory").lower() == "memory":
+        local.append("RATE_LIMIT_BACKEND=memory")
+    if os.getenv("EVENTS_BACKEND", "memory").lower() == "memory":
+        local.append("EVENTS_BACKEND=memory")
+    return local
+
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+local_state = process_local_state()
+# Sin Redis, varios workers multiplican los límites de peticiones y /events no recibe
+# los cambios hechos en los demás procesos: por defecto un solo worker
+workers = int(os.getenv("WEB_CONCURRENCY", 1 if local_state else multiprocessing.cpu_count()))
+if workers > 1 and local_state and os.getenv("ALLOW_PER_PROCESS_STATE", "false").lower() != "true":
+    raise SystemExit(
+        f"WEB_CONCURRENCY={workers} requiere estado compartido entre workers, pero está configurado "
+        f"{' y '.join(local_state)}. Usá RATE_LIMIT_BACKEND=redis y EVENTS_BACKEND=redis, "
+        "o WEB_CONCURRENCY=1 (ALLOW_PER_PROCESS_STATE=true para iniciar igual, ej: benchmarks)."
+    )
+worker_class = "uvicorn_worker.UvicornWorker"
+# /seed descarga imágenes y puede tardar bastante
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = 30
+accesslog = "-"
+
+# Métricas de Prometheus sumadas entre procesos. Debe definirse antes de que
+# los workers importen prometheus_client.
+if workers > 1:
+    os.environ.setdefault(
+        "PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "ecommerce-prometheus")
+    )
+
+
+def on_starting(server):
+    metrics_dir = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    if metrics_dir:
+        # Los archivos de una ejecución anterior sumarían valores viejos
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+        os.makedirs(metrics_dir, exist_ok=True)
+
+    if workers > 1 and local_state:
+        server.log.warning(
+            "%s con %s workers (ALLOW_PER_PROCESS_STATE=true): cada proceso aplica sus propios "
+            "límites y /events solo recibe los cambios hechos en el mismo proceso.",
+            " y ".join(local_state),
+            workers,
+        )
+
+
+def child_exit(server, worker):
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,197 @@
+import asyncio
+import hashlib
+import os
+from datetime import datetime, timedelta, timezone
+from typing import NamedTuple, Optional
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import delete, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse, Response
+
+import database
+import tenants
+from ratelimit import bearer_token
+
+# Segundos durante los que se recuerda la respuesta de cada Idempotency-Key
+TTL = float(os.getenv("IDEMPOTENCY_TTL", "86400"))
+# Una petición original que no terminó en este tiempo (worker caído) se puede reintentar
+PENDING_TIMEOUT = 60
+MAX_KEY_LENGTH = 255
+# Altas (POST) que aceptan el header, además de la confirmación de compra
+PATHS = ("/categories/", "/tags/", "/products/", "/carts/", "/batch")
+
+
+def accepts(path: str) -> bool:
+    return path in PATHS or (path.startswith("/carts/") and path.endswith("/checkout"))
+
+
+class Stored(NamedTuple):
+    status_code: int
+    content_type: Optional[str]
+    body: bytes
+
+
+def fingerprint(scope, body: bytes) -> bytes:
+    """Resumen de la petición: una misma clave no puede reutilizarse con otro contenido."""
+    digest = hashlib.sha256()
+    for part in (scope["method"].encode(), scope["path"].encode(), scope["query_string"], body):
+        digest.update(len(part).to_bytes(8, "big") + part)
+    return digest.digest()[:16]
+
+
+def claim(token: str, key: str, request_fingerprint: bytes):
+    """
+    Reserva la clave para ejecutar la petición.
+
+    Returns:
+        ("claimed", tenant_id), ("replay", Stored), ("pending", None) o ("mismatch", None)
+    """
+    model = database.IdempotencyKey
+    with database.get_session(token) as db:
+        tenant_id = tenants.get_tenant_id(db, token)
+        now = datetime.now(timezone.utc)
+        # Las claves vencidas del token se borran aquí: no hace falta una tarea periódica
+        db.execute(delete(model).where(model.tenant_id == tenant_id, model.created_at < now - timedelta(seconds=TTL)))
+        claimed = db.execute(
+            sqlite_insert(model)
+            .values(tenant_id=tenant_id, key=key, fingerprint=request_fingerprint, created_at=now)
+            .on_conflict_do_nothing(index_elements=["tenant_id", "key"])
+        ).rowcount
+        if not claimed:
+            # La petición original quedó a medias (el worker se cayó): se vuelve a ejecutar
+            claimed = db.execute(
+                update(model)
+                .where(
+                    model.tenant_id == tenant_id,
+                    model.key == key,
+                    model.fingerprint == request_fingerprint,
+                    model.status_code.is_(None),
+                    model.created_at < now - timedelta(seconds=PENDING_TIMEOUT),
+                )
+                .values(created_at=now)
+            ).rowcount
+        db.commit()
+        if claimed:
+            return "claimed", tenant_id
+
+        row = db.get(model, (tenant_id, key))
+        if row is None:
+            # Venció entre ambas consultas
+            return claim(token, key, request_fingerprint)
+        if row.fingerprint != request_fingerprint:
+            return "mismatch", None
+        if row.status_code is None:
+            return "pending", None
+        return "replay", Stored(row.status_code, row.content_type, row.body)
+
+
+def store(token: str, tenant_id: int, key: str, response: Optional[Stored]):
+    """Guarda la respuesta; sin respuesta (no fue 2xx) libera la clave para reintentar."""
+    model = database.IdempotencyKey
+    with database.get_session(token) as db:
+        match = (model.tenant_id == tenant_id) & (model.key == key)
+        if response is None:
+            db.execute(delete(model).where(match))
+        else:
+            db.execute(update(model).where(match).values(**response._asdict()))
+        db.commit()
+
+
+class IdempotencyMiddleware:
+    """
+    Middleware ASGI para el header `Idempotency-Key` en las altas.
+
+    La primera petición con una clave se ejecuta y su respuesta se guarda por
+    token durante `TTL` segundos; los reintentos con la misma clave reciben la
+    misma respuesta (con `Idempotent-Replayed: true`) sin volver a crear nada.
+    Solo se guardan las respuestas 2xx: ante un error (por ejemplo el 409 de
+    una compra sin stock suficiente) el reintento con la misma clave vuelve a
+    ejecutar la petición.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or not accepts(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+        key = Headers(scope=scope).get("idempotency-key")
+        token = bearer_token(scope)
+        if key is None or token is None:
+            await self.app(scope, receive, send)
+            return
+        if not key or len(key) > MAX_KEY_LENGTH:
+            response = JSONResponse(
+                status_code=400,
+                content={"detail": f"Idempotency-Key debe tener entre 1 y {MAX_KEY_LENGTH} caracteres"},
+            )
+            await response(scope, receive, send)
+            return
+
+        chunks = []
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] != "http.request":
+                return
+            chunks.append(message.get("body", b""))
+            more_body = message.get("more_body", False)
+        body = b"".join(chunks)
+
+        result, value = await run_in_threadpool(claim, token, key, fingerprint(scope, body))
+        if result == "replay":
+            response = Response(
+                value.body, status_code=value.status_code, media_type=value.content_type,
+                headers={"Idempotent-Replayed": "true"},
+            )
+            await response(scope, receive, send)
+            return
+        if result == "pending":
+            response = JSONResponse(
+                status_code=409,
+                content={"detail": "Hay una petición en curso con la misma Idempotency-Key; reintentar en unos segundos"},
+                headers={"Retry-After": "1"},
+            )
+            await response(scope, receive, send)
+            return
+        if result == "mismatch":
+            response = JSONResponse(
+                status_code=422,
+                content={"detail": "La Idempotency-Key ya se usó con otra petición"},
+            )
+            await response(scope, receive, send)
+            return
+
+        tenant_id = value
+        body_sent = False
+
+        async def replay_receive():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        status_code = 500
+        content_type = None
+        response_chunks = []
+
+        async def capture_send(message):
+            nonlocal status_code, content_type
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                content_type = Headers(raw=message["headers"]).get("content-type")
+            elif message["type"] == "http.response.body":
+                response_chunks.append(message.get("body", b""))
+            await send(message)
+
+        stored = None
+        try:
+            await self.app(scope, replay_receive, capture_send)
+            if 200 <= status_code < 300:
+                stored = Stored(status_code, content_type, b"".join(response_chunks))
+        finally:
+            await asyncio.shield(run_in_threadpool(store, token, tenant_id, key, stored))
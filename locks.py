@@ -0,0 +1,68 @@
+import os
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: un solo proceso, los bloqueos no son necesarios
+    fcntl = None
+
+# Directorio de los archivos de bloqueo compartidos entre workers
+LOCKS_DIR = os.getenv("LOCKS_DIR", ".")
+
+
+def lock_path(name: str) -> str:
+    return os.path.join(LOCKS_DIR, f".{name}.lock")
+
+
+@contextmanager
+def file_lock(name: str):
+    """
+    Bloqueo exclusivo entre procesos (flock) mientras dura el bloque.
+
+    Serializa el trabajo de inicio (crear tablas, recalcular contadores) cuando
+    varios workers importan `main` al mismo tiempo.
+    """
+    with open(lock_path(name), "a") as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class Leadership:
+    """
+    Bloqueo no bloqueante que un único worker conserva mientras vive.
+
+    Sirve para tareas periódicas que deben ejecutarse en un solo proceso. Si el
+    líder termina, el sistema operativo libera el bloqueo y otro worker lo toma
+    en su siguiente intento.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.lock_file = None
+
+    @property
+    def is_leader(self) -> bool:
+        return self.lock_file is not None
+
+    def try_acquire(self) -> bool:
+        if self.lock_file is not None:
+            return True
+        lock_file = open(lock_path(self.name), "a")
+        if fcntl:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                return False
+        self.lock_file = lock_file
+        return True
+
+    def release(self):
+        if self.lock_file is not None:
+            self.lock_file.close()
+            self.lock_file = None
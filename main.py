@@ -1,24 +1,75 @@
-from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, status
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, BackgroundTasks, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, RedirectResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
-from typing import List, Optional
+from typing import List, Literal, Optional
+from contextlib import asynccontextmanager
+import asyncio
 import os
 import uuid
-import shutil
-from pathlib import Path
 from dotenv import load_dotenv
 
 # Cargar variables de entorno
 load_dotenv()
 
+import autocomplete
+import batch
 import database
 import schemas
 import crud
-import seeder
-import cleaner
+import compression
+import events
+import idempotency
+import locks
+import metrics
+import profiler
+import ratelimit
+import tenants
 from auth import get_current_token
+from static_files import UploadsStaticFiles
+from storage import IMAGE_EXTENSIONS, LocalStorage, get_storage, name_from_url
+
+async def collect_orphans_periodically(interval: int, leadership: locks.Leadership):
+    """
+    Ejecuta el recolector de archivos huérfanos cada `interval` segundos, fuera del event loop.
+    
+    Con varios workers solo lo ejecuta el que conserva el bloqueo de líder.
+    """
+    import cleaner
+    
+    while True:
+        await asyncio.sleep(interval)
+        if leadership.try_acquire():
+            await run_in_threadpool(cleaner.run_scheduled_gc)
+
+def initialize_database():
+    """Crea las tablas y recalcula los contadores de uso, una sola vez aunque arranquen varios workers"""
+    with locks.file_lock("startup"):
+        database.create_tables()
+        
+        # Databases created before quotas existed: compute the usage counters once
+        with database.SessionLocal() as db:
+            if crud.token_usage_needs_rebuild(db):
+                crud.rebuild_token_usage(db, {stored.name: stored.size for stored in storage.list()})
+            # Same for the related products index
+            if crud.related_index_needs_rebuild(db):
+                crud.rebuild_related_index(db)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Schema checks run here instead of at import time, so importing main stays cheap
+    await run_in_threadpool(initialize_database)
+    
+    gc_interval = int(os.getenv("UPLOADS_GC_INTERVAL", "0"))
+    gc_leadership = locks.Leadership("uploads-gc")
+    gc_task = None
+    if gc_interval > 0:
+        gc_task = asyncio.create_task(collect_orphans_periodically(gc_interval, gc_leadership))
+    yield
+    if gc_task:
+        gc_task.cancel()
+    gc_leadership.release()
 
 # Create FastAPI app
 app = FastAPI(
@@ -57,8 +108,16 @@ app = FastAPI(
         "name": "Uso Educativo - UNTDF",
         "url": "https://www.untdf.edu.ar/",
     },
+    lifespan=lifespan,
 )
 
+# Idempotency-Key on create endpoints (innermost: stores the uncompressed response of the endpoint)
+app.add_middleware(idempotency.IdempotencyMiddleware)
+
+# Per-token rate limiting (added before CORS so 429 responses still carry CORS headers)
+if ratelimit.ENABLED:
+    app.add_middleware(ratelimit.RateLimitMiddleware)
+
 # Add CORS middleware to allow frontend development
 app.add_middleware(
     CORSMiddleware,
@@ -66,17 +125,37 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  # Permite todos los métodos HTTP
     allow_headers=["*"],  # Permite todos los headers
+    expose_headers=["X-Missing-Ids", "Idempotent-Replayed"],  # Legibles desde JavaScript
 )
 
-# Create database tables
-database.create_tables()
+# Response compression (gzip/brotli); added before Prometheus so its latency includes compression
+if compression.ENABLED:
+    app.add_middleware(compression.CompressionMiddleware)
 
-# Create uploads directory
-uploads_dir = Path("uploads")
-uploads_dir.mkdir(exist_ok=True)
+# Prometheus instrumentation (per-route latency, DB queries per request)
+app.add_middleware(metrics.PrometheusMiddleware)
+database.on_engine_created(metrics.instrument_engine)
 
-# Mount static files for serving images
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
+# Opt-in query profiler (QUERY_PROFILER=true): slow query log and Server-Timing header
+if profiler.ENABLED:
+    app.add_middleware(profiler.QueryProfilerMiddleware)
+    database.on_engine_created(profiler.instrument_engine)
+
+# Storage backend for uploaded images (local directory or S3-compatible bucket)
+storage = get_storage()
+
+if isinstance(storage, LocalStorage):
+    # Mount static files for serving images (cacheable: filenames are immutable)
+    app.mount("/uploads", UploadsStaticFiles(directory=storage.directory), name="uploads")
+else:
+    @app.get("/uploads/{filename}", include_in_schema=False)
+    def redirect_upload(filename: str):
+        """Redirige a una URL prefirmada del bucket: los bytes no pasan por la API"""
+        try:
+            url = storage.presigned_url(filename)
+        except ValueError:
+            raise HTTPException(status_code=404, detail="Archivo no encontrado")
+        return RedirectResponse(url, status_code=307)
 
 # Admin token verification
 def verify_admin_token(token: str) -> bool:
@@ -93,6 +172,105 @@ def get_admin_token(credentials = Depends(get_current_token)) -> str:
         )
     return credentials
 
+def delete_stored_pictures(picture_urls: List[str], token: Optional[str] = None, tenant_id: Optional[int] = None):
+    """Elimina del almacenamiento los archivos de imágenes de un registro eliminado"""
+    freed = 0
+    for picture_url in picture_urls:
+        name = name_from_url(picture_url)
+        if name:
+            try:
+                freed += storage.delete(name)
+            except Exception as e:
+                print(f"Error eliminando imagen {picture_url}: {e}")
+    if token and tenant_id and freed:
+        # Return the freed bytes to the owner's upload quota
+        with database.get_session(token) as db:
+            crud.release_usage(db, tenant_id, "upload_bytes", freed)
+            db.commit()
+
+def image_extension(filename: Optional[str]) -> str:
+    """Extensión de un archivo subido; 400 si no es un formato de imagen admitido"""
+    extension = filename.rsplit(".", 1)[-1].lower() if filename and "." in filename else ""
+    if extension not in IMAGE_EXTENSIONS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Formato de imagen no admitido: {filename}. Usar {', '.join(IMAGE_EXTENSIONS)}"
+        )
+    return extension
+
+def save_uploads(db: Session, tenant_id: int, uploads: List[tuple], kind: str) -> List[str]:
+    """Guarda los archivos y los descuenta de la cuota del token; si se excede, los elimina"""
+    saved = []
+    try:
+        for filename, fileobj in uploads:
+            size = storage.save(filename, fileobj)
+            saved.append(filename)
+            metrics.record_upload(kind, size)
+            crud.reserve_usage(db, tenant_id, "upload_bytes", size)
+    except crud.QuotaExceededError:
+        for filename in saved:
+            storage.delete(filename)
+        raise
+    return [storage.url(filename) for filename in saved]
+
+# Batch fetch by id (?ids=1,2,3)
+MAX_IDS = 100
+
+def parse_ids(ids: Optional[str] = None) -> Optional[List[int]]:
+    """Dependency: convierte `?ids=3,1,2` en una lista de ids sin repetidos, en el orden pedido"""
+    if ids is None:
+        return None
+    try:
+        parsed = [int(part) for part in ids.split(",") if part.strip()]
+    except ValueError:
+        raise HTTPException(
+            status_code=422,
+            detail="ids debe ser una lista de números separados por comas (ej: ids=1,2,3)"
+        )
+    parsed = list(dict.fromkeys(parsed))
+    if len(parsed) > MAX_IDS:
+        raise HTTPException(status_code=422, detail=f"Máximo {MAX_IDS} ids por petición")
+    return parsed
+
+def set_missing_ids(response: Response, missing: List[int]):
+    """Informa en la cabecera X-Missing-Ids los ids pedidos que no existen (o son de otro token)"""
+    if missing:
+        response.headers["X-Missing-Ids"] = ",".join(str(item_id) for item_id in missing)
+
+def check_category_parent(db: Session, tenant_id: int, parent_id: Optional[int], category_id: Optional[int] = None):
+    """Valida la categoría padre: debe existir y no puede ser la propia categoría ni una de sus subcategorías"""
+    if parent_id is None:
+        return
+    if crud.get_category(db, category_id=parent_id, tenant_id=tenant_id) is None:
+        raise HTTPException(status_code=404, detail="Categoría padre no encontrada")
+    if category_id is not None and crud.is_in_category_subtree(db, root_id=category_id, category_id=parent_id):
+        raise HTTPException(
+            status_code=422,
+            detail="Una categoría no puede moverse dentro de sí misma ni de una de sus subcategorías"
+        )
+
+@app.exception_handler(crud.QuotaExceededError)
+def quota_exceeded_handler(request, exc: crud.QuotaExceededError):
+    names = {
+        "products": "productos",
+        "categories": "categorías",
+        "tags": "etiquetas",
+        "upload_bytes": "bytes de imágenes",
+        "carts": "carritos abiertos",
+    }
+    return JSONResponse(
+        status_code=status.HTTP_403_FORBIDDEN,
+        content={"detail": f"Cuota excedida: máximo {exc.limit} {names[exc.field]} por token"}
+    )
+
+@app.exception_handler(crud.DuplicateTitleError)
+def duplicate_title_handler(request, exc: crud.DuplicateTitleError):
+    names = {"categories": "una categoría", "tags": "una etiqueta"}
+    return JSONResponse(
+        status_code=status.HTTP_409_CONFLICT,
+        content={"detail": f"Ya existe {names[exc.entity]} con el título '{exc.title}'"}
+    )
+
 # Root endpoint
 @app.get(
     "/",
@@ -119,6 +297,11 @@ def read_root():
         "contacto": "fgonzalez@untdf.edu.ar"
     }
 
+@app.get("/metrics", include_in_schema=False)
+async def read_metrics():
+    """Métricas en formato Prometheus (peticiones, latencias, consultas SQL, pool de hilos)"""
+    return metrics.metrics_response()
+
 # Category endpoints
 @app.get(
     "/categories/", 
@@ -128,10 +311,12 @@ def read_root():
     tags=["Categorías"]
 )
 def read_categories(
+    response: Response,
     skip: int = 0,
     limit: int = 100,
+    ids: Optional[List[int]] = Depends(parse_ids),
     db: Session = Depends(database.get_db),
-    token: str = Depends(get_current_token)
+    tenant_id: int = Depends(tenants.get_current_tenant)
 ):
     """
     ## Listar todas las categorías
@@ -141,11 +326,18 @@ def read_categories(
     **Parámetros:**
     - **skip**: Número de registros a omitir (para paginación)
     - **limit**: Número máximo de registros a devolver
+    - **ids**: Ids separados por comas (ej: `ids=3,1,2`) para obtener varias categorías en una
+      sola petición, en el orden pedido. Los ids inexistentes se informan en la cabecera `X-Missing-Ids`
     
     **Respuesta:**
     Lista de categorías con sus respectivos datos e imagen (si tiene)
     """
-    categories = crud.get_categories(db, token=token, skip=skip, limit=limit)
+    if ids is not None:
+        categories, missing = crud.get_categories_by_ids(db, tenant_id=tenant_id, ids=ids)
+        set_missing_ids(response, missing)
+        return categories
+    
+    categories = crud.get_categories(db, tenant_id=tenant_id, skip=skip, limit=limit)
     return categories
 
 @app.post(
@@ -158,7 +350,7 @@ def read_categories(
 def create_category(
     category: schemas.CategoryCreate,
     db: Session = Depends(database.get_db),
-    token: str = Depends(get_current_token)
+    tenant_id: int = Depends(tenants.get_current_tenant)
 ):
     """
     ## Crear una nueva categoría
@@ -169,9 +361,48 @@ def create_category(
     - **title**: Nombre de la categoría (ej: "Electrónicos")
     - **description**: Descripción detallada de la categoría
     
+    **Datos opcionales:**
+    - **parent_id**: ID de la categoría padre (ej: "Celulares" dentro de "Electrónicos").
+      Sin `parent_id` la categoría queda en el primer nivel
+    
     **Nota:** La imagen se puede agregar posteriormente usando el endpoint de subida de imagen.
+    
+    El título no puede repetirse (`409`). Para reintentar sin crear duplicados, enviar el
+    header `Idempotency-Key` o usar `PUT /categories/by-title/{title}`.
     """
-    return crud.create_category(db=db, category=category, token=token)
+    check_category_parent(db, tenant_id, category.parent_id)
+    return crud.create_category(db=db, category=category, tenant_id=tenant_id)
+
+@app.put(
+    "/categories/by-title/{title}",
+    response_model=schemas.Category,
+    summary="Crear o actualizar categoría por título",
+    description="Crea la categoría si no existe una con ese título, o actualiza su descripción",
+    tags=["Categorías"]
+)
+def upsert_category(
+    title: str,
+    category: schemas.CategoryUpsert,
+    response: Response,
+    db: Session = Depends(database.get_db),
+    tenant_id: int = Depends(tenants.get_current_tenant)
+):
+    """
+    ## Crear o actualizar una categoría por título
+    
+    El título identifica a la categoría: repetir la petición (por ejemplo, al reintentar
+    después de un timeout) nunca crea una categoría duplicada.
+    
+    **Parámetros:**
+    - **title**: Título de la categoría (en la URL)
+    - **description**: Descripción de la categoría
+    
+    **Respuesta:** `201` si la categoría se creó, `200` si ya existía.
+    """
+    db_category, created = crud.upsert_category(db, tenant_id=tenant_id, title=title, category=category)
+    if created:
+        response.status_code = status.HTTP_201_CREATED
+    return db_category
 
 @app.get(
     "/categories/{category_id}", 
@@ -183,7 +414,7 @@ def create_category(
 def read_category(
     category_id: int,
     db: Session = Depends(database.get_db),
-    token: str = Depends(get_current_token)
+    tenant_id: int = Depends(tenants.get_current_tenant)
 ):
     """
     ## Obtener una categoría específica
@@ -196,7 +427,7 @@ def read_category(
     **Respuesta:**
     Datos completos de la categoría incluyendo imagen si tiene una asignada.
     """
-    db_category = crud.get_category(db, category_id=category_id, token=token)
+    db_category = crud.get_category(db, category_id=category_id, tenant_id=tenant_id)
     if db_category is None:
         raise HTTPException(status_code=404, detail="Categoría no encontrada")
     return db_category
@@ -212,7 +443,7 @@ def update_category(
     category_id: int,
     category: schemas.CategoryUpdate,
     db: Session = Depends(database.get_db),
-    token: str = Depends(get_current_token)
+    tenant_id: int = Depends(tenants.get_current_tenant)
 ):
     """
     ## Actualizar una categoría
@@ -223,11 +454,16 @@ def update_category(
     - **category_id**: ID de la categoría a actualizar
     - **title**: Nuevo nombre de la categoría (opcional)
     - **description**: Nueva descripción de la categoría (opcional)
+    - **parent_id**: Nueva categoría padre (opcional). La categoría se mueve con todas sus
+      subcategorías; `null` la lleva al primer nivel. No puede moverse dentro de sí misma
+      ni de una de sus subcategorías (`422`)
     
     **Respuesta:**
     Datos actualizados de la categoría.
     """
-    db_category = crud.update_category(db, category_id=category_id, category=category, token=token)
+    if "parent_id" in category.model_fields_set:
+        check_category_parent(db, tenant_id, category.parent_id, category_id)
+    db_category = crud.update_category(db, category_id=category_id, category=category, tenant_id=tenant_id)
     if db_category is None:
         raise HTTPException(status_code=404, detail="Categoría no encontrada")
     return db_category
@@ -240,8 +476,10 @@ def update_category(
 )
 def delete_category(
     category_id: int,
+    background_tasks: BackgroundTasks,
     db: Session = Depends(database.get_db),
-    token: str = Depends(get_current_token)
+    token: str = Depends(get_current_token),
+    tenant_id: int = Depends(tenants.get_current_tenant)
 ):
     """
     ## Eliminar una categoría
@@ -254,12 +492,76 @@ def delete_category(
     - **category_id**: ID de la categoría a eliminar
     
     **Nota:** Asegúrate de que no haya productos asociados a esta categoría antes de eliminarla.
+    Sus subcategorías no se eliminan: pasan a depender de la categoría padre de la eliminada.
     """
-    db_category = crud.delete_category(db, category_id=category_id, token=token)
+    db_category = crud.delete_category(db, category_id=category_id, tenant_id=tenant_id)
     if db_category is None:
         raise HTTPException(status_code=404, detail="Categoría no encontrada")
+    if db_category.picture:
+        batch.add_task(background_tasks, delete_stored_pictures, [db_category.picture], token, tenant_id)
     return {"message": "Categoría eliminada exitosamente"}
 
+@app.get(
+    "/categories/{category_id}/products",
+    response_model=List[schemas.Product],
+    summary="Productos de una categoría",
+    description="Obtiene los productos de una categoría, opcionalmente incluyendo sus subcategorías",
+    tags=["Categorías", "Productos"]
+)
+def read_category_products(
+    category_id: int,
+    recursive: bool = False,
+    skip: int = 0,
+    limit: int = 100,
+    db: Session = Depends(database.get_db),
+    tenant_id: int = Depends(tenants.get_current_tenant)
+):
+    """
+    ## Productos de una categoría
+    
+    **Parámetros:**
+    - **category_id**: ID de la categoría
+    - **recursive**: Si es `true`, incluye los productos de todas sus subcategorías (a cualquier
+      profundidad) en una sola consulta. Los productos vienen agrupados por categoría
+    - **skip**: Número de registros a omitir (para paginación)
+    - **limit**: Número máximo de registros a devolver
+    """
+    if crud.get_category(db, category_id=category_id, tenant_id=tenant_id) is None:
+        raise HTTPException(status_code=404, detail="Categoría no encontrada")
+    products = crud.get_category_products(
+        db, tenant_id=tenant_id, category_id=category_id, recursive=recursive, skip=skip, limit=limit
+    )
+    # Convert pictures string to list
+    for product in products:
+        product.pictures = product.pictures.split(",") if product.pictures else []
+    return products
+
+@app.get(
+    "/categories/{category_id}/path",
+    response_model=List[schemas.Category],
+    summary="Ruta de una categoría",
+    description="Obtiene las categorías desde el primer nivel hasta la indicada (breadcrumb)",
+    tags=["Categorías"]
+)
+def read_category_path(
+    category_id: int,
+    db: Session = Depends(database.get_db),
+    tenant_id: int = Depends(tenants.get_current_tenant)
+):
+    """
+    ## Ruta de una categoría
+    
+    Devuelve la categoría y todas sus categorías superiores, empezando por la de primer
+    nivel (ej: `Electrónicos > Celulares > Accesorios`), para armar un breadcrumb.
+    
+    **Parámetros:**
+    - **category_id**: ID de la categoría
+    """
+    path = crud.get_category_path(db, tenant_id=tenant_id, category_id=category_id)
+    if not path:
+        raise HTTPException(status_code=404, detail="Categoría no encontrada")
+    return path
+
 @app.post(
     "/categories/{category_id}/picture",
     summary="Subir imagen a categoría",
@@ -268,9 +570,11 @@ def delete_category(
 )
 def upload_category_picture(
     category_id: int,
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     db: Session = Depends(database.get_db),
-    token: str = Depends(get_current_token)
+    token: str = Depends(get_current_token),
+    tenant_id: int = Depends(tenants.get_current_tenant)
 ):
     """
     ## Subir imagen a una categoría
@@ -285,30 +589,34 @@ def upload_category_picture(
     - JPEG (.jpg, .jpeg)
     - PNG (.png)
     - GIF (.gif)
+    - WebP (.webp)
+    
+    Otras extensiones responden `400`.
     
     **Respuesta:**
     URL pública donde se puede acceder a la imagen subida.
     """
     # Check if category exists
-    db_category = crud.get_category(db, category_id=category_id, token=token)
+    db_category = crud.get_category(db, category_id=category_id, tenant_id=tenant_id)
     if db_category is None:
         raise HTTPException(status_code=404, detail="Categoría no encontrada")
     
     # Generate unique filename
-    file_extension = file.filename.split(".")[-1]
+    file_extension = image_extension(file.filename)
     filename = f"category_{category_id}_{uuid.uuid4()}.{file_extension}"
-    file_path = uploads_dir / filename
     
-    # Save file
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    # Save file (counted against the token's upload quota)
+    old_picture = db_category.picture
+    [picture_url] = save_uploads(db, tenant_id, [(filename, file.file)], "category")
     
     # Update category with picture path
-    db_category.picture = f"/uploads/{filename}"
+    db_category.picture = picture_url
     db.commit()
+    if old_picture:
+        batch.add_task(background_tasks, delete_stored_pictures, [old_picture], token, tenant_id)
     db.refresh(db_category)
     
-    return {"picture_url": f"/uploads/{filename}"}
+    return {"picture_url": db_category.picture}
 
 # Tag endpoints
 @app.get(
@@ -319,10 +627,12 @@ def upload_category_picture(
     tags=["Etiquetas"]
 )
 def read_tags(
+    response: Response,
     skip: int = 0,
     limit: int = 100,
+    ids: Optional[List[int]] = Depends(parse_ids),
     db: Session = Depends(database.get_db),
-    token: str = Depends(get_current_token)
+    tenant_id: int = Depends(tenants.get_current_tenant)
 ):
     """
     ## Listar todas las etiquetas
@@ -333,11 +643,18 @@ def read_tags(
     **Parámetros:**
     - **skip**: Número de registros a omitir (para paginación)
     - **limit**: Número máximo de registros a devolver
+    - **ids**: Ids separados por comas (ej: `ids=3,1,2`) para obtener varias etiquetas en una
+      sola petición, en el orden pedido. Los ids inexistentes se informan en la cabecera `X-Missing-Ids`
     
     **Ejemplos de etiquetas:**
     - "Nuevo", "Oferta", "Destacado", "Liquidación", etc.
     """
-    tags = crud.get_tags(db, token=token, skip=skip, limit=limit)
+    if ids is not None:
+        tags, missing = crud.get_tags_by_ids(db, tenant_id=tenant_id, ids=ids)
+        set_missing_ids(response, missing)
+        return tags
+    
+    tags = crud.get_tags(db, tenant_id=tenant_id, skip=skip, limit=limit)
     return tags
 
 @app.post(
@@ -350,7 +667,7 @@ def read_tags(
 def create_tag(
     tag: schemas.TagCreate,
     db: Session = Depends(database.get_db),
-    token: str = Depends(get_current_token)
+    tenant_id: int = Depends(tenants.get_current_tenant)
 ):
     """
     ## Crear una nueva etiqueta
@@ -364,8 +681,40 @@ def create_tag(
     - Marcar productos en oferta
     - Destacar productos nuevos
     - Crear filtros especiales
+    
+    El título no puede repetirse (`409`). Para reintentar sin crear duplicados, enviar el
+    header `Idempotency-Key` o usar `PUT /tags/by-title/{title}`.
     """
-    return crud.create_tag(db=db, tag=tag, token=token)
+    return crud.create_tag(db=db, tag=tag, tenant_id=tenant_id)
+
+@app.put(
+    "/tags/by-title/{title}",
+    response_model=schemas.Tag,
+    summary="Obtener o crear etiqueta por título",
+    description="Devuelve la etiqueta con ese título, creándola si no existe",
+    tags=["Etiquetas"]
+)
+def upsert_tag(
+    title: str,
+    response: Response,
+    db: Session = Depends(database.get_db),
+    tenant_id: int = Depends(tenants.get_current_tenant)
+):
+    """
+    ## Obtener o crear una etiqueta por título
+    
+    Útil para asignar etiquetas por nombre sin buscarlas antes: repetir la petición
+    nunca crea una etiqueta duplicada.
+    
+    **Parámetros:**
+    - **title**: Nombre de la etiqueta (en la URL, ej: `/tags/by-title/Oferta`)
+    
+    **Respuesta:** `201` si la etiqueta se creó, `200` si ya existía.
+    """
+    db_tag, created = crud.upsert_tag(db, tenant_id=tenant_id, title=title)
+    if created:
+        response.status_code = status.HTTP_201_CREATED
+    return db_tag
 
 @app.get(
     "/tags/{tag_id}", 
@@ -377,7 +726,7 @@ def create_tag(
 def read_tag(
     tag_id: int,
     db: Session = Depends(database.get_db),
-    token: str = Depends(get_current_token)
+    tenant_id: int = Depends(tenants.get_current_tenant)
 ):
     """
     ## Obtener una etiqueta específica
@@ -387,7 +736,7 @@ def read_tag(
     **Parámetros:**
     - **tag_id**: ID único de la etiqueta a obtener
     """
-    db_tag = crud.get_tag(db, tag_id=tag_id, token=token)
+    db_tag = crud.get_tag(db, tag_id=tag_id, tenant_id=tenant_id)
     if db_tag is None:
         raise HTTPException(status_code=404, detail="Etiqueta no encontrada")
     return db_tag
@@ -403,7 +752,7 @@ def update_tag(
     tag_id: int,
     tag: schemas.TagUpdate,
     db: Session = Depends(database.get_db),
-    token: str = Depends(get_current_token)
+    tenant_id: int = Depends(tenants.get_current_tenant)
 ):
     """
     ## Actualizar una etiqueta
@@ -414,7 +763,7 @@ def update_tag(
     - **tag_id**: ID de la etiqueta a actualizar
     - **title**: Nuevo nombre de la etiqueta
     """
-    db_tag = crud.update_tag(db, tag_id=tag_id, tag=tag, token=token)
+    db_tag = crud.update_tag(db, tag_id=tag_id, tag=tag, tenant_id=tenant_id)
     if db_tag is None:
         raise HTTPException(status_code=404, detail="Etiqueta no encontrada")
     return db_tag
@@ -428,7 +777,7 @@ def update_tag(
 def delete_tag(
     tag_id: int,
     db: Session = Depends(database.get_db),
-    token: str = Depends(get_current_token)
+    tenant_id: int = Depends(tenants.get_current_tenant)
 ):
     """
     ## Eliminar una etiqueta
@@ -442,11 +791,56 @@ def delete_tag(
     
     **Nota:** La etiqueta se desasociará automáticamente de todos los productos que la tenían asignada.
     """
-    db_tag = crud.delete_tag(db, tag_id=tag_id, token=token)
+    db_tag = crud.delete_tag(db, tag_id=tag_id, tenant_id=tenant_id)
     if db_tag is None:
         raise HTTPException(status_code=404, detail="Etiqueta no encontrada")
     return {"message": "Etiqueta eliminada exitosamente"}
 
+@app.post(
+    "/tags/{tag_id}/products",
+    response_model=schemas.TagProductsResult,
+    summary="Asignar etiqueta a varios productos",
+    description="Agrega o quita una etiqueta de un conjunto de productos sin reemplazar sus demás etiquetas",
+    tags=["Etiquetas"]
+)
+def update_tag_products(
+    tag_id: int,
+    changes: schemas.TagProductsUpdate,
+    db: Session = Depends(database.get_db),
+    tenant_id: int = Depends(tenants.get_current_tenant)
+):
+    """
+    ## Asignar o quitar una etiqueta en varios productos
+    
+    Agrega la etiqueta a los productos de `add` y la quita de los de `remove`, en una sola
+    operación. Las demás etiquetas de cada producto no cambian.
+    
+    **Parámetros:**
+    - **tag_id**: ID de la etiqueta
+    - **add**: IDs de productos a los que se agrega la etiqueta
+    - **remove**: IDs de productos de los que se quita la etiqueta
+    
+    **Ejemplo:**
+    ```json
+    {
+        "add": [1, 4, 7],
+        "remove": [2]
+    }
+    ```
+    
+    **Respuesta:**
+    - **added**: Productos que no tenían la etiqueta y ahora la tienen
+    - **removed**: Productos que tenían la etiqueta y ya no la tienen
+    - **missing**: IDs que no existen (o son de otro token); no generan error
+    """
+    if len(changes.add) + len(changes.remove) > MAX_IDS:
+        raise HTTPException(status_code=422, detail=f"Máximo {MAX_IDS} ids por petición")
+    if set(changes.add) & set(changes.remove):
+        raise HTTPException(status_code=422, detail="Un producto no puede estar en add y en remove a la vez")
+    if crud.get_tag(db, tag_id=tag_id, tenant_id=tenant_id) is None:
+        raise HTTPException(status_code=404, detail="Etiqueta no encontrada")
+    return crud.update_tag_products(db, tenant_id, tag_id, add=changes.add, remove=changes.remove)
+
 # Product endpoints
 @app.get(
     "/products/", 
@@ -456,10 +850,13 @@ def delete_tag(
     tags=["Productos"]
 )
 def read_products(
+    response: Response,
     skip: int = 0,
     limit: int = 100,
+    format: Literal["full", "compact"] = "full",
+    ids: Optional[List[int]] = Depends(parse_ids),
     db: Session = Depends(database.get_db),
-    token: str = Depends(get_current_token)
+    tenant_id: int = Depends(tenants.get_current_tenant)
 ):
     """
     ## Listar todos los productos
@@ -470,14 +867,36 @@ def read_products(
     **Parámetros:**
     - **skip**: Número de registros a omitir (para paginación)
     - **limit**: Número máximo de registros a devolver
+    - **format**: `full` (por defecto) o `compact`
+    - **ids**: Ids separados por comas (ej: `ids=3,1,2`) para obtener varios productos en una
+      sola petición (carrito, favoritos), en el orden pedido. Los ids inexistentes se informan
+      en la cabecera `X-Missing-Ids`
     
     **Respuesta incluye:**
     - Información básica del producto (título, descripción, precio)
     - Categoría completa con su información
     - Lista de etiquetas asignadas
     - URLs de las imágenes del producto
+    
+    **Formato compacto (`?format=compact`):**
+    Cada producto referencia su categoría (`category_id`) y sus etiquetas (`tag_ids`) por id, y
+    cada categoría y etiqueta aparece una sola vez en `categories` y `tags`:
+    `{"products": [...], "categories": [...], "tags": [...]}`
     """
-    products = crud.get_products(db, token=token, skip=skip, limit=limit)
+    missing = []
+    if ids is not None:
+        products, missing = crud.get_products_by_ids(db, tenant_id=tenant_id, ids=ids)
+    else:
+        products = crud.get_products(db, tenant_id=tenant_id, skip=skip, limit=limit)
+    
+    if format == "compact":
+        # Serialized directly with pydantic (bypasses the List[Product] response_model)
+        compact = schemas.CompactProductList.model_validate(crud.compact_product_list(db, products))
+        compact_response = Response(content=compact.model_dump_json(), media_type="application/json")
+        set_missing_ids(compact_response, missing)
+        return compact_response
+    
+    set_missing_ids(response, missing)
     # Convert pictures string to list
     for product in products:
         if product.pictures:
@@ -496,7 +915,7 @@ def read_products(
 def create_product(
     product: schemas.ProductCreate,
     db: Session = Depends(database.get_db),
-    token: str = Depends(get_current_token)
+    tenant_id: int = Depends(tenants.get_current_tenant)
 ):
     """
     ## Crear un nuevo producto
@@ -508,6 +927,7 @@ def create_product(
     - **description**: Descripción detallada
     - **price**: Precio en números decimales
     - **category_id**: ID de la categoría a la que pertenece
+    - **stock**: Unidades disponibles (opcional, 0 por defecto)
     - **tag_ids**: Lista de IDs de etiquetas (opcional)
     
     **Ejemplo:**
@@ -517,18 +937,22 @@ def create_product(
         "description": "Smartphone Apple con chip A17 Pro",
         "price": 1199.99,
         "category_id": 1,
+        "stock": 25,
         "tag_ids": [1, 2]
     }
     ```
     
     **Nota:** Las imágenes se pueden agregar posteriormente usando el endpoint de subida de imágenes.
+    
+    Para reintentar después de un timeout sin crear el producto dos veces, enviar el header
+    `Idempotency-Key` (ej: un UUID por producto): los reintentos reciben la respuesta original.
     """
     # Check if category exists
-    category = crud.get_category(db, product.category_id, token)
+    category = crud.get_category(db, product.category_id, tenant_id)
     if not category:
         raise HTTPException(status_code=404, detail="Categoría no encontrada")
     
-    db_product = crud.create_product(db=db, product=product, token=token)
+    db_product = crud.create_product(db=db, product=product, tenant_id=tenant_id)
     # Convert pictures string to list for response
     if db_product.pictures:
         db_product.pictures = db_product.pictures.split(",")
@@ -546,7 +970,7 @@ def create_product(
 def read_product(
     product_id: int,
     db: Session = Depends(database.get_db),
-    token: str = Depends(get_current_token)
+    tenant_id: int = Depends(tenants.get_current_tenant)
 ):
     """
     ## Obtener un producto específico
@@ -560,7 +984,7 @@ def read_product(
     **Parámetros:**
     - **product_id**: ID único del producto a obtener
     """
-    db_product = crud.get_product(db, product_id=product_id, token=token)
+    db_product = crud.get_product(db, product_id=product_id, tenant_id=tenant_id)
     if db_product is None:
         raise HTTPException(status_code=404, detail="Producto no encontrado")
     
@@ -571,6 +995,44 @@ def read_product(
         db_product.pictures = []
     return db_product
 
+@app.get(
+    "/products/{product_id}/related",
+    response_model=List[schemas.RelatedProduct],
+    summary="Productos relacionados",
+    description="Productos más parecidos según etiquetas compartidas y categoría",
+    tags=["Productos"]
+)
+def read_related_products(
+    product_id: int,
+    limit: int = crud.RELATED_TOP_K,
+    db: Session = Depends(database.get_db),
+    tenant_id: int = Depends(tenants.get_current_tenant)
+):
+    """
+    ## Productos relacionados
+    
+    Devuelve los productos más parecidos, del más al menos relacionado. Cada etiqueta
+    compartida suma `RELATED_TAG_WEIGHT` al puntaje (`score`) y tener la misma categoría
+    suma `RELATED_CATEGORY_WEIGHT`. Los productos sin nada en común no se incluyen.
+    
+    El índice se actualiza al crear, modificar o eliminar productos, etiquetas y
+    categorías, por lo que la consulta no compara el catálogo completo.
+    
+    **Parámetros:**
+    - **product_id**: ID del producto
+    - **limit**: Cantidad máxima de productos (hasta `RELATED_TOP_K`, 10 por defecto)
+    """
+    if crud.get_product(db, product_id=product_id, tenant_id=tenant_id) is None:
+        raise HTTPException(status_code=404, detail="Producto no encontrado")
+    related = []
+    limit = max(0, min(limit, crud.RELATED_TOP_K))
+    for product, score in crud.get_related_products(db, tenant_id=tenant_id, product_id=product_id, limit=limit):
+        # Convert pictures string to list
+        product.pictures = product.pictures.split(",") if product.pictures else []
+        product.score = score
+        related.append(product)
+    return related
+
 @app.put(
     "/products/{product_id}", 
     response_model=schemas.Product,
@@ -582,7 +1044,7 @@ def update_product(
     product_id: int,
     product: schemas.ProductUpdate,
     db: Session = Depends(database.get_db),
-    token: str = Depends(get_current_token)
+    tenant_id: int = Depends(tenants.get_current_tenant)
 ):
     """
     ## Actualizar un producto
@@ -595,6 +1057,7 @@ def update_product(
     - **description**: Nueva descripción (opcional)
     - **price**: Nuevo precio (opcional)
     - **category_id**: Nueva categoría (opcional)
+    - **stock**: Unidades disponibles (opcional)
     - **tag_ids**: Nueva lista de etiquetas (opcional)
     
     **Ejemplo de actualización parcial:**
@@ -607,11 +1070,11 @@ def update_product(
     """
     # Check if category exists if provided
     if product.category_id:
-        category = crud.get_category(db, product.category_id, token)
+        category = crud.get_category(db, product.category_id, tenant_id)
         if not category:
             raise HTTPException(status_code=404, detail="Categoría no encontrada")
     
-    db_product = crud.update_product(db, product_id=product_id, product=product, token=token)
+    db_product = crud.update_product(db, product_id=product_id, product=product, tenant_id=tenant_id)
     if db_product is None:
         raise HTTPException(status_code=404, detail="Producto no encontrado")
     
@@ -630,8 +1093,10 @@ def update_product(
 )
 def delete_product(
     product_id: int,
+    background_tasks: BackgroundTasks,
     db: Session = Depends(database.get_db),
-    token: str = Depends(get_current_token)
+    token: str = Depends(get_current_token),
+    tenant_id: int = Depends(tenants.get_current_tenant)
 ):
     """
     ## Eliminar un producto
@@ -645,11 +1110,80 @@ def delete_product(
     
     **Nota:** Las imágenes del producto también serán eliminadas del servidor.
     """
-    db_product = crud.delete_product(db, product_id=product_id, token=token)
+    db_product = crud.delete_product(db, product_id=product_id, tenant_id=tenant_id)
     if db_product is None:
         raise HTTPException(status_code=404, detail="Producto no encontrado")
+    if db_product.pictures:
+        batch.add_task(background_tasks, delete_stored_pictures, db_product.pictures.split(","), token, tenant_id)
     return {"message": "Producto eliminado exitosamente"}
 
+def change_product_tag(db: Session, tenant_id: int, product_id: int, tag_id: int, attach: bool):
+    db_product = crud.get_product(db, product_id=product_id, tenant_id=tenant_id)
+    if db_product is None:
+        raise HTTPException(status_code=404, detail="Producto no encontrado")
+    if crud.get_tag(db, tag_id=tag_id, tenant_id=tenant_id) is None:
+        raise HTTPException(status_code=404, detail="Etiqueta no encontrada")
+    if attach:
+        crud.update_tag_products(db, tenant_id, tag_id, add=[product_id], remove=[])
+    else:
+        crud.update_tag_products(db, tenant_id, tag_id, add=[], remove=[product_id])
+    
+    # Convert pictures string to list
+    if db_product.pictures:
+        db_product.pictures = db_product.pictures.split(",")
+    else:
+        db_product.pictures = []
+    return db_product
+
+@app.post(
+    "/products/{product_id}/tags/{tag_id}",
+    response_model=schemas.Product,
+    summary="Agregar etiqueta al producto",
+    description="Agrega una etiqueta al producto sin modificar sus demás etiquetas",
+    tags=["Productos"]
+)
+def add_product_tag(
+    product_id: int,
+    tag_id: int,
+    db: Session = Depends(database.get_db),
+    tenant_id: int = Depends(tenants.get_current_tenant)
+):
+    """
+    ## Agregar una etiqueta a un producto
+    
+    A diferencia de `PUT /products/{id}` con `tag_ids`, no hace falta enviar la lista completa
+    de etiquetas. Si el producto ya tenía la etiqueta, no cambia nada.
+    
+    **Parámetros:**
+    - **product_id**: ID del producto
+    - **tag_id**: ID de la etiqueta a agregar
+    """
+    return change_product_tag(db, tenant_id, product_id, tag_id, attach=True)
+
+@app.delete(
+    "/products/{product_id}/tags/{tag_id}",
+    response_model=schemas.Product,
+    summary="Quitar etiqueta del producto",
+    description="Quita una etiqueta del producto sin modificar sus demás etiquetas",
+    tags=["Productos"]
+)
+def remove_product_tag(
+    product_id: int,
+    tag_id: int,
+    db: Session = Depends(database.get_db),
+    tenant_id: int = Depends(tenants.get_current_tenant)
+):
+    """
+    ## Quitar una etiqueta de un producto
+    
+    Si el producto no tenía la etiqueta, no cambia nada.
+    
+    **Parámetros:**
+    - **product_id**: ID del producto
+    - **tag_id**: ID de la etiqueta a quitar
+    """
+    return change_product_tag(db, tenant_id, product_id, tag_id, attach=False)
+
 @app.post(
     "/products/{product_id}/pictures",
     summary="Subir imágenes al producto",
@@ -660,7 +1194,7 @@ def upload_product_pictures(
     product_id: int,
     files: List[UploadFile] = File(...),
     db: Session = Depends(database.get_db),
-    token: str = Depends(get_current_token)
+    tenant_id: int = Depends(tenants.get_current_tenant)
 ):
     """
     ## Subir imágenes a un producto
@@ -675,6 +1209,9 @@ def upload_product_pictures(
     - JPEG (.jpg, .jpeg)
     - PNG (.png)
     - GIF (.gif)
+    - WebP (.webp)
+    
+    Otras extensiones responden `400`.
     
     **Buenas prácticas:**
     - Usar imágenes de alta calidad
@@ -685,23 +1222,20 @@ def upload_product_pictures(
     Lista de URLs públicas donde se pueden acceder a las imágenes subidas.
     """
     # Check if product exists
-    db_product = crud.get_product(db, product_id=product_id, token=token)
+    db_product = crud.get_product(db, product_id=product_id, tenant_id=tenant_id)
     if db_product is None:
         raise HTTPException(status_code=404, detail="Producto no encontrado")
     
-    picture_urls = []
+    uploads = []
     
     for file in files:
         # Generate unique filename
-        file_extension = file.filename.split(".")[-1]
+        file_extension = image_extension(file.filename)
         filename = f"product_{product_id}_{uuid.uuid4()}.{file_extension}"
-        file_path = uploads_dir / filename
-        
-        # Save file
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        picture_urls.append(f"/uploads/{filename}")
+        uploads.append((filename, file.file))
+    
+    # Save files (counted against the token's upload quota)
+    picture_urls = save_uploads(db, tenant_id, uploads, "product")
     
     # Update product with picture paths
     existing_pictures = db_product.pictures.split(",") if db_product.pictures else []
@@ -712,6 +1246,398 @@ def upload_product_pictures(
     
     return {"picture_urls": picture_urls}
 
+# Cart and order endpoints
+def get_cart_or_404(db: Session, cart_id: int, tenant_id: int):
+    db_cart = crud.get_cart(db, cart_id=cart_id, tenant_id=tenant_id)
+    if db_cart is None:
+        raise HTTPException(status_code=404, detail="Carrito no encontrado")
+    return db_cart
+
+@app.post(
+    "/carts/",
+    response_model=schemas.Cart,
+    summary="Crear carrito",
+    description="Crea un carrito de compras vacío",
+    tags=["Carritos y Pedidos"]
+)
+def create_cart(
+    db: Session = Depends(database.get_db),
+    tenant_id: int = Depends(tenants.get_current_tenant)
+):
+    """
+    ## Crear un carrito
+    
+    Crea un carrito vacío. Cada token puede tener varios carritos abiertos a la vez
+    (por ejemplo, uno por cada usuario de la tienda), hasta `QUOTA_MAX_OPEN_CARTS`.
+    El carrito se elimina al confirmar la compra.
+    """
+    db_cart = crud.create_cart(db, tenant_id=tenant_id)
+    return crud.cart_contents(db, db_cart.id)
+
+@app.get(
+    "/carts/{cart_id}",
+    response_model=schemas.Cart,
+    summary="Obtener carrito",
+    description="Productos del carrito con su precio y stock actuales",
+    tags=["Carritos y Pedidos"]
+)
+def get_cart(
+    cart_id: int,
+    db: Session = Depends(database.get_db),
+    tenant_id: int = Depends(tenants.get_current_tenant)
+):
+    """
+    ## Obtener un carrito
+    
+    Devuelve los productos del carrito con su título, precio y stock actuales, y el total.
+    El stock se informa como referencia: recién se reserva al confirmar la compra.
+    """
+    get_cart_or_404(db, cart_id, tenant_id)
+    return crud.cart_contents(db, cart_id)
+
+@app.put(
+    "/carts/{cart_id}/items/{product_id}",
+    response_model=schemas.Cart,
+    summary="Agregar producto al carrito",
+    description="Agrega un producto al carrito o cambia su cantidad",
+    tags=["Carritos y Pedidos"]
+)
+def set_cart_item(
+    cart_id: int,
+    product_id: int,
+    item: schemas.CartItemUpdate,
+    db: Session = Depends(database.get_db),
+    tenant_id: int = Depends(tenants.get_current_tenant)
+):
+    """
+    ## Agregar un producto al carrito
+    
+    Fija la cantidad del producto en el carrito (no la suma a la anterior, así que repetir
+    la petición no cambia el resultado). Con `quantity: 0` el producto se quita.
+    
+    **Parámetros:**
+    - **cart_id**: ID del carrito
+    - **product_id**: ID del producto
+    - **quantity**: Cantidad (0 a 1000)
+    """
+    get_cart_or_404(db, cart_id, tenant_id)
+    if crud.get_product(db, product_id=product_id, tenant_id=tenant_id) is None:
+        raise HTTPException(status_code=404, detail="Producto no encontrado")
+    crud.set_cart_item(db, cart_id=cart_id, product_id=product_id, quantity=item.quantity)
+    return crud.cart_contents(db, cart_id)
+
+@app.delete(
+    "/carts/{cart_id}/items/{product_id}",
+    response_model=schemas.Cart,
+    summary="Quitar producto del carrito",
+    description="Quita un producto del carrito",
+    tags=["Carritos y Pedidos"]
+)
+def remove_cart_item(
+    cart_id: int,
+    product_id: int,
+    db: Session = Depends(database.get_db),
+    tenant_id: int = Depends(tenants.get_current_tenant)
+):
+    """
+    ## Quitar un producto del carrito
+    
+    **Parámetros:**
+    - **cart_id**: ID del carrito
+    - **product_id**: ID del producto a quitar
+    """
+    get_cart_or_404(db, cart_id, tenant_id)
+    crud.set_cart_item(db, cart_id=cart_id, product_id=product_id, quantity=0)
+    return crud.cart_contents(db, cart_id)
+
+@app.delete(
+    "/carts/{cart_id}",
+    summary="Eliminar carrito",
+    description="Elimina un carrito sin comprar",
+    tags=["Carritos y Pedidos"]
+)
+def delete_cart(
+    cart_id: int,
+    db: Session = Depends(database.get_db),
+    tenant_id: int = Depends(tenants.get_current_tenant)
+):
+    """
+    ## Eliminar un carrito
+    
+    Descarta el carrito y sus productos. El stock no cambia.
+    """
+    if crud.delete_cart(db, cart_id=cart_id, tenant_id=tenant_id) is None:
+        raise HTTPException(status_code=404, detail="Carrito no encontrado")
+    return {"message": "Carrito eliminado exitosamente"}
+
+@app.post(
+    "/carts/{cart_id}/checkout",
+    response_model=schemas.Order,
+    summary="Confirmar compra",
+    description="Convierte el carrito en un pedido descontando el stock de cada producto",
+    tags=["Carritos y Pedidos"]
+)
+def checkout_cart(
+    cart_id: int,
+    db: Session = Depends(database.get_db),
+    tenant_id: int = Depends(tenants.get_current_tenant)
+):
+    """
+    ## Confirmar la compra
+    
+    Crea un pedido con los productos del carrito, descuenta el stock y elimina el carrito,
+    todo en una sola transacción: o se compra todo el carrito o no se compra nada.
+    
+    El stock se descuenta con una actualización condicional por producto, por lo que
+    aunque muchos clientes compren el mismo producto a la vez nunca se vende más de lo
+    disponible.
+    
+    **Errores:**
+    - `404`: El carrito no existe, está vacío o ya se confirmó
+    - `409`: Algún producto no tiene stock suficiente; `product_ids` indica cuáles.
+      El carrito queda como estaba para corregir las cantidades y reintentar.
+    
+    **Reintentos:** enviar el header `Idempotency-Key` para que un reintento después de
+    un timeout devuelva el mismo pedido en lugar de un `404`.
+    """
+    try:
+        db_order = crud.checkout(db, tenant_id=tenant_id, cart_id=cart_id)
+    except crud.OutOfStockError as e:
+        return JSONResponse(
+            status_code=status.HTTP_409_CONFLICT,
+            content={"detail": "Stock insuficiente", "product_ids": e.product_ids}
+        )
+    if db_order is None:
+        raise HTTPException(status_code=404, detail="Carrito no encontrado o vacío")
+    return db_order
+
+@app.get(
+    "/orders/",
+    response_model=List[schemas.Order],
+    summary="Listar pedidos",
+    description="Pedidos confirmados del token, del más reciente al más antiguo",
+    tags=["Carritos y Pedidos"]
+)
+def list_orders(
+    skip: int = 0,
+    limit: int = 100,
+    db: Session = Depends(database.get_db),
+    tenant_id: int = Depends(tenants.get_current_tenant)
+):
+    """
+    ## Listar pedidos
+    
+    Cada pedido conserva el título y el precio de sus productos al momento de la compra.
+    
+    **Parámetros:**
+    - **skip**: Cantidad de registros a omitir (paginación)
+    - **limit**: Cantidad máxima de registros a retornar
+    """
+    return crud.get_orders(db, tenant_id=tenant_id, skip=skip, limit=limit)
+
+@app.get(
+    "/orders/{order_id}",
+    response_model=schemas.Order,
+    summary="Obtener pedido",
+    description="Obtiene un pedido por su ID",
+    tags=["Carritos y Pedidos"]
+)
+def get_order(
+    order_id: int,
+    db: Session = Depends(database.get_db),
+    tenant_id: int = Depends(tenants.get_current_tenant)
+):
+    """
+    ## Obtener un pedido
+    
+    **Parámetros:**
+    - **order_id**: ID del pedido
+    """
+    db_order = crud.get_order(db, order_id=order_id, tenant_id=tenant_id)
+    if db_order is None:
+        raise HTTPException(status_code=404, detail="Pedido no encontrado")
+    return db_order
+
+@app.get(
+    "/usage",
+    response_model=schemas.TokenUsage,
+    summary="Uso y cuotas del token",
+    description="Cantidad de productos, categorías, etiquetas, bytes de imágenes y carritos abiertos usados por el token y sus límites",
+    tags=["Información General"]
+)
+def read_usage(
+    db: Session = Depends(database.get_db),
+    tenant_id: int = Depends(tenants.get_current_tenant)
+):
+    """
+    ## Uso y cuotas del token
+    
+    Cada token puede crear una cantidad limitada de registros y subir un máximo de bytes
+    en imágenes. Al superar una cuota, la API responde **403**.
+    
+    **Respuesta:**
+    - **usage**: Uso actual del token
+    - **limits**: Límites configurados (0 = sin límite)
+    """
+    usage = crud.get_token_usage(db, tenant_id)
+    return {
+        "usage": {
+            field: getattr(usage, field) if usage else 0
+            for field in crud.QUOTAS
+        },
+        "limits": crud.QUOTAS,
+    }
+
+@app.get(
+    "/sync",
+    response_model=schemas.SyncChanges,
+    summary="Sincronización incremental",
+    description="Productos, categorías y etiquetas modificados o eliminados desde un cursor",
+    tags=["Información General"]
+)
+def sync_changes(
+    since: int = 0,
+    db: Session = Depends(database.get_db),
+    tenant_id: int = Depends(tenants.get_current_tenant)
+):
+    """
+    ## Sincronización incremental
+    
+    Permite mantener una copia local del catálogo sin descargarlo completo cada vez.
+    
+    **Uso:**
+    1. La primera vez, pedir `GET /sync` (sin `since`): devuelve todo el catálogo y un `cursor`
+    2. Guardar el `cursor` y, más adelante, pedir `GET /sync?since=<cursor>`
+    3. Aplicar los cambios recibidos y guardar el nuevo `cursor`
+    
+    **Respuesta:**
+    - **products**, **categories**, **tags**: Registros creados o modificados (formato compacto, con `updated_at`)
+    - **deleted**: Registros eliminados (`{"entity": "product", "id": 3}`)
+    - **cursor**: Valor de `since` para la próxima sincronización
+    - **reset**: `true` si la respuesta es el catálogo completo; la copia local debe reemplazarse
+      (primera sincronización, o después de `/seed` o de una limpieza general)
+    """
+    return crud.get_changes(db, tenant_id, since=since)
+
+@app.get(
+    "/autocomplete",
+    response_model=List[schemas.AutocompleteResult],
+    summary="Autocompletar",
+    description="Productos, categorías y etiquetas cuyo título empieza con el texto buscado",
+    tags=["Información General"]
+)
+def autocomplete_titles(
+    q: str = "",
+    limit: int = 10,
+    db: Session = Depends(database.get_db),
+    tenant_id: int = Depends(tenants.get_current_tenant)
+):
+    """
+    ## Autocompletar
+    
+    Pensado para un buscador que consulta en cada tecla. Devuelve los productos,
+    categorías y etiquetas cuyo título, o alguna palabra del título, empieza con `q`,
+    en orden alfabético. No distingue mayúsculas ni acentos (`azu` encuentra "Azúcar").
+    
+    La búsqueda usa un índice en memoria del token, sin recorrer la base de datos.
+    
+    **Parámetros:**
+    - **q**: Texto escrito hasta el momento
+    - **limit**: Cantidad máxima de resultados (hasta 50)
+    
+    **Ejemplo de respuesta:**
+    ```json
+    [{"entity": "product", "id": 3, "title": "Queso azul"}]
+    ```
+    """
+    return autocomplete.search(db, tenant_id, q, limit=limit)
+
+def events_channel(token: str) -> str:
+    """Canal del token, resuelto con una sesión corta: las conexiones abiertas no retienen ninguna"""
+    with database.get_session(token) as db:
+        return events.channel(db, tenants.get_tenant_id(db, token))
+
+@app.get(
+    "/events",
+    response_class=StreamingResponse,
+    summary="Cambios en tiempo real",
+    description="Notificaciones (Server-Sent Events) de altas, modificaciones y bajas de productos, categorías y etiquetas",
+    tags=["Información General"]
+)
+async def stream_events(token: str = Depends(get_current_token)):
+    """
+    ## Cambios en tiempo real (Server-Sent Events)
+    
+    Reemplaza el polling de los listados: la conexión queda abierta y el servidor envía un
+    evento por cada cambio confirmado en los datos del token.
+    
+    **Eventos:**
+    - `created`, `updated`, `deleted`: `{"entity": "product", "id": 3, "version": 12}`
+    - `reset`: los datos se reemplazaron (`/seed` o limpieza general); descargar todo con `GET /sync`
+    - `overflow`: el cliente no leyó a tiempo y se descartaron eventos; ponerse al día con `GET /sync`
+    
+    El `id` de cada evento es la versión del cambio, usable como `since` en `GET /sync`.
+    Conviene conectarse primero a `/events` y después pedir `GET /sync`, para no perder
+    cambios ocurridos entre ambas peticiones.
+    
+    **Ejemplo (JavaScript):** `EventSource` no permite enviar el header `Authorization`;
+    usar `fetch` con un lector del cuerpo o una librería como `@microsoft/fetch-event-source`.
+    """
+    key = await run_in_threadpool(events_channel, token)
+    subscriber = events.broker.subscribe(key)
+    if subscriber is None:
+        raise HTTPException(
+            status_code=429,
+            detail=f"Demasiadas conexiones a /events: máximo {events.MAX_SUBSCRIBERS} por token"
+        )
+    return events.EventStreamResponse(subscriber)
+
+@app.post(
+    "/batch",
+    response_model=schemas.BatchResponse,
+    summary="Varias peticiones en una",
+    description="Ejecuta una lista ordenada de peticiones en una sola llamada y, por defecto, en una sola transacción",
+    tags=["Información General"]
+)
+async def run_batch(
+    request: schemas.BatchRequest,
+    background_tasks: BackgroundTasks,
+    token: str = Depends(get_current_token),
+    tenant_id: int = Depends(tenants.get_current_tenant)
+):
+    """
+    ## Varias peticiones en una
+
+    Ejecuta en orden una lista de peticiones a los endpoints de la API, con el mismo token,
+    y devuelve todas las respuestas juntas. Útil para crear una categoría, sus etiquetas y
+    sus productos con un solo viaje de red.
+
+    **Parámetros:**
+    - **requests**: Lista de `{"method": "POST", "path": "/categories/", "body": {...}}`
+      (máximo `BATCH_MAX_REQUESTS`, 25 por defecto)
+    - **atomic**: `true` (por defecto) ejecuta todo en una transacción: si una petición falla,
+      se revierten las anteriores y las siguientes no se ejecutan (estado `424`).
+      Con `false` cada petición se confirma por separado y un error no detiene el resto.
+
+    **Referencias a respuestas anteriores:** `"$N.campo"` se reemplaza por el campo de la
+    respuesta de la petición `N` (empezando en 0), en el cuerpo o en la ruta.
+    Ejemplo: `{"method": "POST", "path": "/products/", "body": {"title": "Queso", "price": 900, "category_id": "$0.id"}}`
+    o `{"method": "PUT", "path": "/categories/$0.id", "body": {...}}`.
+
+    **Respuesta:** `responses` (`status` y `body` de cada petición, en el mismo orden) y
+    `committed` (`false` si el lote atómico se revirtió).
+
+    No se permiten `/batch`, `/seed`, `/events`, `/admin` ni la subida de archivos
+    (multipart). Las rutas deben llevar la barra final como en las peticiones
+    normales (`/products/`, no `/products`).
+    """
+    if len(request.requests) > batch.MAX_REQUESTS:
+        raise HTTPException(
+            status_code=422,
+            detail=f"Demasiadas peticiones en el lote: máximo {batch.MAX_REQUESTS}"
+        )
+    return await batch.execute(app, request.requests, token, atomic=request.atomic, background_tasks=background_tasks)
+
 # Seed endpoint
 @app.post(
     "/seed",
@@ -756,12 +1682,15 @@ def seed_database(
     **Respuesta:**
     Estadísticas detalladas sobre los datos cargados y errores si los hubiera.
     """
+    # Imported on first use: pulls in requests and yaml
+    import seeder
+    
     try:
         # Limpiar datos existentes
         seeder.clean_token_data(db, token)
         
         # Cargar nuevos datos desde seed.yml
-        stats = seeder.load_seed_data(db, token)
+        stats = seeder.load_seed_data(db, tenants.get_tenant_id(db, token))
         
         return {
             "message": "Datos de prueba cargados exitosamente",
@@ -790,7 +1719,7 @@ def seed_database(
     tags=["Administración"]
 )
 def clean_system(
-    db: Session = Depends(database.get_db),
+    db: Session = Depends(database.get_main_db),
     admin_token: str = Depends(get_admin_token)
 ):
     """
@@ -824,6 +1753,8 @@ def clean_system(
     
     ⚠️ PELIGRO: Este endpoint eliminará TODOS los datos y archivos del sistema.
     """
+    import cleaner
+    
     try:
         stats = cleaner.clean_everything(db)
         
@@ -839,6 +1770,121 @@ def clean_system(
             detail=f"Error interno del servidor durante la limpieza: {str(e)}"
         )
 
+@app.get(
+    "/admin/stats",
+    response_model=schemas.AdminStats,
+    summary="Estadísticas del sistema (Administrador)",
+    description="Cantidad de productos, categorías y etiquetas por token y totales, uso de disco y tamaño de la base de datos",
+    tags=["Administración"]
+)
+def read_admin_stats(
+    skip: int = 0,
+    limit: int = 100,
+    db: Session = Depends(database.get_main_db),
+    admin_token: str = Depends(get_admin_token)
+):
+    """
+    ## Estadísticas del sistema (Solo Administrador)
+    
+    Calcula los totales con consultas agregadas (`COUNT` / `GROUP BY`) directamente en la
+    base de datos, sin descargar los listados completos.
+    
+    **Parámetros:**
+    - **skip**: Número de tokens a omitir (para paginación)
+    - **limit**: Número máximo de tokens a devolver (ordenados por cantidad de productos)
+    
+    **Respuesta:**
+    - **totals**: Totales globales de productos, categorías y etiquetas
+    - **tokens_count**: Cantidad de tokens con datos
+    - **tokens**: Cantidades por token
+    - **uploads**: Cantidad de archivos subidos y bytes ocupados
+    - **database_bytes**: Tamaño del archivo de la base de datos
+    """
+    totals, tokens_count, tokens = crud.get_all_counts(db, skip=skip, limit=limit)
+    files, total_bytes = storage.usage()
+    return {
+        "totals": totals,
+        "tokens_count": tokens_count,
+        "tokens": tokens,
+        "uploads": {"files": files, "bytes": total_bytes},
+        "database_bytes": database.get_database_size(),
+    }
+
+@app.get(
+    "/admin/queries",
+    summary="Consultas SQL más costosas (Administrador)",
+    description="Estadísticas del perfilador de consultas por endpoint. Requiere QUERY_PROFILER=true.",
+    tags=["Administración"]
+)
+def read_query_profile(
+    limit: int = 50,
+    reset: bool = False,
+    admin_token: str = Depends(get_admin_token)
+):
+    """
+    ## Consultas SQL más costosas (Solo Administrador)
+    
+    Muestra las sentencias SQL que más tiempo acumularon desde el inicio del servidor,
+    agrupadas por el endpoint que las originó.
+    
+    **Parámetros:**
+    - **limit**: Número máximo de sentencias a devolver
+    - **reset**: Reiniciar las estadísticas después de leerlas
+    
+    **Respuesta:**
+    Por cada sentencia: endpoint, cantidad de ejecuciones, tiempo total, promedio y máximo
+    (en milisegundos) y filas afectadas.
+    """
+    if not profiler.ENABLED:
+        raise HTTPException(
+            status_code=404,
+            detail="El perfilador de consultas está desactivado (QUERY_PROFILER=true para activarlo)"
+        )
+    statements = profiler.get_statement_stats(limit=limit)
+    if reset:
+        profiler.reset_statement_stats()
+    return {
+        "slow_query_ms": profiler.SLOW_QUERY_MS,
+        "statements": statements
+    }
+
+@app.post(
+    "/admin/gc",
+    summary="Eliminar imágenes huérfanas (Administrador)",
+    description="Elimina archivos subidos que ya no están referenciados por ningún producto o categoría",
+    tags=["Administración"]
+)
+def collect_orphaned_files(
+    batch_size: int = 200,
+    max_files: int = 5000,
+    min_age: int = 3600,
+    db: Session = Depends(database.get_main_db),
+    admin_token: str = Depends(get_admin_token)
+):
+    """
+    ## Eliminar imágenes huérfanas (Solo Administrador)
+    
+    Compara los archivos del almacenamiento con las imágenes referenciadas en la base de datos
+    y elimina los que ya no se usan (por ejemplo, imágenes de seeds anteriores).
+    
+    **Parámetros:**
+    - **batch_size**: Archivos procesados por lote
+    - **max_files**: Máximo de archivos revisados en esta ejecución (la siguiente continúa donde terminó)
+    - **min_age**: Antigüedad mínima en segundos para eliminar un archivo
+    
+    **Respuesta:**
+    Archivos revisados, archivos eliminados y bytes liberados.
+    """
+    import cleaner
+    
+    stats = cleaner.collect_orphaned_files(
+        db, batch_size=batch_size, max_files=max_files, min_age=min_age
+    )
+    return {
+        "message": "Recolección de imágenes huérfanas finalizada",
+        "statistics": stats
+    }
+
 if __name__ == "__main__":
     import uvicorn
     port = int(os.environ.get("PORT", 8000))
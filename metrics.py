@@ -0,0 +1,221 @@
+import os
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+import anyio.to_thread
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client import multiprocess
+from sqlalchemy import event
+from starlette.responses import Response
+from starlette.routing import Match
+
+# HTTP
+REQUESTS = Counter(
+    "http_requests_total",
+    "Peticiones HTTP atendidas",
+    ["method", "route", "status"],
+)
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "Duración de las peticiones HTTP",
+    ["method", "route"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+REQUESTS_IN_PROGRESS = Gauge(
+    "http_requests_in_progress",
+    "Peticiones HTTP en curso",
+    ["method", "route"],
+    multiprocess_mode="livesum",
+)
+
+# Base de datos
+DB_QUERIES = Counter(
+    "db_queries_total",
+    "Consultas SQL ejecutadas",
+    ["route"],
+)
+DB_QUERY_DURATION = Histogram(
+    "db_query_duration_seconds",
+    "Duración de cada consulta SQL",
+    ["route"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1),
+)
+DB_QUERIES_PER_REQUEST = Histogram(
+    "db_queries_per_request",
+    "Consultas SQL ejecutadas por petición",
+    ["route"],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 250),
+)
+DB_TIME_PER_REQUEST = Histogram(
+    "db_time_per_request_seconds",
+    "Tiempo total en consultas SQL por petición",
+    ["route"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+
+# Pool de hilos donde se ejecutan los endpoints síncronos
+THREADPOOL_BUSY = Gauge(
+    "threadpool_threads_busy",
+    "Hilos del pool ocupados",
+    multiprocess_mode="livesum",
+)
+THREADPOOL_LIMIT = Gauge(
+    "threadpool_threads_limit",
+    "Tamaño máximo del pool de hilos",
+    multiprocess_mode="livesum",
+)
+
+# Cachés y archivos
+CACHE_REQUESTS = Counter(
+    "cache_requests_total",
+    "Consultas a cachés internas",
+    ["cache", "result"],
+)
+UPLOAD_BYTES = Counter(
+    "upload_bytes_total",
+    "Bytes de imágenes guardados en el almacenamiento",
+    ["kind"],
+)
+
+# Compresión de respuestas
+COMPRESSION_BYTES = Counter(
+    "compression_bytes_total",
+    "Bytes de respuestas antes (original) y después (compressed) de comprimir",
+    ["encoding", "stage"],
+)
+COMPRESSION_SECONDS = Counter(
+    "compression_seconds_total",
+    "Tiempo dedicado a comprimir respuestas",
+    ["encoding"],
+)
+
+# Eventos de cambios (GET /events)
+EVENT_SUBSCRIBERS = Gauge(
+    "event_subscribers",
+    "Clientes conectados a /events",
+    multiprocess_mode="livesum",
+)
+EVENTS = Counter(
+    "events_total",
+    "Eventos de cambios entregados a los clientes o descartados por colas llenas",
+    ["result"],
+)
+
+# Estadísticas de la petición en curso (route, consultas y tiempo en SQL)
+_request_stats: ContextVar[Optional[dict]] = ContextVar("request_stats", default=None)
+
+
+def record_cache(cache: str, hit: bool):
+    """Registra un acierto o fallo de la caché `cache`."""
+    CACHE_REQUESTS.labels(cache, "hit" if hit else "miss").inc()
+
+
+def record_upload(kind: str, size: int):
+    """Registra los bytes de una imagen guardada (kind: product, category, seed)."""
+    UPLOAD_BYTES.labels(kind).inc(size)
+
+
+def record_compression(encoding: str, original: int, compressed: int, seconds: float):
+    """Registra una compresión (bytes ahorrados = original - compressed)."""
+    COMPRESSION_BYTES.labels(encoding, "original").inc(original)
+    COMPRESSION_BYTES.labels(encoding, "compressed").inc(compressed)
+    COMPRESSION_SECONDS.labels(encoding).inc(seconds)
+
+
+def record_events(result: str, count: int):
+    """Registra eventos de /events entregados (delivered) o descartados (dropped)."""
+    if count:
+        EVENTS.labels(result).inc(count)
+
+
+def sample_threadpool():
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    THREADPOOL_BUSY.set(limiter.borrowed_tokens)
+    THREADPOOL_LIMIT.set(limiter.total_tokens)
+
+
+def route_template(app, scope) -> str:
+    """Devuelve la plantilla de la ruta (ej: `/products/{product_id}`) para no generar una serie por id."""
+    for route in app.router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+
+class PrometheusMiddleware:
+    """Middleware ASGI que mide cada petición HTTP por plantilla de ruta."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        route = route_template(scope["app"], scope)
+        stats = {"route": route, "queries": 0, "db_time": 0.0}
+        token = _request_stats.set(stats)
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        in_progress = REQUESTS_IN_PROGRESS.labels(method, route)
+        in_progress.inc()
+        sample_threadpool()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            REQUEST_DURATION.labels(method, route).observe(time.perf_counter() - start)
+            REQUESTS.labels(method, route, str(status_code)).inc()
+            DB_QUERIES_PER_REQUEST.labels(route).observe(stats["queries"])
+            DB_TIME_PER_REQUEST.labels(route).observe(stats["db_time"])
+            in_progress.dec()
+            sample_threadpool()
+            _request_stats.reset(token)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("metrics_query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    duration = time.perf_counter() - conn.info["metrics_query_start"].pop()
+    stats = _request_stats.get()
+    route = stats["route"] if stats else "background"
+    if stats:
+        stats["queries"] += 1
+        stats["db_time"] += duration
+    DB_QUERIES.labels(route).inc()
+    DB_QUERY_DURATION.labels(route).observe(duration)
+
+
+def _handle_error(context):
+    starts = context.connection.info.get("metrics_query_start") if context.connection else None
+    if starts:
+        starts.pop()
+
+
+def instrument_engine(engine):
+    """Registra los eventos de SQLAlchemy que miden las consultas del engine."""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+
+
+def metrics_response() -> Response:
+    sample_threadpool()
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        # Varios workers (gunicorn): se suman las métricas de todos los procesos
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
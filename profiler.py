@@ -0,0 +1,161 @@
+import logging
+import os
+import threading
+import time
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import event
+
+from metrics import route_template
+
+# Perfilador de consultas (opcional): QUERY_PROFILER=true
+ENABLED = os.getenv("QUERY_PROFILER", "false").lower() == "true"
+# Consultas más lentas que este umbral se registran en el log con su plan de ejecución
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "100"))
+# Agregar la cabecera Server-Timing con el resumen de consultas de cada petición
+SERVER_TIMING = os.getenv("QUERY_PROFILER_SERVER_TIMING", "true").lower() == "true"
+
+logger = logging.getLogger("ecommerce.profiler")
+
+# Consultas de la petición en curso
+_request_queries: ContextVar[Optional[dict]] = ContextVar("request_queries", default=None)
+
+# Estadísticas acumuladas por (endpoint, sentencia)
+_statements: Dict[tuple, Dict[str, Any]] = {}
+_statements_lock = threading.Lock()
+
+
+def explain_query_plan(cursor, statement: str, parameters) -> List[str]:
+    """
+    Obtiene el plan de ejecución de SQLite para una consulta.
+
+    Usa la conexión DBAPI directamente para no disparar los eventos de SQLAlchemy.
+
+    Returns:
+        Lista con el detalle de cada paso del plan
+    """
+    try:
+        rows = cursor.connection.execute(f"EXPLAIN QUERY PLAN {statement}", parameters).fetchall()
+        return [row[-1] for row in rows]
+    except Exception as e:
+        return [f"(no se pudo obtener el plan: {e})"]
+
+
+def record_statement(endpoint: str, statement: str, duration: float, rowcount: Optional[int]):
+    with _statements_lock:
+        stats = _statements.get((endpoint, statement))
+        if stats is None:
+            stats = _statements[(endpoint, statement)] = {
+                "endpoint": endpoint,
+                "statement": statement,
+                "count": 0,
+                "total_ms": 0.0,
+                "max_ms": 0.0,
+                "rows": 0,
+            }
+        duration_ms = duration * 1000
+        stats["count"] += 1
+        stats["total_ms"] += duration_ms
+        stats["max_ms"] = max(stats["max_ms"], duration_ms)
+        if rowcount is not None:
+            stats["rows"] += rowcount
+
+
+def get_statement_stats(limit: int = 50) -> List[Dict[str, Any]]:
+    """
+    Devuelve las sentencias que más tiempo acumularon, con su endpoint de origen.
+
+    Returns:
+        Lista ordenada por tiempo total
+    """
+    with _statements_lock:
+        rows = [dict(stats) for stats in _statements.values()]
+    for row in rows:
+        row["avg_ms"] = row["total_ms"] / row["count"]
+        row["total_ms"] = round(row["total_ms"], 3)
+        row["max_ms"] = round(row["max_ms"], 3)
+        row["avg_ms"] = round(row["avg_ms"], 3)
+    rows.sort(key=lambda row: row["total_ms"], reverse=True)
+    return rows[:limit]
+
+
+def reset_statement_stats():
+    with _statements_lock:
+        _statements.clear()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("profiler_query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    duration = time.perf_counter() - conn.info["profiler_query_start"].pop()
+    compact_statement = " ".join(statement.split())
+    request = _request_queries.get()
+    endpoint = request["endpoint"] if request else "background"
+    # SQLite solo informa filas afectadas en INSERT/UPDATE/DELETE (-1 en SELECT)
+    rowcount = cursor.rowcount if cursor.rowcount >= 0 else None
+
+    if request is not None:
+        request["count"] += 1
+        request["duration"] += duration
+
+    record_statement(endpoint, compact_statement, duration, rowcount)
+
+    if duration * 1000 >= SLOW_QUERY_MS:
+        plan = []
+        if not executemany and statement.lstrip().upper().startswith("SELECT"):
+            plan = explain_query_plan(cursor, statement, parameters)
+        logger.warning(
+            "Consulta lenta (%.1f ms) en %s: %s | parámetros: %s | plan: %s",
+            duration * 1000,
+            endpoint,
+            compact_statement,
+            parameters,
+            "; ".join(plan) or "-",
+        )
+
+
+def _handle_error(context):
+    starts = context.connection.info.get("profiler_query_start") if context.connection else None
+    if starts:
+        starts.pop()
+
+
+def instrument_engine(engine):
+    """Registra los eventos de SQLAlchemy del perfilador en el engine."""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+
+
+class QueryProfilerMiddleware:
+    """
+    Middleware ASGI que asocia cada consulta al endpoint que la originó y
+    agrega la cabecera `Server-Timing: db;dur=<ms>;desc="<n> consultas"`.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request = {"endpoint": route_template(scope["app"], scope), "count": 0, "duration": 0.0}
+        token = _request_queries.set(request)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and SERVER_TIMING:
+                timing = f'db;dur={request["duration"] * 1000:.2f};desc="{request["count"]} consultas"'
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"server-timing", timing.encode("latin-1"))
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_queries.reset(token)
@@ -0,0 +1,300 @@
+import asyncio
+import hashlib
+import json
+import math
+import os
+import time
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from starlette.responses import JSONResponse
+
+ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+
+
+class Limit(NamedTuple):
+    capacity: int       # ráfaga máxima (tamaño del balde)
+    period: float       # segundos para recargar el balde completo
+    concurrency: int    # peticiones simultáneas permitidas (0 = sin límite)
+
+    @property
+    def rate(self) -> float:
+        return self.capacity / self.period
+
+
+def parse_limit(value: str, concurrency: int) -> Limit:
+    """Convierte "120/60" (120 peticiones cada 60 segundos) en un Limit."""
+    capacity, period = value.split("/")
+    return Limit(int(capacity), float(period), concurrency)
+
+
+# Presupuestos separados por tipo de petición
+LIMITS: Dict[str, Limit] = {
+    "read": parse_limit(os.getenv("RATE_LIMIT_READ", "300/60"),
+                        int(os.getenv("RATE_LIMIT_READ_CONCURRENCY", "20"))),
+    "write": parse_limit(os.getenv("RATE_LIMIT_WRITE", "120/60"),
+                         int(os.getenv("RATE_LIMIT_WRITE_CONCURRENCY", "10"))),
+    "upload": parse_limit(os.getenv("RATE_LIMIT_UPLOAD", "30/60"),
+                          int(os.getenv("RATE_LIMIT_UPLOAD_CONCURRENCY", "4"))),
+    "seed": parse_limit(os.getenv("RATE_LIMIT_SEED", "5/300"),
+                        int(os.getenv("RATE_LIMIT_SEED_CONCURRENCY", "1"))),
+}
+
+
+def classify(method: str, path: str) -> Optional[str]:
+    """
+    Determina el presupuesto que consume una petición.
+
+    Returns:
+        "read", "write", "upload", "seed" o None si la petición no se limita
+    """
+    if method == "OPTIONS" or path.startswith("/uploads/"):
+        return None
+    if path == "/events":
+        # Conexión de larga duración: se limita con EVENTS_MAX_SUBSCRIBERS
+        return None
+    if path == "/seed":
+        return "seed"
+    if method == "POST" and (path.endswith("/picture") or path.endswith("/pictures")):
+        return "upload"
+    if method in ("GET", "HEAD"):
+        return "read"
+    return "write"
+
+
+def batch_cost(body: bytes) -> int:
+    """Escrituras que consume `POST /batch`: una por sub-petición (al menos una)."""
+    try:
+        requests = json.loads(body).get("requests")
+    except (ValueError, AttributeError):
+        return 1
+    return max(1, len(requests)) if isinstance(requests, list) else 1
+
+
+async def read_body(receive):
+    """
+    Lee el cuerpo completo de la petición y devuelve una función `receive` que lo
+    entrega otra vez a la aplicación.
+    """
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] != "http.request":
+            break
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            break
+    body = b"".join(chunks)
+    replayed = False
+
+    async def replay():
+        nonlocal replayed
+        if replayed:
+            return await receive()
+        replayed = True
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    return body, replay
+
+
+class MemoryBackend:
+    """
+    Baldes de tokens en memoria del proceso.
+
+    Suficiente con un único worker; con varios procesos cada uno tendría sus
+    propios baldes, por lo que conviene usar RedisBackend.
+    """
+
+    MAX_KEYS = 50_000
+
+    def __init__(self):
+        self.buckets: Dict[str, Tuple[float, float]] = {}
+        self.active: Dict[str, int] = {}
+
+    async def acquire(self, key: str, limit: Limit, cost: int = 1) -> Tuple[bool, float]:
+        now = time.monotonic()
+        tokens, last = self.buckets.get(key, (limit.capacity, now))
+        tokens = min(limit.capacity, tokens + (now - last) * limit.rate)
+        if tokens >= cost:
+            self.buckets[key] = (tokens - cost, now)
+            allowed, retry_after = True, 0.0
+        else:
+            self.buckets[key] = (tokens, now)
+            allowed, retry_after = False, (cost - tokens) / limit.rate
+        if len(self.buckets) > self.MAX_KEYS:
+            self.evict_idle(now)
+        return allowed, retry_after
+
+    def evict_idle(self, now: float):
+        """Descarta baldes que ya se recargaron por completo (equivalen a uno nuevo)."""
+        longest_period = max(limit.period for limit in LIMITS.values())
+        for key, (_, last) in list(self.buckets.items()):
+            if now - last > longest_period:
+                del self.buckets[key]
+
+    async def enter(self, key: str, limit: Limit) -> bool:
+        if not limit.concurrency:
+            return True
+        current = self.active.get(key, 0)
+        if current >= limit.concurrency:
+            return False
+        self.active[key] = current + 1
+        return True
+
+    async def leave(self, key: str, limit: Limit):
+        if not limit.concurrency:
+            return
+        current = self.active.get(key, 1) - 1
+        if current > 0:
+            self.active[key] = current
+        else:
+            self.active.pop(key, None)
+
+
+class RedisBackend:
+    """
+    Baldes de tokens compartidos en Redis, para despliegues con varios workers.
+
+    Requiere el paquete `redis`. El balde se actualiza de forma atómica con un
+    script Lua que usa el reloj del servidor Redis.
+    """
+
+    TOKEN_BUCKET_SCRIPT = """
+    local capacity = tonumber(ARGV[1])
+    local rate = tonumber(ARGV[2])
+    local cost = tonumber(ARGV[3])
+    local clock = redis.call('TIME')
+    local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+    local data = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+    local tokens = tonumber(data[1]) or capacity
+    local ts = tonumber(data[2]) or now
+    tokens = math.min(capacity, tokens + (now - ts) * rate)
+    local allowed = 0
+    local retry = 0
+    if tokens >= cost then
+        tokens = tokens - cost
+        allowed = 1
+    else
+        retry = (cost - tokens) / rate
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+    redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+    return {allowed, tostring(retry)}
+    """
+
+    # Si un worker muere con peticiones en curso, el contador expira solo
+    CONCURRENCY_TTL = 300
+
+    def __init__(self, url: str):
+        try:
+            import redis.asyncio
+        except ImportError:
+            raise RuntimeError(
+                "RATE_LIMIT_BACKEND=redis requiere el paquete redis. Instalalo con: pip install redis"
+            )
+        self.client = redis.asyncio.from_url(url)
+        self.token_bucket = self.client.register_script(self.TOKEN_BUCKET_SCRIPT)
+
+    async def acquire(self, key: str, limit: Limit, cost: int = 1) -> Tuple[bool, float]:
+        allowed, retry_after = await self.token_bucket(
+            keys=[f"ratelimit:bucket:{key}"], args=[limit.capacity, limit.rate, cost]
+        )
+        return bool(allowed), float(retry_after)
+
+    async def enter(self, key: str, limit: Limit) -> bool:
+        if not limit.concurrency:
+            return True
+        counter = f"ratelimit:active:{key}"
+        current = await self.client.incr(counter)
+        await self.client.expire(counter, self.CONCURRENCY_TTL)
+        if current > limit.concurrency:
+            await self.client.decr(counter)
+            return False
+        return True
+
+    async def leave(self, key: str, limit: Limit):
+        if limit.concurrency:
+            await self.client.decr(f"ratelimit:active:{key}")
+
+
+def create_backend():
+    """Crea el backend configurado con RATE_LIMIT_BACKEND (memory o redis)."""
+    backend = os.getenv("RATE_LIMIT_BACKEND", "memory").lower()
+    if backend == "memory":
+        return MemoryBackend()
+    if backend == "redis":
+        return RedisBackend(os.getenv("RATE_LIMIT_REDIS_URL", "redis://localhost:6379/0"))
+    raise RuntimeError(f"RATE_LIMIT_BACKEND desconocido: {backend}")
+
+
+def bearer_token(scope) -> Optional[str]:
+    for name, value in scope["headers"]:
+        if name == b"authorization":
+            scheme, _, credentials = value.decode("latin-1").partition(" ")
+            if scheme.lower() == "bearer" and credentials:
+                return credentials
+    return None
+
+
+def too_many_requests(retry_after: float, detail: str) -> JSONResponse:
+    return JSONResponse(
+        status_code=429,
+        content={"detail": detail},
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+
+class RateLimitMiddleware:
+    """
+    Middleware ASGI que limita las peticiones de cada token Bearer.
+
+    Cada token tiene un balde de tokens por tipo de petición (lectura,
+    escritura, subida de imágenes y seed) y un máximo de peticiones
+    simultáneas por tipo. Al excederse responde 429 con `Retry-After`.
+    El token de administrador no se limita. `POST /batch` consume una
+    escritura por cada sub-petición del lote.
+    """
+
+    def __init__(self, app, backend=None):
+        self.app = app
+        self.backend = backend or create_backend()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        kind = classify(scope["method"], scope["path"])
+        token = bearer_token(scope) if kind else None
+        if token is None or token == os.getenv("ADMIN_TOKEN"):
+            await self.app(scope, receive, send)
+            return
+
+        limit = LIMITS[kind]
+        key = f"{hashlib.sha256(token.encode()).hexdigest()[:32]}:{kind}"
+
+        cost = 1
+        if scope["method"] == "POST" and scope["path"] == "/batch":
+            body, receive = await read_body(receive)
+            cost = batch_cost(body)
+
+        allowed, retry_after = await self.backend.acquire(key, limit, cost)
+        if not allowed:
+            response = too_many_requests(
+                retry_after,
+                f"Demasiadas peticiones ({kind}): máximo {limit.capacity} cada {limit.period:g} segundos"
+            )
+            await response(scope, receive, send)
+            return
+
+        if not await self.backend.enter(key, limit):
+            response = too_many_requests(
+                1,
+                f"Demasiadas peticiones simultáneas ({kind}): máximo {limit.concurrency}"
+            )
+            await response(scope, receive, send)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            await asyncio.shield(self.backend.leave(key, limit))
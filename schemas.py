@@ -1,14 +1,19 @@
-from pydantic import BaseModel
-from typing import List, Optional
+from datetime import datetime
+from pydantic import BaseModel, Field
+from typing import Any, List, Literal, Optional
 
 # Category schemas
 class CategoryBase(BaseModel):
     title: str
     description: str
+    parent_id: Optional[int] = None
 
 class CategoryCreate(CategoryBase):
     pass
 
+class CategoryUpsert(BaseModel):
+    description: str
+
 class CategoryUpdate(CategoryBase):
     title: Optional[str] = None
     description: Optional[str] = None
@@ -16,6 +21,7 @@ class CategoryUpdate(CategoryBase):
 class Category(CategoryBase):
     id: int
     picture: Optional[str] = None
+    updated_at: Optional[datetime] = None
     
     class Config:
         from_attributes = True
@@ -32,16 +38,28 @@ class TagUpdate(TagBase):
 
 class Tag(TagBase):
     id: int
+    updated_at: Optional[datetime] = None
     
     class Config:
         from_attributes = True
 
+# Tag membership deltas (POST /tags/{id}/products): attach/detach without replacing tag_ids
+class TagProductsUpdate(BaseModel):
+    add: List[int] = []
+    remove: List[int] = []
+
+class TagProductsResult(BaseModel):
+    added: List[int]
+    removed: List[int]
+    missing: List[int]
+
 # Product schemas
 class ProductBase(BaseModel):
     title: str
     description: str
     price: float
     category_id: int
+    stock: int = Field(0, ge=0)
 
 class ProductCreate(ProductBase):
     tag_ids: Optional[List[int]] = []
@@ -51,6 +69,7 @@ class ProductUpdate(BaseModel):
     description: Optional[str] = None
     price: Optional[float] = None
     category_id: Optional[int] = None
+    stock: Optional[int] = Field(None, ge=0)
     tag_ids: Optional[List[int]] = None
 
 class Product(ProductBase):
@@ -58,6 +77,120 @@ class Product(ProductBase):
     pictures: Optional[List[str]] = []
     category: Optional[Category] = None
     tags: Optional[List[Tag]] = []
+    updated_at: Optional[datetime] = None
+    
+    class Config:
+        from_attributes = True
+
+# Related products (GET /products/{id}/related), best first
+class RelatedProduct(Product):
+    score: float
+
+# Compact product listing (?format=compact): categories and tags sent once, referenced by id
+class CompactProduct(ProductBase):
+    id: int
+    pictures: List[str] = []
+    tag_ids: List[int] = []
+    updated_at: Optional[datetime] = None
+
+class CompactProductList(BaseModel):
+    products: List[CompactProduct]
+    categories: List[Category]
+    tags: List[Tag]
+
+# Incremental sync (GET /sync): rows changed and deleted since a cursor
+class DeletedEntity(BaseModel):
+    entity: Literal["product", "category", "tag"]
+    id: int
+
+class SyncChanges(CompactProductList):
+    deleted: List[DeletedEntity] = []
+    cursor: int
+    reset: bool
+
+# Typeahead (GET /autocomplete)
+class AutocompleteResult(BaseModel):
+    entity: Literal["product", "category", "tag"]
+    id: int
+    title: str
+
+# Cart and order schemas
+class CartItemUpdate(BaseModel):
+    quantity: int = Field(..., ge=0, le=1000)  # 0 removes the product from the cart
+
+class CartItem(BaseModel):
+    product_id: int
+    title: str
+    price: float
+    quantity: int
+    stock: int  # Available now; checked again at checkout
+
+class Cart(BaseModel):
+    id: int
+    items: List[CartItem]
+    total: float
+
+class OrderItem(BaseModel):
+    product_id: int
+    title: Optional[str] = None
+    unit_price: float
+    quantity: int
+    
+    class Config:
+        from_attributes = True
+
+class Order(BaseModel):
+    id: int
+    created_at: datetime
+    total: float
+    items: List[OrderItem]
     
     class Config:
         from_attributes = True
+
+# Batch requests (POST /batch): sub-requests run in order against the existing routes
+class BatchSubRequest(BaseModel):
+    method: Literal["GET", "POST", "PUT", "PATCH", "DELETE"]
+    path: str
+    body: Optional[Any] = None
+
+class BatchRequest(BaseModel):
+    requests: List[BatchSubRequest]
+    atomic: bool = True
+
+class BatchSubResponse(BaseModel):
+    status: int
+    body: Optional[Any] = None
+
+class BatchResponse(BaseModel):
+    responses: List[BatchSubResponse]
+    committed: bool
+
+# Admin statistics schemas
+class EntityCounts(BaseModel):
+    products: int
+    categories: int
+    tags: int
+
+class TokenStats(EntityCounts):
+    token_hash: Optional[str] = None  # SHA-256 of the bearer token
+
+class StorageStats(BaseModel):
+    files: int
+    bytes: int
+
+class AdminStats(BaseModel):
+    totals: EntityCounts
+    tokens_count: int
+    tokens: List[TokenStats]
+    uploads: StorageStats
+    database_bytes: int
+
+# Per-token quota schemas
+class UsageCounts(EntityCounts):
+    upload_bytes: int
+    carts: int
+
+class TokenUsage(BaseModel):
+    usage: UsageCounts
+    limits: UsageCounts
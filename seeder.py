@@ -2,51 +2,71 @@ import yaml
 import requests
 import os
 import uuid
-from pathlib import Path
 from urllib.parse import urlparse
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 from typing import Dict, List, Any
 
 import database
 import crud
 import schemas
+import metrics
+import tenants
+from storage import IMAGE_EXTENSIONS, Storage, get_storage
 
-def download_image(url: str, filename: str, uploads_dir: Path) -> str:
+# Unidades disponibles de cada producto del seed que no indica `stock`
+SEED_STOCK = 100
+
+def download_image(url: str, filename: str, storage: Storage = None, db: Session = None, tenant_id: int = None) -> str:
     """
-    Descarga una imagen desde una URL y la guarda localmente.
+    Descarga una imagen desde una URL y la guarda en el almacenamiento configurado.
+    
+    La descarga se transmite por bloques directamente al almacenamiento, sin
+    cargar la imagen completa en memoria. Si se indican `db` y `tenant_id`, los
+    bytes se descuentan de la cuota del token (sin confirmar la transacción).
     
     Args:
         url: URL de la imagen a descargar
         filename: Nombre base para el archivo
-        uploads_dir: Directorio donde guardar la imagen
+        storage: Backend de almacenamiento (por defecto el de la aplicación)
+        db: Sesión de base de datos para registrar el uso (opcional)
+        tenant_id: Id del token dueño de la imagen (opcional)
     
     Returns:
-        Ruta local de la imagen descargada
+        Ruta pública de la imagen descargada
     """
+    storage = storage or get_storage()
     try:
-        response = requests.get(url, timeout=30)
-        response.raise_for_status()
-        
-        # Obtener extensión del archivo desde la URL o usar jpg por defecto
-        parsed_url = urlparse(url)
-        path = parsed_url.path
-        if '.' in path:
-            extension = path.split('.')[-1].lower()
-            # Validar extensiones de imagen
-            if extension not in ['jpg', 'jpeg', 'png', 'gif', 'webp']:
+        with requests.get(url, timeout=30, stream=True) as response:
+            response.raise_for_status()
+            
+            # Obtener extensión del archivo desde la URL o usar jpg por defecto
+            parsed_url = urlparse(url)
+            path = parsed_url.path
+            if '.' in path:
+                extension = path.split('.')[-1].lower()
+                # Validar extensiones de imagen
+                if extension not in IMAGE_EXTENSIONS:
+                    extension = 'jpg'
+            else:
                 extension = 'jpg'
-        else:
-            extension = 'jpg'
-        
-        # Generar nombre único para el archivo
-        unique_filename = f"{filename}_{uuid.uuid4().hex[:8]}.{extension}"
-        file_path = uploads_dir / unique_filename
+            
+            # Generar nombre único para el archivo
+            unique_filename = f"{filename}_{uuid.uuid4().hex[:8]}.{extension}"
+            
+            # Guardar la imagen (decodificando gzip/deflate del transporte si lo hubiera)
+            response.raw.decode_content = True
+            size = storage.save(unique_filename, response.raw)
+            metrics.record_upload("seed", size)
         
-        # Guardar la imagen
-        with open(file_path, 'wb') as f:
-            f.write(response.content)
+        if db is not None:
+            try:
+                crud.reserve_usage(db, tenant_id, "upload_bytes", size)
+            except crud.QuotaExceededError:
+                storage.delete(unique_filename)
+                raise
         
-        return f"/uploads/{unique_filename}"
+        return storage.url(unique_filename)
     
     except Exception as e:
         print(f"Error descargando imagen {url}: {e}")
@@ -60,37 +80,65 @@ def clean_token_data(db: Session, token: str):
         db: Sesión de base de datos
         token: Token del usuario
     """
+    # Con DATABASE_SHARDING, `db` es la sesión del shard del token: se borran sus filas
+    # igual que en la base compartida. El archivo (y su tabla de tokens) se conserva, así
+    # los ids cacheados en cada worker siguen siendo válidos y los clientes de /sync y
+    # /events reciben el reinicio
+    tenant_id = tenants.get_tenant_id(db, token)
+    
+    # Eliminar el índice de productos relacionados
+    product_ids = select(database.Product.id).where(database.Product.tenant_id == tenant_id)
+    db.query(database.RelatedProduct).filter(database.RelatedProduct.product_id.in_(product_ids)).delete(synchronize_session=False)
+    
+    # Eliminar carritos y pedidos (los carritos hacen referencia a los productos)
+    cart_ids = select(database.Cart.id).where(database.Cart.tenant_id == tenant_id)
+    db.query(database.CartItem).filter(database.CartItem.cart_id.in_(cart_ids)).delete(synchronize_session=False)
+    db.query(database.Cart).filter(database.Cart.tenant_id == tenant_id).delete(synchronize_session=False)
+    order_ids = select(database.Order.id).where(database.Order.tenant_id == tenant_id)
+    db.query(database.OrderItem).filter(database.OrderItem.order_id.in_(order_ids)).delete(synchronize_session=False)
+    db.query(database.Order).filter(database.Order.tenant_id == tenant_id).delete(synchronize_session=False)
+    
     # Eliminar productos (esto también elimina las relaciones con etiquetas)
-    products = db.query(database.Product).filter(database.Product.token == token).all()
+    products = db.query(database.Product).filter(database.Product.tenant_id == tenant_id).all()
     for product in products:
         db.delete(product)
     
-    # Eliminar categorías
-    categories = db.query(database.Category).filter(database.Category.token == token).all()
+    # Eliminar categorías (y el árbol de categorías)
+    category_ids = select(database.Category.id).where(database.Category.tenant_id == tenant_id)
+    db.query(database.CategoryClosure).filter(database.CategoryClosure.descendant_id.in_(category_ids)).delete(synchronize_session=False)
+    categories = db.query(database.Category).filter(database.Category.tenant_id == tenant_id).all()
     for category in categories:
         db.delete(category)
     
     # Eliminar etiquetas
-    tags = db.query(database.Tag).filter(database.Tag.token == token).all()
+    tags = db.query(database.Tag).filter(database.Tag.tenant_id == tenant_id).all()
     for tag in tags:
         db.delete(tag)
     
+    # Las respuestas guardadas por Idempotency-Key hacen referencia a los datos eliminados
+    db.query(database.IdempotencyKey).filter(database.IdempotencyKey.tenant_id == tenant_id).delete()
+    
+    # Reiniciar los contadores de uso del token
+    crud.reset_token_usage(db, tenant_id)
+    
+    # Los clientes de /sync vuelven a descargar el catálogo completo
+    crud.reset_sync(db, tenant_id)
+    
     db.commit()
 
-def load_seed_data(db: Session, token: str, seed_file_path: str = "seed.yml") -> Dict[str, Any]:
+def load_seed_data(db: Session, tenant_id: int, seed_file_path: str = "seed.yml") -> Dict[str, Any]:
     """
     Carga datos desde el archivo seed.yml y los inserta en la base de datos.
     
     Args:
         db: Sesión de base de datos
-        token: Token del usuario
+        tenant_id: Id del token del usuario (ver `tenants.get_tenant_id`)
         seed_file_path: Ruta al archivo de semilla
     
     Returns:
         Diccionario con estadísticas de la carga
     """
-    uploads_dir = Path("uploads")
-    uploads_dir.mkdir(exist_ok=True)
+    storage = get_storage()
     
     # Leer archivo YAML
     try:
@@ -109,9 +157,6 @@ def load_seed_data(db: Session, token: str, seed_file_path: str = "seed.yml") ->
         "errors": []
     }
     
-    # Crear un diccionario para almacenar las etiquetas creadas
-    tags_map = {}
-    
     # Procesar cada categoría
     for category_key, category_data in seed_data.items():
         try:
@@ -121,7 +166,7 @@ def load_seed_data(db: Session, token: str, seed_file_path: str = "seed.yml") ->
                 description=category_data["description"]
             )
             
-            db_category = crud.create_category(db=db, category=category_create, token=token)
+            db_category = crud.create_category(db=db, category=category_create, tenant_id=tenant_id)
             stats["categories_created"] += 1
             
             # Descargar imagen de categoría si existe
@@ -129,7 +174,9 @@ def load_seed_data(db: Session, token: str, seed_file_path: str = "seed.yml") ->
                 picture_url = download_image(
                     category_data["picture"],
                     f"category_{db_category.id}",
-                    uploads_dir
+                    storage,
+                    db,
+                    tenant_id
                 )
                 if picture_url:
                     db_category.picture = picture_url
@@ -144,24 +191,23 @@ def load_seed_data(db: Session, token: str, seed_file_path: str = "seed.yml") ->
                         tag_ids = []
                         if "tags" in item_data:
                             for tag_name in item_data["tags"]:
-                                if tag_name not in tags_map:
-                                    # Crear nueva etiqueta
-                                    tag_create = schemas.TagCreate(title=tag_name)
-                                    db_tag = crud.create_tag(db=db, tag=tag_create, token=token)
-                                    tags_map[tag_name] = db_tag.id
+                                # La etiqueta se crea la primera vez que aparece
+                                db_tag, created = crud.upsert_tag(db, tenant_id=tenant_id, title=tag_name)
+                                if created:
                                     stats["tags_created"] += 1
-                                tag_ids.append(tags_map[tag_name])
+                                tag_ids.append(db_tag.id)
                         
                         # Crear producto
                         product_create = schemas.ProductCreate(
                             title=item_data["title"],
                             description=item_data["description"],
                             price=float(item_data["price"]),
+                            stock=int(item_data.get("stock", SEED_STOCK)),
                             category_id=db_category.id,
                             tag_ids=tag_ids
                         )
                         
-                        db_product = crud.create_product(db=db, product=product_create, token=token)
+                        db_product = crud.create_product(db=db, product=product_create, tenant_id=tenant_id)
                         stats["products_created"] += 1
                         
                         # Descargar imágenes del producto
@@ -171,7 +217,9 @@ def load_seed_data(db: Session, token: str, seed_file_path: str = "seed.yml") ->
                                 downloaded_url = download_image(
                                     picture_url,
                                     f"product_{db_product.id}_{i}",
-                                    uploads_dir
+                                    storage,
+                                    db,
+                                    tenant_id
                                 )
                                 if downloaded_url:
                                     picture_urls.append(downloaded_url)
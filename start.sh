@@ -26,5 +26,11 @@ fi
 mkdir -p uploads
 
 # Iniciar servidor
-echo "🔥 Iniciando servidor con recarga automática..."
-uvicorn main:app --host 0.0.0.0 --port 8000 --reload
+if [ "${WEB_CONCURRENCY:-1}" -gt 1 ]; then
+    # Varios procesos (ej: WEB_CONCURRENCY=4 ./start.sh), sin recarga automática
+    echo "🔥 Iniciando servidor con $WEB_CONCURRENCY workers..."
+    PORT=8000 gunicorn main:app -c gunicorn.conf.py
+else
+    echo "🔥 Iniciando servidor con recarga automática..."
+    uvicorn main:app --host 0.0.0.0 --port 8000 --reload
+fi
@@ -0,0 +1,93 @@
+import os
+from mimetypes import guess_type
+
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+
+# Los nombres de archivo subidos incluyen un UUID y nunca se reescriben,
+# por lo que el navegador puede guardarlos en caché sin revalidar.
+CACHE_MAX_AGE = int(os.getenv("UPLOADS_CACHE_MAX_AGE", "31536000"))
+CACHE_CONTROL = f"public, max-age={CACHE_MAX_AGE}, immutable"
+
+# Servir variantes precomprimidas (archivo.svg.br / archivo.svg.gz) si existen
+PRECOMPRESSED = os.getenv("UPLOADS_PRECOMPRESSED", "false").lower() == "true"
+PRECOMPRESSED_ENCODINGS = [("br", ".br"), ("gzip", ".gz")]
+
+# Delegar el envío del archivo a un proxy (ej: "X-Accel-Redirect" en nginx,
+# "X-Sendfile" en Apache). Vacío = el archivo lo envía la propia API.
+SENDFILE_HEADER = os.getenv("UPLOADS_SENDFILE_HEADER", "")
+SENDFILE_PREFIX = os.getenv("UPLOADS_SENDFILE_PREFIX", "/protected-uploads/")
+
+
+class UploadsStaticFiles(StaticFiles):
+    """
+    StaticFiles para el directorio uploads con cabeceras de caché de larga duración.
+
+    FileResponse ya agrega ETag, Last-Modified y soporte de Range, y usa
+    `http.response.pathsend` cuando el servidor lo soporta. Esta clase agrega
+    `Cache-Control: immutable`, variantes precomprimidas opcionales y la
+    delegación opcional del envío al proxy (X-Accel-Redirect / X-Sendfile).
+    """
+
+    def file_response(
+        self,
+        full_path,
+        stat_result: os.stat_result,
+        scope,
+        status_code: int = 200,
+    ) -> Response:
+        request_headers = Headers(scope=scope)
+        media_type = guess_type(str(full_path))[0] or "application/octet-stream"
+
+        if SENDFILE_HEADER:
+            response = self.sendfile_response(full_path, media_type)
+        else:
+            response = self.precompressed_response(full_path, media_type, request_headers)
+            if response is None:
+                response = FileResponse(full_path, status_code=status_code, stat_result=stat_result)
+            if self.is_not_modified(response.headers, request_headers):
+                response = NotModifiedResponse(response.headers)
+
+        response.headers["Cache-Control"] = CACHE_CONTROL
+        if PRECOMPRESSED:
+            response.headers["Vary"] = "Accept-Encoding"
+        return response
+
+    def precompressed_response(self, full_path, media_type: str, request_headers: Headers):
+        """
+        Devuelve la variante precomprimida del archivo si el cliente la acepta y existe.
+
+        Returns:
+            FileResponse de la variante o None si no corresponde
+        """
+        if not PRECOMPRESSED:
+            return None
+
+        accepted = [
+            value.split(";")[0].strip()
+            for value in request_headers.get("accept-encoding", "").split(",")
+        ]
+        for encoding, suffix in PRECOMPRESSED_ENCODINGS:
+            if encoding not in accepted:
+                continue
+            variant_path = f"{full_path}{suffix}"
+            try:
+                variant_stat = os.stat(variant_path)
+            except FileNotFoundError:
+                continue
+            return FileResponse(
+                variant_path,
+                stat_result=variant_stat,
+                media_type=media_type,
+                headers={"Content-Encoding": encoding},
+            )
+        return None
+
+    def sendfile_response(self, full_path, media_type: str) -> Response:
+        """Respuesta vacía que le indica al proxy qué archivo enviar."""
+        relative_path = os.path.relpath(full_path, self.directory)
+        return Response(
+            media_type=media_type,
+            headers={SENDFILE_HEADER: SENDFILE_PREFIX + relative_path.replace(os.sep, "/")},
+        )
@@ -0,0 +1,301 @@
+import importlib.util
+import os
+import uuid
+from functools import cached_property
+from mimetypes import guess_type
+from pathlib import Path
+from typing import BinaryIO, Iterator, NamedTuple, Optional, Tuple
+
+# Prefijo público de las imágenes guardadas en la base de datos
+PUBLIC_PREFIX = "/uploads/"
+
+CHUNK_SIZE = 64 * 1024
+
+# Extensiones aceptadas para las imágenes (subidas y descargadas por el seed)
+IMAGE_EXTENSIONS = ("jpg", "jpeg", "png", "gif", "webp")
+
+
+class StoredFile(NamedTuple):
+    name: str
+    size: int
+    modified: float
+
+
+class Storage:
+    """
+    Interfaz común para los backends de almacenamiento de imágenes.
+
+    Los nombres son relativos al almacenamiento (ej: `product_1_<uuid>.jpg`)
+    y la base de datos guarda siempre la ruta pública `/uploads/<nombre>`,
+    independientemente del backend.
+    """
+
+    def save(self, name: str, fileobj: BinaryIO) -> int:
+        """Guarda el contenido leyendo por bloques. Devuelve los bytes escritos."""
+        raise NotImplementedError
+
+    def open(self, name: str) -> Iterator[bytes]:
+        """Devuelve el contenido del archivo como un iterador de bloques."""
+        raise NotImplementedError
+
+    def delete(self, name: str) -> int:
+        """Elimina el archivo. Devuelve los bytes liberados (0 si no existía)."""
+        raise NotImplementedError
+
+    def list(self, start_after: Optional[str] = None) -> Iterator[StoredFile]:
+        """
+        Recorre los archivos almacenados en orden alfabético.
+
+        Args:
+            start_after: Si se indica, comienza después de este nombre (para recorridos incrementales)
+        """
+        raise NotImplementedError
+
+    def clear(self) -> int:
+        """Elimina todos los archivos. Devuelve la cantidad eliminada."""
+        raise NotImplementedError
+
+    def usage(self) -> Tuple[int, int]:
+        """Devuelve la cantidad de archivos y el total de bytes almacenados."""
+        files = 0
+        total = 0
+        for stored in self.list():
+            files += 1
+            total += stored.size
+        return files, total
+
+    def presigned_url(self, name: str) -> Optional[str]:
+        """URL temporal para descargar el archivo sin pasar por la API (si el backend la soporta)."""
+        return None
+
+    def url(self, name: str) -> str:
+        return f"{PUBLIC_PREFIX}{name}"
+
+
+class LocalStorage(Storage):
+    """Almacenamiento en un directorio del sistema de archivos local."""
+
+    def __init__(self, directory: str = "uploads"):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def path(self, name: str) -> Path:
+        path = (self.directory / name).resolve()
+        if path.parent != self.directory.resolve():
+            raise ValueError(f"Nombre de archivo inválido: {name}")
+        return path
+
+    def save(self, name: str, fileobj: BinaryIO) -> int:
+        path = self.path(name)
+        # Escribir en un archivo temporal y renombrar: nunca se sirve un archivo a medias
+        tmp_path = path.with_name(f".{name}.{uuid.uuid4().hex}.tmp")
+        written = 0
+        try:
+            with open(tmp_path, "wb") as buffer:
+                while chunk := fileobj.read(CHUNK_SIZE):
+                    buffer.write(chunk)
+                    written += len(chunk)
+            os.replace(tmp_path, path)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+        return written
+
+    def open(self, name: str) -> Iterator[bytes]:
+        with open(self.path(name), "rb") as f:
+            while chunk := f.read(CHUNK_SIZE):
+                yield chunk
+
+    def delete(self, name: str) -> int:
+        path = self.path(name)
+        try:
+            size = path.stat().st_size
+            path.unlink()
+        except FileNotFoundError:
+            return 0
+        return size
+
+    def list(self, start_after: Optional[str] = None) -> Iterator[StoredFile]:
+        if not self.directory.is_dir():
+            return
+        with os.scandir(self.directory) as entries:
+            names = sorted(
+                entry.name for entry in entries
+                if not entry.name.startswith(".") and (start_after is None or entry.name > start_after)
+            )
+        for name in names:
+            try:
+                stat = (self.directory / name).stat()
+            except FileNotFoundError:
+                continue
+            if os.path.isfile(self.directory / name):
+                yield StoredFile(name, stat.st_size, stat.st_mtime)
+
+    def clear(self) -> int:
+        deleted = 0
+        for stored in list(self.list()):
+            self.path(stored.name).unlink(missing_ok=True)
+            deleted += 1
+        return deleted
+
+
+class _CountingReader:
+    """Envuelve un archivo para contar los bytes leídos mientras se sube."""
+
+    def __init__(self, fileobj: BinaryIO):
+        self.fileobj = fileobj
+        self.count = 0
+
+    def read(self, size: int = -1) -> bytes:
+        chunk = self.fileobj.read(size)
+        self.count += len(chunk)
+        return chunk
+
+
+class S3Storage(Storage):
+    """
+    Almacenamiento en un bucket S3 o compatible (MinIO, Cloudflare R2, etc.).
+
+    Requiere `boto3`. Las imágenes se sirven con un redirect a una URL
+    prefirmada (o a `S3_PUBLIC_URL` si el bucket es público), así los bytes
+    no pasan por el proceso de Python. El cliente de boto3 (lento de importar)
+    se crea en el primer uso, no al iniciar la aplicación.
+    """
+
+    def __init__(
+        self,
+        bucket: str,
+        prefix: str = "",
+        endpoint_url: Optional[str] = None,
+        region: Optional[str] = None,
+        access_key: Optional[str] = None,
+        secret_key: Optional[str] = None,
+        presign_expires: int = 3600,
+        public_url: Optional[str] = None,
+    ):
+        if importlib.util.find_spec("boto3") is None:
+            raise RuntimeError(
+                "STORAGE_BACKEND=s3 requiere boto3. Instalalo con: pip install boto3"
+            )
+
+        self.bucket = bucket
+        self.prefix = prefix.strip("/") + "/" if prefix.strip("/") else ""
+        self.presign_expires = presign_expires
+        self.public_url = public_url.rstrip("/") if public_url else None
+        self.client_options = {
+            "endpoint_url": endpoint_url,
+            "region_name": region,
+            "aws_access_key_id": access_key,
+            "aws_secret_access_key": secret_key,
+        }
+
+    @cached_property
+    def client(self):
+        import boto3
+        return boto3.client("s3", **self.client_options)
+
+    def key(self, name: str) -> str:
+        if "/" in name or name.startswith("."):
+            raise ValueError(f"Nombre de archivo inválido: {name}")
+        return f"{self.prefix}{name}"
+
+    def save(self, name: str, fileobj: BinaryIO) -> int:
+        reader = _CountingReader(fileobj)
+        content_type = guess_type(name)[0] or "application/octet-stream"
+        # upload_fileobj sube por partes (multipart) sin cargar el archivo en memoria
+        self.client.upload_fileobj(
+            reader,
+            self.bucket,
+            self.key(name),
+            ExtraArgs={
+                "ContentType": content_type,
+                "CacheControl": "public, max-age=31536000, immutable",
+            },
+        )
+        return reader.count
+
+    def open(self, name: str) -> Iterator[bytes]:
+        response = self.client.get_object(Bucket=self.bucket, Key=self.key(name))
+        yield from response["Body"].iter_chunks(CHUNK_SIZE)
+
+    def delete(self, name: str) -> int:
+        key = self.key(name)
+        try:
+            size = self.client.head_object(Bucket=self.bucket, Key=key)["ContentLength"]
+        except self.client.exceptions.ClientError:
+            return 0
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+        return size
+
+    def list(self, start_after: Optional[str] = None) -> Iterator[StoredFile]:
+        paginator = self.client.get_paginator("list_objects_v2")
+        extra = {"StartAfter": self.key(start_after)} if start_after else {}
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix, **extra):
+            for obj in page.get("Contents", []):
+                name = obj["Key"][len(self.prefix):]
+                if "/" in name:
+                    continue
+                yield StoredFile(name, obj["Size"], obj["LastModified"].timestamp())
+
+    def clear(self) -> int:
+        deleted = 0
+        batch = []
+        for stored in self.list():
+            batch.append({"Key": self.key(stored.name)})
+            # delete_objects acepta hasta 1000 claves por llamada
+            if len(batch) == 1000:
+                self.client.delete_objects(Bucket=self.bucket, Delete={"Objects": batch})
+                deleted += len(batch)
+                batch = []
+        if batch:
+            self.client.delete_objects(Bucket=self.bucket, Delete={"Objects": batch})
+            deleted += len(batch)
+        return deleted
+
+    def presigned_url(self, name: str) -> str:
+        if self.public_url:
+            return f"{self.public_url}/{self.key(name)}"
+        return self.client.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": self.bucket, "Key": self.key(name)},
+            ExpiresIn=self.presign_expires,
+        )
+
+
+_storage: Optional[Storage] = None
+
+
+def create_storage() -> Storage:
+    """Crea el backend configurado con la variable de entorno STORAGE_BACKEND."""
+    backend = os.getenv("STORAGE_BACKEND", "local").lower()
+    if backend == "local":
+        return LocalStorage(os.getenv("UPLOADS_DIR", "uploads"))
+    if backend == "s3":
+        bucket = os.getenv("S3_BUCKET")
+        if not bucket:
+            raise RuntimeError("STORAGE_BACKEND=s3 requiere la variable S3_BUCKET")
+        return S3Storage(
+            bucket=bucket,
+            prefix=os.getenv("S3_PREFIX", ""),
+            endpoint_url=os.getenv("S3_ENDPOINT_URL"),
+            region=os.getenv("S3_REGION"),
+            access_key=os.getenv("S3_ACCESS_KEY_ID"),
+            secret_key=os.getenv("S3_SECRET_ACCESS_KEY"),
+            presign_expires=int(os.getenv("S3_PRESIGN_EXPIRES", "3600")),
+            public_url=os.getenv("S3_PUBLIC_URL"),
+        )
+    raise RuntimeError(f"STORAGE_BACKEND desconocido: {backend}")
+
+
+def get_storage() -> Storage:
+    """Devuelve el backend de almacenamiento compartido por toda la aplicación."""
+    global _storage
+    if _storage is None:
+        _storage = create_storage()
+    return _storage
+
+
+def name_from_url(picture_url: str) -> Optional[str]:
+    """Obtiene el nombre del archivo a partir de la ruta pública `/uploads/<nombre>`."""
+    if picture_url and picture_url.startswith(PUBLIC_PREFIX):
+        return picture_url[len(PUBLIC_PREFIX):]
+    return None
@@ -0,0 +1,68 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Tuple
+
+from fastapi import Depends
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+import database
+import metrics
+from auth import get_current_token, hash_token
+
+# Tokens resueltos que se mantienen en memoria (los menos usados se descartan)
+CACHE_SIZE = int(os.getenv("TENANT_CACHE_SIZE", "10000"))
+
+# (archivo de base de datos, hash del token) -> id del tenant
+_cache: "OrderedDict[Tuple[str, str], int]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _database_key(db: Session) -> str:
+    # Con DATABASE_SHARDING cada archivo tiene su propia tabla de tokens
+    return str(db.get_bind().engine.url.database)
+
+
+def get_tenant_id(db: Session, token: str) -> int:
+    """
+    Devuelve el id entero del token, registrándolo la primera vez.
+
+    Los ids nunca se reutilizan (AUTOINCREMENT), por lo que pueden cachearse
+    sin invalidación aunque haya varios workers.
+    """
+    token_hash = hash_token(token)
+    key = (_database_key(db), token_hash)
+    with _cache_lock:
+        tenant_id = _cache.get(key)
+        if tenant_id is not None:
+            _cache.move_to_end(key)
+    metrics.record_cache("tenants", tenant_id is not None)
+    if tenant_id is not None:
+        return tenant_id
+
+    lookup = select(database.Tenant.id).where(database.Tenant.token_hash == token_hash)
+    tenant_id = db.execute(lookup).scalar()
+    if tenant_id is None:
+        db.execute(
+            sqlite_insert(database.Tenant)
+            .values(token_hash=token_hash)
+            .on_conflict_do_nothing(index_elements=["token_hash"])
+        )
+        db.commit()
+        tenant_id = db.execute(lookup).scalar()
+
+    with _cache_lock:
+        _cache[key] = tenant_id
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return tenant_id
+
+
+def get_current_tenant(
+    token: str = Depends(get_current_token),
+    db: Session = Depends(database.get_db),
+) -> int:
+    """Dependency: id entero del token Bearer, usado para aislar los datos de cada estudiante."""
+    return get_tenant_id(db, token)
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Script de prueba para los lotes de peticiones (POST /batch)
+Universidad Nacional de Tierra del Fuego
+
+Ejecuta la aplicación en proceso, en un directorio temporal (base de datos y
+uploads propios), así que no necesita un servidor en ejecución.
+"""
+
+import asyncio
+import json
+import os
+import uuid
+
+from fastapi.testclient import TestClient
+
+import ratelimit
+from benchmarks.harness import boot_app
+
+
+def test_atomic_batch_keeps_pictures_on_rollback():
+    print("📦 Probando lotes atómicos con imágenes - UNTDF")
+    print("=" * 50)
+
+    previous_dir = os.getcwd()
+    app, workdir = boot_app()
+    import database
+    try:
+        headers = {"Authorization": f"Bearer test_batch_{uuid.uuid4().hex[:8]}"}
+        with TestClient(app) as client:
+            category = client.post(
+                "/categories/", json={"title": "Lácteos", "description": "Leche y quesos"}, headers=headers
+            ).json()
+            product = client.post(
+                "/products/",
+                json={"title": "Queso", "description": "Queso cremoso", "price": 900, "category_id": category["id"]},
+                headers=headers,
+            ).json()
+            urls = client.post(
+                f"/products/{product['id']}/pictures",
+                files=[("files", ("queso.jpg", b"imagen de prueba", "image/jpeg"))],
+                headers=headers,
+            ).json()["picture_urls"]
+            picture = os.path.join(workdir, "uploads", urls[0].rsplit("/", 1)[-1])
+            assert os.path.exists(picture)
+
+            print("1. Lote que elimina el producto y luego falla...")
+            response = client.post("/batch", json={"requests": [
+                {"method": "DELETE", "path": f"/products/{product['id']}"},
+                {"method": "GET", "path": "/products/999999"},
+            ]}, headers=headers)
+            result = response.json()
+            print(f"   ✅ Respuestas: {[item['status'] for item in result['responses']]}")
+            assert response.status_code == 200
+            assert result["responses"][0]["status"] == 200
+            assert result["committed"] is False
+
+            print("2. El producto y su imagen siguen existiendo...")
+            restored = client.get(f"/products/{product['id']}", headers=headers).json()
+            assert restored["pictures"] == urls
+            assert os.path.exists(picture)
+            print("   ✅ Imagen conservada")
+
+            print("3. Lote confirmado: la imagen se elimina al terminar...")
+            result = client.post("/batch", json={"requests": [
+                {"method": "DELETE", "path": f"/products/{product['id']}"},
+            ]}, headers=headers).json()
+            assert result["committed"] is True
+            assert not os.path.exists(picture)
+            print("   ✅ Imagen eliminada")
+    finally:
+        database.engine.dispose()
+        os.chdir(previous_dir)
+
+    print()
+    print("🎉 ¡Lotes atómicos funcionando!")
+
+
+def test_batch_consumes_one_write_per_request():
+    print("⏱️  Probando el límite de escrituras con lotes - UNTDF")
+
+    received = []
+
+    async def app(scope, receive, send):
+        received.append((await receive())["body"])
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def post_batch(middleware, size):
+        body = json.dumps({"requests": [{"method": "POST", "path": "/tags/"}] * size}).encode()
+        scope = {
+            "type": "http", "method": "POST", "path": "/batch",
+            "headers": [(b"authorization", b"Bearer test_batch_limits")],
+        }
+        sent = []
+
+        async def receive():
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        async def send(message):
+            sent.append(message)
+
+        await middleware(scope, receive, send)
+        return sent[0]["status"], body
+
+    middleware = ratelimit.RateLimitMiddleware(app, ratelimit.MemoryBackend())
+    previous_limit = ratelimit.LIMITS["write"]
+    ratelimit.LIMITS["write"] = ratelimit.Limit(10, 60, 0)
+    try:
+        status, body = asyncio.run(post_batch(middleware, 8))
+        assert status == 200 and received == [body]
+        # Quedan 2 escrituras: un lote de 3 se rechaza
+        status, _ = asyncio.run(post_batch(middleware, 3))
+        assert status == 429
+        print("   ✅ Cada sub-petición descuenta una escritura")
+    finally:
+        ratelimit.LIMITS["write"] = previous_limit
+
+
+if __name__ == "__main__":
+    test_atomic_batch_keeps_pictures_on_rollback()
+    test_batch_consumes_one_write_per_request()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Script de prueba para el árbol de categorías (tabla category_closure)
+Universidad Nacional de Tierra del Fuego
+
+Crea, mueve y elimina categorías en un orden aleatorio (con semilla fija) y,
+después de cada operación, compara la tabla de clausura mantenida
+incrementalmente con la que se obtiene recorriendo `parent_id` desde cero.
+Ejecuta la aplicación en proceso, en un directorio temporal.
+"""
+
+import os
+import random
+import uuid
+
+from benchmarks.harness import boot_app
+
+OPERATIONS = 300
+
+
+def closure_rows(db, category_ids):
+    import database
+    closure = database.CategoryClosure
+    return sorted(
+        db.query(closure.ancestor_id, closure.descendant_id, closure.depth)
+        .filter(closure.descendant_id.in_(category_ids) | closure.ancestor_id.in_(category_ids))
+        .all()
+    )
+
+
+def rebuilt_closure_rows(db, tenant_id):
+    """Todos los pares (ancestro, descendiente, profundidad), subiendo por parent_id"""
+    import database
+    parents = dict(
+        db.query(database.Category.id, database.Category.parent_id)
+        .filter(database.Category.tenant_id == tenant_id)
+    )
+    rows = []
+    for category_id in parents:
+        ancestor_id, depth = category_id, 0
+        while ancestor_id is not None:
+            rows.append((ancestor_id, category_id, depth))
+            ancestor_id, depth = parents[ancestor_id], depth + 1
+    return sorted(rows)
+
+
+def apply_random_operation(db, crud, schemas, tenant_id, rng):
+    import database
+    categories = [
+        row.id for row in db.query(database.Category.id).filter(database.Category.tenant_id == tenant_id)
+    ]
+    operation = rng.choice(["create", "create", "move", "move", "delete"])
+
+    if operation == "create" or len(categories) < 2:
+        parent_id = rng.choice([None, *categories])
+        category = crud.create_category(
+            db, schemas.CategoryCreate(title=f"Categoría {uuid.uuid4().hex[:6]}", description="d", parent_id=parent_id),
+            tenant_id,
+        )
+        return "create", category.id
+    if operation == "move":
+        category_id = rng.choice(categories)
+        # Igual que la API: no se mueve dentro de su propio subárbol
+        parents = [
+            parent_id for parent_id in categories
+            if not crud.is_in_category_subtree(db, root_id=category_id, category_id=parent_id)
+        ]
+        parent_id = rng.choice([None, *parents])
+        crud.update_category(db, category_id, schemas.CategoryUpdate(parent_id=parent_id), tenant_id)
+        return "move", category_id
+    crud.delete_category(db, rng.choice(categories), tenant_id)
+    return "delete", None
+
+
+def test_incremental_closure_matches_rebuild():
+    print("🌳 Probando el árbol de categorías - UNTDF")
+    print("=" * 50)
+
+    previous_dir = os.getcwd()
+    app, workdir = boot_app()
+    import crud
+    import database
+    import schemas
+    import tenants
+    try:
+        rng = random.Random(50)
+        token = f"test_categories_{uuid.uuid4().hex[:8]}"
+        applied = {}
+        created = set()
+        deepest = 0
+        with database.get_session(token) as db:
+            tenant_id = tenants.get_tenant_id(db, token)
+            for step in range(OPERATIONS):
+                operation, category_id = apply_random_operation(db, crud, schemas, tenant_id, rng)
+                applied[operation] = applied.get(operation, 0) + 1
+                if category_id is not None:
+                    created.add(category_id)
+                incremental = closure_rows(db, created)
+                rebuilt = rebuilt_closure_rows(db, tenant_id)
+                assert incremental == rebuilt, f"paso {step} ({operation}): la clausura difiere de la reconstrucción"
+                deepest = max([deepest] + [depth for _, _, depth in rebuilt])
+
+            # La ruta de la categoría más profunda va de la raíz hasta ella
+            category_id = max(rebuilt, key=lambda row: row[2])[1]
+            path = [category.id for category in crud.get_category_path(db, tenant_id=tenant_id, category_id=category_id)]
+            expected = sorted((row for row in rebuilt if row[1] == category_id), key=lambda row: -row[2])
+            assert path == [ancestor_id for ancestor_id, _, _ in expected]
+        print(f"   ✅ Operaciones: {applied}")
+        print(f"   ✅ Profundidad máxima alcanzada: {deepest}")
+    finally:
+        database.engine.dispose()
+        os.chdir(previous_dir)
+
+    print()
+    print("🎉 ¡La clausura incremental coincide con la reconstrucción!")
+
+
+if __name__ == "__main__":
+    test_incremental_closure_matches_rebuild()
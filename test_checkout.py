@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Script de prueba para la confirmación de compras (POST /carts/{id}/checkout)
+Universidad Nacional de Tierra del Fuego
+
+Ejecuta la aplicación en proceso, en un directorio temporal (base de datos y
+uploads propios), así que no necesita un servidor en ejecución.
+"""
+
+import asyncio
+import os
+import uuid
+
+import ratelimit
+from benchmarks.harness import auth, boot_app, make_client
+
+STOCK = 10
+CARTS = 25
+
+
+async def concurrent_checkouts(app, headers):
+    async with make_client(app=app) as client:
+        category = (await client.post(
+            "/categories/", json={"title": "Lácteos", "description": "Leche y quesos"}, headers=headers
+        )).json()
+        product = (await client.post(
+            "/products/",
+            json={"title": "Queso", "description": "Queso cremoso", "price": 900,
+                  "category_id": category["id"], "stock": STOCK},
+            headers=headers,
+        )).json()
+
+        cart_ids = []
+        for _ in range(CARTS):
+            cart = (await client.post("/carts/", headers=headers)).json()
+            await client.put(f"/carts/{cart['id']}/items/{product['id']}", json={"quantity": 1}, headers=headers)
+            cart_ids.append(cart["id"])
+
+        print(f"1. {CARTS} compras simultáneas de un producto con stock {STOCK}...")
+        responses = await asyncio.gather(*(
+            client.post(f"/carts/{cart_id}/checkout", headers=headers) for cart_id in cart_ids
+        ))
+        statuses = [response.status_code for response in responses]
+        print(f"   ✅ Confirmadas: {statuses.count(200)}, sin stock: {statuses.count(409)}")
+        assert sorted(set(statuses)) == [200, 409]
+        assert statuses.count(200) == STOCK
+        for response in responses:
+            if response.status_code == 409:
+                assert response.json() == {"detail": "Stock insuficiente", "product_ids": [product["id"]]}
+
+        print("2. El stock no queda negativo y coincide con los pedidos...")
+        remaining = (await client.get(f"/products/{product['id']}", headers=headers)).json()["stock"]
+        orders = (await client.get("/orders/", headers=headers)).json()
+        assert remaining == 0
+        assert len(orders) == STOCK
+        assert sum(item["quantity"] for order in orders for item in order["items"]) == STOCK
+        # Los carritos rechazados siguen abiertos; los confirmados liberaron su cuota
+        usage = (await client.get("/usage", headers=headers)).json()["usage"]
+        assert usage["carts"] == CARTS - STOCK
+        print(f"   ✅ Stock restante: {remaining}, pedidos: {len(orders)}")
+
+        print("3. Un carrito con un producto sin stock no cambia nada...")
+        other = (await client.post(
+            "/products/",
+            json={"title": "Manteca", "description": "Manteca", "price": 500,
+                  "category_id": category["id"], "stock": 3},
+            headers=headers,
+        )).json()
+        cart_id = next(cart_id for cart_id, response in zip(cart_ids, responses) if response.status_code == 409)
+        await client.put(f"/carts/{cart_id}/items/{other['id']}", json={"quantity": 2}, headers=headers)
+        response = await client.post(f"/carts/{cart_id}/checkout", headers=headers)
+        assert response.status_code == 409
+        assert response.json()["product_ids"] == [product["id"]]
+        assert (await client.get(f"/products/{other['id']}", headers=headers)).json()["stock"] == 3
+        cart = (await client.get(f"/carts/{cart_id}", headers=headers)).json()
+        assert [item["product_id"] for item in cart["items"]] == sorted([product["id"], other["id"]])
+        print("   ✅ El carrito y el stock quedaron como estaban")
+
+
+def test_concurrent_checkouts_never_oversell():
+    print("🛒 Probando compras simultáneas - UNTDF")
+    print("=" * 50)
+
+    previous_dir = os.getcwd()
+    app, workdir = boot_app()
+    import crud
+    import database
+    previous_quota = crud.QUOTAS["carts"]
+    crud.QUOTAS["carts"] = CARTS
+    # Las compras simultáneas no deben chocar con el límite de peticiones por token
+    previous_limits = dict(ratelimit.LIMITS)
+    for kind in ("read", "write"):
+        ratelimit.LIMITS[kind] = ratelimit.Limit(10_000, 60, 0)
+    try:
+        asyncio.run(concurrent_checkouts(app, auth(f"test_checkout_{uuid.uuid4().hex[:8]}")))
+    finally:
+        crud.QUOTAS["carts"] = previous_quota
+        ratelimit.LIMITS.update(previous_limits)
+        database.engine.dispose()
+        os.chdir(previous_dir)
+
+    print()
+    print("🎉 ¡Nunca se vende más de lo disponible!")
+
+
+if __name__ == "__main__":
+    test_concurrent_checkouts_never_oversell()
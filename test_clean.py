@@ -126,5 +126,38 @@ def test_clean_functionality():
     except Exception as e:
         print(f"❌ Error inesperado: {e}")
 
+def test_clean_then_create_tagged_product():
+    """Después de /clean los ids se reutilizan: no deben quedar relaciones producto-etiqueta viejas."""
+    from fastapi.testclient import TestClient
+    from benchmarks.harness import boot_app
+    
+    previous_dir = os.getcwd()
+    app, _ = boot_app()
+    import database
+    try:
+        os.environ["ADMIN_TOKEN"] = "test_clean_admin"
+        headers = {"Authorization": "Bearer test_clean_tags"}
+        with TestClient(app) as client:
+            def create_tagged_product():
+                category = client.post("/categories/", json={"title": "Lácteos", "description": "Leche"}, headers=headers).json()
+                tag = client.post("/tags/", json={"title": "Oferta"}, headers=headers).json()
+                return client.post("/products/", json={
+                    "title": "Queso", "description": "Queso cremoso", "price": 900,
+                    "category_id": category["id"], "tag_ids": [tag["id"]],
+                }, headers=headers)
+            
+            assert create_tagged_product().status_code == 200
+            response = client.post("/clean", headers={"Authorization": "Bearer test_clean_admin"})
+            assert response.status_code == 200
+            
+            response = create_tagged_product()
+            assert response.status_code == 200, response.text
+            assert [tag["title"] for tag in response.json()["tags"]] == ["Oferta"]
+            print("✅ Producto con etiquetas creado después de la limpieza")
+    finally:
+        database.engine.dispose()
+        os.chdir(previous_dir)
+
 if __name__ == "__main__":
     test_clean_functionality()
+    test_clean_then_create_tagged_product()
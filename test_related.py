@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Script de prueba para el índice de productos relacionados
+Universidad Nacional de Tierra del Fuego
+
+Aplica altas, cambios de etiquetas, cambios de categoría y bajas en un orden
+aleatorio (con semilla fija) y, después de cada operación, compara el índice
+mantenido incrementalmente con el que se obtiene al reconstruirlo desde cero.
+Ejecuta la aplicación en proceso, en un directorio temporal.
+"""
+
+import os
+import random
+import uuid
+
+from benchmarks.harness import boot_app
+
+OPERATIONS = 200
+
+
+def related_rows(db, tenant_id):
+    import database
+    return sorted(
+        db.query(database.RelatedProduct.product_id, database.RelatedProduct.related_id, database.RelatedProduct.score)
+        .join(database.Product, database.Product.id == database.RelatedProduct.product_id)
+        .filter(database.Product.tenant_id == tenant_id)
+        .all()
+    )
+
+
+def apply_random_operation(db, crud, schemas, tenant_id, rng):
+    import database
+    # Otras pruebas del mismo proceso pueden haber dejado datos de otros tokens
+    categories = [row.id for row in db.query(database.Category.id).filter(database.Category.tenant_id == tenant_id)]
+    tags = [row.id for row in db.query(database.Tag.id).filter(database.Tag.tenant_id == tenant_id)]
+    products = [row.id for row in db.query(database.Product.id).filter(database.Product.tenant_id == tenant_id)]
+    operation = rng.choice([
+        "create", "create", "retag", "tag_delta", "move", "delete_product", "delete_tag", "delete_category",
+    ])
+
+    if operation == "create" or not products:
+        if not categories or rng.random() < 0.1:
+            title = f"Categoría {uuid.uuid4().hex[:6]}"
+            crud.create_category(db, schemas.CategoryCreate(title=title, description="d"), tenant_id)
+            return "create_category"
+        if len(tags) < 3 or rng.random() < 0.15:
+            crud.create_tag(db, schemas.TagCreate(title=f"Etiqueta {uuid.uuid4().hex[:6]}"), tenant_id)
+            return "create_tag"
+        crud.create_product(db, schemas.ProductCreate(
+            title=f"Producto {uuid.uuid4().hex[:6]}", description="d", price=10,
+            category_id=rng.choice(categories), tag_ids=rng.sample(tags, rng.randint(0, 3)),
+        ), tenant_id)
+    elif operation == "retag":
+        tag_ids = rng.sample(tags, rng.randint(0, min(3, len(tags))))
+        crud.update_product(db, rng.choice(products), schemas.ProductUpdate(tag_ids=tag_ids), tenant_id)
+    elif operation == "tag_delta" and tags:
+        chosen = rng.sample(products, rng.randint(1, min(4, len(products))))
+        split = rng.randint(0, len(chosen))
+        crud.update_tag_products(db, tenant_id, rng.choice(tags), add=chosen[:split], remove=chosen[split:])
+    elif operation == "move" and categories:
+        crud.update_product(db, rng.choice(products), schemas.ProductUpdate(category_id=rng.choice(categories)), tenant_id)
+    elif operation == "delete_product":
+        crud.delete_product(db, rng.choice(products), tenant_id)
+    elif operation == "delete_tag" and len(tags) > 3:
+        crud.delete_tag(db, rng.choice(tags), tenant_id)
+    elif operation == "delete_category" and len(categories) > 1:
+        crud.delete_category(db, rng.choice(categories), tenant_id)
+    else:
+        return None
+    return operation
+
+
+def test_incremental_index_matches_rebuild():
+    print("🔗 Probando el índice de productos relacionados - UNTDF")
+    print("=" * 50)
+
+    previous_dir = os.getcwd()
+    app, workdir = boot_app()
+    import crud
+    import database
+    import schemas
+    import tenants
+    # Listas cortas: así las altas y bajas también desplazan entradas del top-K
+    previous_top_k = crud.RELATED_TOP_K
+    crud.RELATED_TOP_K = 3
+    try:
+        rng = random.Random(48)
+        token = f"test_related_{uuid.uuid4().hex[:8]}"
+        applied = {}
+        with database.get_session(token) as db:
+            tenant_id = tenants.get_tenant_id(db, token)
+            for step in range(OPERATIONS):
+                operation = apply_random_operation(db, crud, schemas, tenant_id, rng)
+                if operation is None:
+                    continue
+                applied[operation] = applied.get(operation, 0) + 1
+                incremental = related_rows(db, tenant_id)
+                crud.rebuild_related_index(db)
+                rebuilt = related_rows(db, tenant_id)
+                assert incremental == rebuilt, f"paso {step} ({operation}): el índice difiere de la reconstrucción"
+            assert rebuilt, "ningún producto quedó relacionado con otro"
+        print(f"   ✅ Operaciones: {applied}")
+        print(f"   ✅ Pares en el índice al final: {len(rebuilt)}")
+    finally:
+        crud.RELATED_TOP_K = previous_top_k
+        database.engine.dispose()
+        os.chdir(previous_dir)
+
+    print()
+    print("🎉 ¡El índice incremental coincide con la reconstrucción!")
+
+
+if __name__ == "__main__":
+    test_incremental_index_matches_rebuild()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Script de prueba para los backends de almacenamiento de imágenes
+Universidad Nacional de Tierra del Fuego
+
+Por defecto prueba el almacenamiento local en un directorio temporal.
+Para probar el backend S3 contra MinIO:
+
+    docker run -p 9000:9000 -e MINIO_ROOT_USER=minio -e MINIO_ROOT_PASSWORD=minio123 \\
+        minio/minio server /data
+    STORAGE_BACKEND=s3 S3_BUCKET=uploads S3_ENDPOINT_URL=http://localhost:9000 \\
+        S3_ACCESS_KEY_ID=minio S3_SECRET_ACCESS_KEY=minio123 python test_storage.py
+
+(el bucket debe existir previamente)
+"""
+
+import io
+import os
+import tempfile
+
+import storage
+
+
+def test_storage_backend():
+    print("🗄️  Probando backend de almacenamiento - UNTDF")
+    print("=" * 50)
+
+    if os.getenv("STORAGE_BACKEND", "local").lower() == "local":
+        backend = storage.LocalStorage(tempfile.mkdtemp(prefix="uploads-test-"))
+    else:
+        backend = storage.create_storage()
+    print(f"Backend: {type(backend).__name__}")
+
+    content = os.urandom(200_000)
+
+    print("1. Guardando archivo por bloques...")
+    written = backend.save("test_storage_demo.jpg", io.BytesIO(content))
+    print(f"   ✅ Bytes escritos: {written}")
+    assert written == len(content)
+
+    print("2. Leyendo archivo...")
+    read_back = b"".join(backend.open("test_storage_demo.jpg"))
+    print(f"   ✅ Bytes leídos: {len(read_back)}")
+    assert read_back == content
+
+    print("3. Listando archivos...")
+    names = {stored.name: stored.size for stored in backend.list()}
+    print(f"   ✅ Archivos: {len(names)}")
+    assert names.get("test_storage_demo.jpg") == len(content)
+
+    print("4. URL pública y URL prefirmada...")
+    print(f"   📄 URL: {backend.url('test_storage_demo.jpg')}")
+    print(f"   📄 Prefirmada: {backend.presigned_url('test_storage_demo.jpg')}")
+
+    print("5. Eliminando archivo...")
+    freed = backend.delete("test_storage_demo.jpg")
+    print(f"   ✅ Bytes liberados: {freed}")
+    assert freed == len(content)
+    assert backend.delete("test_storage_demo.jpg") == 0
+
+    print("6. Rechazando nombres inválidos...")
+    try:
+        backend.save("../fuera.jpg", io.BytesIO(b"x"))
+        raise AssertionError("Se aceptó un nombre fuera del almacenamiento")
+    except ValueError:
+        print("   ✅ Nombre inválido rechazado")
+
+    print()
+    print("🎉 ¡Backend de almacenamiento funcionando!")
+
+
+def test_gc_keeps_precompressed_copies():
+    print("🧹 Probando el recolector de huérfanos con copias precomprimidas - UNTDF")
+
+    from benchmarks.harness import boot_app
+
+    previous_dir = os.getcwd()
+    boot_app()
+    import cleaner
+    import database
+    try:
+        # El backend local puede haberse creado en otro directorio (otra prueba del mismo proceso)
+        os.makedirs("uploads", exist_ok=True)
+        backend = storage.get_storage()
+        for name in ("a_1234.svg", "a_1234.svg.br", "a_1234.svg.gz", "huerfano_1234.svg", "huerfano_1234.svg.br"):
+            backend.save(name, io.BytesIO(b"<svg/>"))
+        with database.SessionLocal() as db:
+            db.add(database.Category(title="Con imagen", description="d", tenant_id=1, picture=backend.url("a_1234.svg")))
+            db.commit()
+
+            cleaner._gc_cursor = None
+            stats = cleaner.collect_orphaned_files(db, min_age=0)
+
+        remaining = {stored.name for stored in backend.list()}
+        print(f"   ✅ Archivos conservados: {sorted(remaining)}")
+        assert {"a_1234.svg", "a_1234.svg.br", "a_1234.svg.gz"} <= remaining
+        assert not {"huerfano_1234.svg", "huerfano_1234.svg.br"} & remaining
+        assert stats["orphans_deleted"] == 2
+    finally:
+        database.engine.dispose()
+        os.chdir(previous_dir)
+
+
+if __name__ == "__main__":
+    test_storage_backend()
+    test_gc_keeps_precompressed_copies()